@@ -0,0 +1,79 @@
+"""Compact binary encoding for time-series responses.
+
+Sent when a client's Accept header names ``application/vnd.energy.columnar``.
+The body is a 8-byte stream header followed by any number of blocks, all
+little-endian::
+
+    header: b"EMCB" | version u16 | reserved u16
+    block:  id length u16 | device id (utf-8) | zero padding to 8 bytes
+            | point count u32 | reserved u32
+            | timestamps int64[count] (epoch ms)
+            | values float32[count] | zero padding to 8 bytes
+
+A device may span several consecutive blocks (streamed chunk by chunk);
+clients concatenate blocks that share a device id.
+"""
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import struct
+import numpy as np
+
+COLUMNAR_MEDIA_TYPE = "application/vnd.energy.columnar"
+MAGIC = b"EMCB"
+VERSION = 1
+STREAM_HEADER = struct.Struct("<4sHH")
+ID_HEADER = struct.Struct("<H")
+COUNT_HEADER = struct.Struct("<I4x")
+
+def wants_columnar(request: Request) -> bool:
+    return COLUMNAR_MEDIA_TYPE in request.headers.get("accept", "")
+
+def _pad(length: int) -> bytes:
+    return b"\0" * (-length % 8)
+
+def encode_block(device_id: str, timestamps: np.ndarray, values: np.ndarray) -> bytes:
+    key = device_id.encode("utf-8")
+    head = ID_HEADER.pack(len(key)) + key
+    body = np.asarray(values, dtype="<f4").tobytes()
+    return b"".join((
+        head, _pad(len(head)),
+        COUNT_HEADER.pack(len(timestamps)),
+        np.asarray(timestamps, dtype="<i8").tobytes(),
+        body, _pad(len(body)),
+    ))
+
+def encode_stream(blocks: Iterable[Tuple[str, np.ndarray, np.ndarray]]) -> Iterator[bytes]:
+    """Yield the stream header and then one encoded block per (device_id, timestamps, values)"""
+    yield STREAM_HEADER.pack(MAGIC, VERSION, 0)
+    for device_id, timestamps, values in blocks:
+        yield encode_block(device_id, timestamps, values)
+
+def columnar_response(blocks: Iterable[Tuple[str, np.ndarray, np.ndarray]],
+                      headers: Optional[Dict[str, str]] = None) -> StreamingResponse:
+    return StreamingResponse(encode_stream(blocks), media_type=COLUMNAR_MEDIA_TYPE, headers=headers)
+
+def decode(data: bytes) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+    """Decode a columnar body into {device_id: (timestamps, values)}"""
+    magic, version, _ = STREAM_HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a columnar energy-data body")
+    parts: Dict[str, List[Tuple[np.ndarray, np.ndarray]]] = {}
+    pos = STREAM_HEADER.size
+    while pos < len(data):
+        (key_len,) = ID_HEADER.unpack_from(data, pos)
+        device_id = data[pos + 2:pos + 2 + key_len].decode("utf-8")
+        pos += 2 + key_len
+        pos += -pos % 8
+        (count,) = COUNT_HEADER.unpack_from(data, pos)
+        pos += COUNT_HEADER.size
+        timestamps = np.frombuffer(data, dtype="<i8", count=count, offset=pos)
+        pos += 8 * count
+        values = np.frombuffer(data, dtype="<f4", count=count, offset=pos)
+        pos += 4 * count
+        pos += -pos % 8
+        parts.setdefault(device_id, []).append((timestamps, values))
+    return {
+        device_id: (np.concatenate([t for t, _ in blocks]), np.concatenate([v for _, v in blocks]))
+        for device_id, blocks in parts.items()
+    }
@@ -0,0 +1,25 @@
+"""Opaque keyset cursors.
+
+A cursor is the sort key of the last row on a page, JSON-encoded and wrapped
+in URL-safe base64 so clients treat it as a token rather than something to
+build themselves. The next page seeks past that key instead of using OFFSET.
+"""
+from fastapi import HTTPException, status
+import base64
+import binascii
+import json
+
+def encode_cursor(*key) -> str:
+    raw = json.dumps(key, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str, *types) -> tuple:
+    """Decode a cursor whose key has one element of each of `types`, or raise a 400"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        key = json.loads(raw)
+        if not isinstance(key, list) or len(key) != len(types):
+            raise ValueError
+        return tuple(kind(part) for kind, part in zip(types, key))
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
@@ -0,0 +1,66 @@
+from app.core.config import settings
+from collections import OrderedDict
+from typing import Dict, Hashable, NamedTuple, Optional
+import threading
+
+class CachedResponse(NamedTuple):
+    etag: str
+    body: bytes
+    media_type: str
+    headers: Dict[str, str]
+
+class ResponseCache:
+    """LRU of rendered response bodies, bounded by their total size in bytes.
+
+    Entries are stored with the ETag they were rendered for; a lookup only
+    hits when the caller's freshly computed ETag still matches, so a stale
+    entry is simply replaced the next time its key is rendered.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        # Single bodies above this are served but not kept, so one export can't flush the cache
+        self.max_entry_bytes = max_bytes // 4
+        self._entries: "OrderedDict[Hashable, CachedResponse]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, etag: str) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.etag != etag:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: Hashable, entry: CachedResponse):
+        if len(entry.body) > self.max_entry_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= len(old.body)
+            self._entries[key] = entry
+            self.bytes += len(entry.body)
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= len(evicted.body)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+response_cache = ResponseCache(max_bytes=settings.RESPONSE_CACHE_MAX_BYTES)
@@ -0,0 +1,203 @@
+from app.db.rollups import ROLLUP_TIERS
+from typing import List, Optional, Tuple
+import re
+import numpy as np
+
+AGGREGATES = ("sum", "mean", "min", "max", "p95")
+# Aggregates that can be recombined from rollup rows
+ROLLUP_AGGREGATES = ("sum", "mean", "min", "max")
+
+WINDOW_UNITS = {"s": 1_000, "m": 60_000, "h": 3_600_000, "d": 86_400_000}
+# Candidate windows when the caller doesn't pick one, smallest first
+AUTO_WINDOWS = ("1m", "5m", "15m", "1h", "6h", "1d", "7d")
+
+def parse_window(window: str) -> int:
+    """Parse a window like "30s", "15m", "1h" or "7d" into milliseconds"""
+    match = re.fullmatch(r"(\d+)([smhd])", window.strip())
+    if not match or int(match.group(1)) == 0:
+        raise ValueError(f"Invalid window: {window!r}")
+    return int(match.group(1)) * WINDOW_UNITS[match.group(2)]
+
+def format_window(window: int) -> str:
+    """Inverse of parse_window, using the largest unit that divides the window"""
+    for unit, width in sorted(WINDOW_UNITS.items(), key=lambda item: -item[1]):
+        if window % width == 0:
+            return f"{window // width}{unit}"
+    return f"{window / 1000:g}s"
+
+def auto_window(start: int, end: int, max_points: int) -> int:
+    """Smallest candidate window that keeps a range under max_points buckets"""
+    for window in AUTO_WINDOWS:
+        width = parse_window(window)
+        if (end - start) // width < max_points:
+            return width
+    return parse_window(AUTO_WINDOWS[-1])
+
+def choose_tier(window: int, agg: str) -> Optional[str]:
+    """Coarsest rollup tier that tiles `window` exactly, or None to use raw points"""
+    if agg not in ROLLUP_AGGREGATES:
+        return None
+    best = None
+    for tier, width in ROLLUP_TIERS.items():
+        if width <= window and window % width == 0 and (best is None or width > ROLLUP_TIERS[best]):
+            best = tier
+    return best
+
+def _groups(buckets: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Start index and size of each run of equal values in a sorted array"""
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    counts = np.diff(np.r_[starts, len(buckets)])
+    return starts, counts
+
+def _percentile(keys: np.ndarray, values: np.ndarray, starts: np.ndarray, counts: np.ndarray,
+                q: float) -> np.ndarray:
+    """Linearly interpolated q-quantile of each run of equal (sorted) keys"""
+    # Sort values within each group, then interpolate at rank q * (n - 1)
+    ordered = values[np.lexsort((values, keys))]
+    rank = q * (counts - 1)
+    lower = np.floor(rank).astype(np.int64)
+    upper = np.minimum(lower + 1, counts - 1)
+    frac = rank - lower
+    return ordered[starts + lower] * (1 - frac) + ordered[starts + upper] * frac
+
+def aggregate(timestamps: np.ndarray, values: np.ndarray, window: int, agg: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Aggregate time-sorted raw points into epoch-aligned windows"""
+    if not len(timestamps):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+    buckets = timestamps // window * window
+    starts, counts = _groups(buckets)
+
+    if agg == "sum":
+        result = np.add.reduceat(values, starts)
+    elif agg == "mean":
+        result = np.add.reduceat(values, starts) / counts
+    elif agg == "min":
+        result = np.minimum.reduceat(values, starts)
+    elif agg == "max":
+        result = np.maximum.reduceat(values, starts)
+    elif agg == "p95":
+        result = _percentile(buckets, values, starts, counts, 0.95)
+    else:
+        raise ValueError(f"Unknown aggregate: {agg}")
+    return buckets[starts], result
+
+def aggregate_rollup(rows: dict, window: int, agg: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Recombine rollup rows (whose width divides `window`) into windows"""
+    if not len(rows["bucket"]):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+    buckets = rows["bucket"] // window * window
+    starts, _ = _groups(buckets)
+
+    if agg == "sum":
+        result = np.add.reduceat(rows["sum"], starts)
+    elif agg == "mean":
+        result = np.add.reduceat(rows["sum"], starts) / np.add.reduceat(rows["count"], starts)
+    elif agg == "min":
+        result = np.minimum.reduceat(rows["min"], starts)
+    elif agg == "max":
+        result = np.maximum.reduceat(rows["max"], starts)
+    else:
+        raise ValueError(f"Aggregate {agg} cannot be computed from rollups")
+    return buckets[starts], result
+
+def query_series(client, device_id: str, start: int, end: int, window: Optional[int],
+                 agg: str) -> Tuple[np.ndarray, np.ndarray, str]:
+    """Read one device's series in [start, end], aggregated if `window` is set.
+
+    Returns (timestamps, values, source) where source is "raw" or the rollup
+    tier that served the query.
+    """
+    if window is None:
+        timestamps, values = client.query(device_id, start, end)
+        return timestamps, values, "raw"
+
+    # Widen the range to whole windows so raw and rollup reads cover the same points
+    start = start // window * window
+    end = (end // window + 1) * window - 1
+
+    tier = choose_tier(window, agg)
+    if tier is not None:
+        timestamps, values = aggregate_rollup(client.query_rollup(device_id, tier, start, end), window, agg)
+        return timestamps, values, tier
+
+    timestamps, values = client.query(device_id, start, end)
+    timestamps, values = aggregate(timestamps, values, window, agg)
+    return timestamps, values, "raw"
+
+def _fill(shape: Tuple[int, int], cells: np.ndarray, result: np.ndarray) -> np.ndarray:
+    matrix = np.full(shape[0] * shape[1], np.nan)
+    matrix[cells] = result
+    return matrix.reshape(shape)
+
+def aggregate_matrix(index: np.ndarray, timestamps: np.ndarray, values: np.ndarray, n_series: int,
+                     grid_start: int, n_buckets: int, window: int, agg: str) -> np.ndarray:
+    """Aggregate raw points of many series onto one window grid in a single pass.
+
+    `index` gives each point's series; the result is an (n_series, n_buckets)
+    matrix with NaN for empty cells.
+    """
+    shape = (n_series, n_buckets)
+    if not len(timestamps):
+        return np.full(shape, np.nan)
+    flat = index * n_buckets + (timestamps - grid_start) // window
+    # Series are read in time order one after another, so flat cell ids are already sorted
+    starts, counts = _groups(flat)
+    cells = flat[starts]
+
+    if agg == "sum":
+        result = np.add.reduceat(values, starts)
+    elif agg == "mean":
+        result = np.add.reduceat(values, starts) / counts
+    elif agg == "min":
+        result = np.minimum.reduceat(values, starts)
+    elif agg == "max":
+        result = np.maximum.reduceat(values, starts)
+    elif agg == "p95":
+        result = _percentile(flat, values, starts, counts, 0.95)
+    else:
+        raise ValueError(f"Unknown aggregate: {agg}")
+    return _fill(shape, cells, result)
+
+def aggregate_rollup_matrix(index: np.ndarray, rows: dict, n_series: int, grid_start: int, n_buckets: int,
+                            window: int, agg: str) -> np.ndarray:
+    """Recombine rollup rows of many series onto one window grid"""
+    shape = (n_series, n_buckets)
+    if not len(rows["bucket"]):
+        return np.full(shape, np.nan)
+    flat = index * n_buckets + (rows["bucket"] - grid_start) // window
+    starts, _ = _groups(flat)
+    cells = flat[starts]
+
+    if agg == "sum":
+        result = np.add.reduceat(rows["sum"], starts)
+    elif agg == "mean":
+        result = np.add.reduceat(rows["sum"], starts) / np.add.reduceat(rows["count"], starts)
+    elif agg == "min":
+        result = np.minimum.reduceat(rows["min"], starts)
+    elif agg == "max":
+        result = np.maximum.reduceat(rows["max"], starts)
+    else:
+        raise ValueError(f"Aggregate {agg} cannot be computed from rollups")
+    return _fill(shape, cells, result)
+
+def query_matrix(client, device_ids: List[str], start: int, end: int, window: int,
+                 agg: str) -> Tuple[np.ndarray, np.ndarray, str]:
+    """Aggregate many devices onto a shared window grid covering [start, end].
+
+    Returns (bucket_starts, matrix, source) where matrix has one row per
+    device and one column per bucket.
+    """
+    grid_start = start // window * window
+    grid_end = (end // window + 1) * window - 1
+    n_buckets = (grid_end + 1 - grid_start) // window
+    grid = grid_start + window * np.arange(n_buckets, dtype=np.int64)
+
+    tier = choose_tier(window, agg)
+    if tier is not None:
+        index, rows = client.query_rollup_many(device_ids, tier, grid_start, grid_end)
+        matrix = aggregate_rollup_matrix(index, rows, len(device_ids), grid_start, n_buckets, window, agg)
+        return grid, matrix, tier
+
+    index, timestamps, values = client.query_many(device_ids, grid_start, grid_end)
+    matrix = aggregate_matrix(index, timestamps, values, len(device_ids), grid_start, n_buckets, window, agg)
+    return grid, matrix, "raw"
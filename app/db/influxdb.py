@@ -1,17 +1,766 @@
 from app.core.config import settings
+from app.db.rollups import ROLLUP_FIELDS, ROLLUP_TIERS, Rollup, empty_rollup
+from app.db.segments import (
+    Segment, WriteAheadLog, read_manifest, save_rollups, write_manifest, write_segment
+)
+from bisect import bisect_right
+from datetime import datetime
+from threading import Event, Lock, RLock, Thread
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 import logging
+import math
+import os
+import time
+import numpy as np
 
 logger = logging.getLogger("influxdb")
 
-# Mock InfluxDB client for development
+DEFAULT_MEASUREMENT = "energy_consumption"
+INT64_MIN = -2**63
+INT64_MAX = 2**63 - 1
+
+def to_epoch_ms(value) -> int:
+    """Normalise a point timestamp (epoch ms, datetime or ISO string) to epoch milliseconds.
+
+    Raises ValueError for anything else, including numbers that don't fit the
+    store's int64 timestamp column.
+    """
+    if isinstance(value, (int, np.integer)):
+        ms = int(value)
+    elif isinstance(value, (float, np.floating)):
+        if not math.isfinite(value):
+            raise ValueError(f"Unsupported timestamp: {value!r}")
+        ms = int(round(value))
+    else:
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value)
+        if not isinstance(value, datetime):
+            raise ValueError(f"Unsupported timestamp: {value!r}")
+        ms = int(round(value.timestamp() * 1000))
+    if not INT64_MIN <= ms <= INT64_MAX:
+        raise ValueError(f"Timestamp out of range: {value!r}")
+    return ms
+
+def from_epoch_ms(value: int) -> datetime:
+    return datetime.fromtimestamp(int(value) / 1000)
+
+class Chunk:
+    """Block of time-sorted timestamp/value columns.
+
+    A chunk takes appends until it is full or closed. Closed chunks are never
+    modified in place: a late insert swaps in new arrays (copy-on-write), which
+    lets sealed chunks be served straight from a read-only segment mmap.
+    """
+
+    __slots__ = ("timestamps", "values", "size", "closed", "dirty", "mapped", "block")
+
+    def __init__(self, capacity: int):
+        self.timestamps = np.empty(capacity, dtype=np.int64)
+        self.values = np.empty(capacity, dtype=np.float64)
+        self.size = 0
+        self.closed = False
+        # Contents differ from the last persisted image (or have none yet)
+        self.dirty = True
+        # Arrays are views over a segment mmap rather than heap memory
+        self.mapped = False
+        # (segment name, offset, count) of the last persisted image
+        self.block: Optional[Tuple[str, int, int]] = None
+
+    @classmethod
+    def sealed(cls, timestamps: np.ndarray, values: np.ndarray, block: Tuple[str, int, int]) -> "Chunk":
+        chunk = cls(0)
+        chunk.timestamps, chunk.values = timestamps, values
+        chunk.size = len(timestamps)
+        chunk.closed = True
+        chunk.dirty = False
+        chunk.mapped = True
+        chunk.block = block
+        return chunk
+
+    @classmethod
+    def frozen(cls, timestamps: np.ndarray, values: np.ndarray) -> "Chunk":
+        """Closed heap chunk that still has to be persisted"""
+        chunk = cls(0)
+        chunk.timestamps, chunk.values = timestamps, values
+        chunk.size = len(timestamps)
+        chunk.closed = True
+        return chunk
+
+    @property
+    def capacity(self) -> int:
+        return len(self.timestamps)
+
+    @property
+    def full(self) -> bool:
+        return self.closed or self.size >= self.capacity
+
+    @property
+    def min_ts(self) -> int:
+        return int(self.timestamps[0])
+
+    @property
+    def max_ts(self) -> int:
+        return int(self.timestamps[self.size - 1])
+
+    @property
+    def nbytes(self) -> int:
+        return self.timestamps.nbytes + self.values.nbytes
+
+    def view(self) -> Tuple[np.ndarray, np.ndarray]:
+        return self.timestamps[:self.size], self.values[:self.size]
+
+    def slice(self, start: Optional[int], end: Optional[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """Views of the points in [start, end]"""
+        ts, vs = self.view()
+        lo = 0 if start is None else int(np.searchsorted(ts, start, side="left"))
+        hi = len(ts) if end is None else int(np.searchsorted(ts, end, side="right"))
+        return ts[lo:hi], vs[lo:hi]
+
+    def append(self, timestamps: np.ndarray, values: np.ndarray) -> int:
+        """Append sorted points that are not older than max_ts; returns how many fit"""
+        if self.closed:
+            return 0
+        n = min(len(timestamps), self.capacity - self.size)
+        self.timestamps[self.size:self.size + n] = timestamps[:n]
+        self.values[self.size:self.size + n] = values[:n]
+        self.size += n
+        self.dirty = True
+        return n
+
+    def insert(self, timestamps: np.ndarray, values: np.ndarray):
+        """Merge sorted points into the chunk, growing it past capacity if needed"""
+        ts, vs = self.view()
+        pos = np.searchsorted(ts, timestamps, side="right")
+        merged_ts = np.insert(ts, pos, timestamps)
+        merged_vs = np.insert(vs, pos, values)
+        if self.closed or len(merged_ts) > self.capacity:
+            self.timestamps = merged_ts
+            self.values = merged_vs
+            self.mapped = False
+        else:
+            self.timestamps[:len(merged_ts)] = merged_ts
+            self.values[:len(merged_vs)] = merged_vs
+        self.size = len(merged_ts)
+        self.dirty = True
+
+    def trim(self, lo: int):
+        """Drop the first `lo` points"""
+        ts, vs = self.view()
+        if self.closed:
+            self.timestamps, self.values = ts[lo:].copy(), vs[lo:].copy()
+            self.mapped = False
+        else:
+            self.timestamps[:self.size - lo] = ts[lo:].copy()
+            self.values[:self.size - lo] = vs[lo:].copy()
+        self.size -= lo
+        self.dirty = True
+
+class Series:
+    """Columnar storage for a single (measurement, device_id) series.
+
+    Points live in a list of time-ordered chunks; `_starts` mirrors the first
+    timestamp of every chunk so range lookups are a bisect over chunks followed
+    by a searchsorted inside the chunks that overlap the range. Every write is
+    also folded into the series' rollup tiers.
+    """
+
+    def __init__(self, chunk_size: int, lateness: int = 0):
+        self.chunk_size = chunk_size
+        # Points older than watermark - lateness (ms) are rejected; 0 disables the window
+        self.lateness = lateness
+        self.chunks: List[Chunk] = []
+        self._starts: List[int] = []
+        self.rollups: Dict[str, Rollup] = {tier: Rollup(width) for tier, width in ROLLUP_TIERS.items()}
+        # Newest timestamp ever accepted for this series
+        self.watermark: Optional[int] = None
+        # Bumped whenever retention removes raw points or rollup buckets
+        self.epoch = 0
+
+    @classmethod
+    def from_chunks(cls, chunk_size: int, chunks: List[Chunk], lateness: int = 0) -> "Series":
+        series = cls(chunk_size, lateness)
+        series.chunks = chunks
+        series._starts = [chunk.min_ts for chunk in chunks]
+        series.watermark = series.max_ts
+        return series
+
+    def __len__(self) -> int:
+        return sum(chunk.size for chunk in self.chunks)
+
+    @property
+    def max_ts(self) -> Optional[int]:
+        return self.chunks[-1].max_ts if self.chunks else None
+
+    @property
+    def nbytes(self) -> int:
+        """Heap bytes held by raw columns (mmap-backed chunks excluded)"""
+        return sum(chunk.nbytes for chunk in self.chunks if not chunk.mapped)
+
+    @property
+    def mapped_nbytes(self) -> int:
+        return sum(chunk.nbytes for chunk in self.chunks if chunk.mapped)
+
+    @property
+    def rollup_nbytes(self) -> int:
+        return sum(rollup.nbytes for rollup in self.rollups.values())
+
+    def write(self, timestamps: np.ndarray, values: np.ndarray) -> Tuple[np.ndarray, np.ndarray, int, int]:
+        """Store points, returning (timestamps, values, duplicates, too_late) where
+        the arrays are the accepted points in time order.
+
+        Points behind the watermark by more than the lateness window are
+        rejected, and a (device, timestamp) already stored or repeated within
+        the batch keeps its first value. Rollups only see accepted points, so
+        late data folds into (and corrects) the buckets it belongs to.
+        """
+        order = np.argsort(timestamps, kind="stable")
+        timestamps, values = timestamps[order], values[order]
+        received = len(timestamps)
+
+        too_late = 0
+        if self.watermark is not None and self.lateness:
+            lo = int(np.searchsorted(timestamps, self.watermark - self.lateness, side="left"))
+            too_late = lo
+            timestamps, values = timestamps[lo:], values[lo:]
+
+        keep = np.r_[True, timestamps[1:] != timestamps[:-1]] if len(timestamps) else np.empty(0, dtype=bool)
+        if self.chunks:
+            behind = np.flatnonzero(keep & (timestamps <= self.max_ts))
+            if len(behind):
+                keep[behind[self._contains(timestamps[behind])]] = False
+        timestamps, values = timestamps[keep], values[keep]
+        duplicates = received - too_late - len(timestamps)
+        if not len(timestamps):
+            return timestamps, values, duplicates, too_late
+
+        for rollup in self.rollups.values():
+            rollup.update(timestamps, values)
+
+        # Anything older than the newest stored point is merged in place,
+        # the (usual) in-order tail is appended to the head chunk.
+        split = 0
+        if self.chunks:
+            split = int(np.searchsorted(timestamps, self.max_ts, side="left"))
+        if split:
+            self._insert(timestamps[:split], values[:split])
+        self._append(timestamps[split:], values[split:])
+        last = int(timestamps[-1])
+        self.watermark = last if self.watermark is None else max(self.watermark, last)
+        return timestamps, values, duplicates, too_late
+
+    def _contains(self, timestamps: np.ndarray) -> np.ndarray:
+        """Boolean mask of sorted timestamps that are already stored"""
+        found = np.zeros(len(timestamps), dtype=bool)
+        idx = np.maximum(np.searchsorted(np.asarray(self._starts), timestamps, side="right") - 1, 0)
+        for i in np.unique(idx):
+            mask = np.flatnonzero(idx == i)
+            stored = self.chunks[i].view()[0]
+            pos = np.minimum(np.searchsorted(stored, timestamps[mask]), len(stored) - 1)
+            found[mask] = stored[pos] == timestamps[mask]
+        return found
+
+    def _append(self, timestamps: np.ndarray, values: np.ndarray):
+        while len(timestamps):
+            if not self.chunks or self.chunks[-1].full:
+                self.chunks.append(Chunk(self.chunk_size))
+                self._starts.append(int(timestamps[0]))
+            n = self.chunks[-1].append(timestamps, values)
+            timestamps, values = timestamps[n:], values[n:]
+
+    def _insert(self, timestamps: np.ndarray, values: np.ndarray):
+        # Route each late point to the chunk whose start precedes it
+        idx = np.searchsorted(np.asarray(self._starts), timestamps, side="right") - 1
+        idx = np.maximum(idx, 0)
+        for i in np.unique(idx):
+            mask = idx == i
+            self.chunks[i].insert(timestamps[mask], values[mask])
+            self._starts[i] = self.chunks[i].min_ts
+
+    def drop_before(self, cutoff: int) -> int:
+        """Remove points older than `cutoff`; returns how many were dropped"""
+        dropped = 0
+        while self.chunks and self.chunks[0].max_ts < cutoff:
+            dropped += self.chunks.pop(0).size
+            self._starts.pop(0)
+        if self.chunks and self.chunks[0].min_ts < cutoff:
+            lo = int(np.searchsorted(self.chunks[0].view()[0], cutoff, side="left"))
+            self.chunks[0].trim(lo)
+            self._starts[0] = self.chunks[0].min_ts
+            dropped += lo
+        return dropped
+
+    def merge_small(self) -> int:
+        """Coalesce runs of adjacent closed chunks that fit in one chunk; returns chunks removed"""
+        merged: List[Chunk] = []
+        run: List[Chunk] = []
+        removed = 0
+
+        def close_run():
+            nonlocal removed
+            if len(run) > 1:
+                merged.append(Chunk.frozen(
+                    np.concatenate([chunk.view()[0] for chunk in run]),
+                    np.concatenate([chunk.view()[1] for chunk in run]),
+                ))
+                removed += len(run) - 1
+            else:
+                merged.extend(run)
+            run.clear()
+
+        for chunk in self.chunks:
+            if not chunk.closed:
+                close_run()
+                merged.append(chunk)
+                continue
+            if run and sum(c.size for c in run) + chunk.size > self.chunk_size:
+                close_run()
+            run.append(chunk)
+        close_run()
+
+        if removed:
+            self.chunks = merged
+            self._starts = [chunk.min_ts for chunk in merged]
+        return removed
+
+    def _overlapping(self, start: Optional[int], end: Optional[int]) -> Iterable[Chunk]:
+        lo = 0 if start is None else max(bisect_right(self._starts, start) - 1, 0)
+        hi = len(self.chunks) if end is None else bisect_right(self._starts, end)
+        return self.chunks[lo:hi]
+
+    def iter_range(self, start: Optional[int] = None, end: Optional[int] = None) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """Yield (timestamps, values) views per chunk for points in [start, end]"""
+        for chunk in self._overlapping(start, end):
+            ts, vs = chunk.slice(start, end)
+            if len(ts):
+                yield ts, vs
+
+    def range(self, start: Optional[int] = None, end: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        parts = list(self.iter_range(start, end))
+        if not parts:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        return (
+            np.concatenate([ts for ts, _ in parts]),
+            np.concatenate([vs for _, vs in parts]),
+        )
+
+# In-process columnar time-series store standing in for InfluxDB in development
 class InfluxDB:
-    def __init__(self):
-        logger.info("Initializing mock InfluxDB client")
-        self.data = []
-    
+    def __init__(self, chunk_size: int = settings.TSDB_CHUNK_SIZE,
+                 lateness_seconds: float = settings.TSDB_LATENESS_SECONDS):
+        logger.info("Initializing in-process columnar InfluxDB store")
+        self.chunk_size = chunk_size
+        self.lateness = int(lateness_seconds * 1000)
+        self._series: Dict[Tuple[str, str], Series] = {}
+        self._lock = RLock()
+        self.duplicates = 0
+        self.too_late = 0
+
+        # Persistence, enabled by open()
+        self.data_dir: Optional[str] = None
+        self._wal: Optional[WriteAheadLog] = None
+        self._segments: Dict[str, Segment] = {}
+        self._next_segment = 1
+        self._seal_lock = Lock()
+        self._stop = Event()
+        self._thread: Optional[Thread] = None
+        self.seal_interval = settings.TSDB_SEAL_INTERVAL_SECONDS
+        self.last_seal_seconds = 0.0
+
+    def open(self, data_dir: str = settings.TSDB_DATA_DIR):
+        """Recover from `data_dir` and start logging and periodic sealing there.
+
+        Sealed chunks come back as mmap views from the segments listed in the
+        manifest, rollups from their last snapshot, and only WAL generations
+        written since the last seal are replayed.
+        """
+        if not data_dir or self.data_dir:
+            return
+        started = time.perf_counter()
+        self.data_dir = data_dir
+        segment_dir = os.path.join(data_dir, "segments")
+        os.makedirs(segment_dir, exist_ok=True)
+        self._wal = WriteAheadLog(os.path.join(data_dir, "wal"), fsync=settings.TSDB_WAL_FSYNC)
+
+        manifest = read_manifest(data_dir) or {"wal_gen": 0, "next_segment": 1, "series": [], "rollups": None}
+        self._next_segment = manifest["next_segment"]
+        with self._lock:
+            for entry in manifest["series"]:
+                chunks = []
+                for name, offset, count in entry["blocks"]:
+                    if name not in self._segments:
+                        self._segments[name] = Segment(os.path.join(segment_dir, name))
+                    timestamps, values = self._segments[name].block(offset, count)
+                    chunks.append(Chunk.sealed(timestamps, values, (name, offset, count)))
+                key = (entry["measurement"], entry["device_id"])
+                self._series[key] = Series.from_chunks(self.chunk_size, chunks, self.lateness)
+
+            if manifest["rollups"]:
+                self._load_rollups(os.path.join(data_dir, manifest["rollups"]))
+
+            replayed = 0
+            generations = [g for g in self._wal.generations() if g >= manifest["wal_gen"]]
+            for generation in generations:
+                for measurement, device_id, timestamps, values in self._wal.replay(generation):
+                    self._series_for(measurement, device_id).write(timestamps, values)
+                    replayed += len(timestamps)
+            self._wal.open(max(generations + [manifest["wal_gen"]]) + 1)
+
+        self._remove_unreferenced(manifest)
+        logger.info(
+            f"Opened time-series store at {data_dir}: {len(self._segments)} segments, "
+            f"{replayed} points replayed from WAL in {time.perf_counter() - started:.3f}s"
+        )
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name="tsdb-sealer", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Seal everything still in memory and close the WAL"""
+        if not self.data_dir:
+            return
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.seal()
+        self._wal.close()
+        self.data_dir = None
+
+    def _run(self):
+        while not self._stop.wait(self.seal_interval):
+            try:
+                self.seal()
+            except Exception as e:
+                logger.error(f"Segment sealing failed: {str(e)}")
+
+    def seal(self, force: bool = False) -> int:
+        """Write all unpersisted chunks to a new segment and truncate the WAL.
+
+        Chunks are closed and the WAL rotated under the store lock; the file is
+        written without it. Sealed chunks are then swapped to mmap views unless a
+        late insert replaced their arrays meanwhile, in which case they stay dirty
+        and the insert is still covered by the new WAL generation. `force` rewrites
+        the manifest even when nothing is pending, e.g. after chunks were dropped.
+        """
+        if not self.data_dir:
+            return 0
+        with self._seal_lock:
+            started = time.perf_counter()
+            with self._lock:
+                pending = [
+                    (key, chunk, chunk.timestamps)
+                    for key, series in self._series.items()
+                    for chunk in series.chunks
+                    if chunk.dirty and chunk.size
+                ]
+                if not pending and not force:
+                    return 0
+                blocks = []
+                for (measurement, device_id), chunk, _ in pending:
+                    chunk.closed = True
+                    blocks.append((measurement, device_id, *chunk.view()))
+                rollups = self._snapshot_rollups()
+                wal_gen = self._wal.rotate() + 1
+                name = f"{self._next_segment:08d}.tseg"
+                rollups_name = f"rollups-{self._next_segment:08d}.npz"
+                self._next_segment += 1
+
+            path = os.path.join(self.data_dir, "segments", name)
+            locations = write_segment(path, blocks) if blocks else []
+            save_rollups(os.path.join(self.data_dir, rollups_name), rollups)
+            segment = Segment(path) if blocks else None
+
+            with self._lock:
+                if segment is not None:
+                    self._segments[name] = segment
+                for (_, chunk, timestamps), (offset, count) in zip(pending, locations):
+                    chunk.block = (name, offset, count)
+                    if chunk.timestamps is timestamps:
+                        chunk.timestamps, chunk.values = segment.block(offset, count)
+                        chunk.dirty = False
+                        chunk.mapped = True
+                manifest = self._manifest(wal_gen, rollups_name)
+
+            write_manifest(self.data_dir, manifest)
+            self._wal.remove_before(wal_gen)
+            self._remove_unreferenced(manifest)
+            self.last_seal_seconds = time.perf_counter() - started
+            logger.info(f"Sealed {sum(len(b[2]) for b in blocks)} points from {len(blocks)} chunks into {name}")
+            return len(blocks)
+
+    def compact(self, raw_cutoffs: Dict[str, int], rollup_cutoffs: Dict[str, int]) -> dict:
+        """Apply retention and merge small chunks and segments.
+
+        `raw_cutoffs` maps measurement -> oldest raw timestamp to keep and
+        `rollup_cutoffs` maps tier -> oldest bucket to keep (epoch ms). Live
+        blocks of small or mostly-dead segments are copied back to the heap and
+        adjacent small chunks coalesced, so the following seal rewrites them
+        into one segment and the old files become unreferenced.
+        """
+        before = self._footprint()
+        dropped_points = dropped_buckets = merged = rewritten = 0
+        with self._lock:
+            for (measurement, device_id), series in list(self._series.items()):
+                dropped = 0
+                if measurement in raw_cutoffs:
+                    dropped += series.drop_before(raw_cutoffs[measurement])
+                dropped_points += dropped
+                for tier, cutoff in rollup_cutoffs.items():
+                    buckets = series.rollups[tier].drop_before(cutoff)
+                    dropped += buckets
+                    dropped_buckets += buckets
+                if dropped:
+                    series.epoch += 1
+                if not series.chunks and not any(r.size for r in series.rollups.values()):
+                    del self._series[(measurement, device_id)]
+
+            live: Dict[str, int] = {}
+            for series in self._series.values():
+                for chunk in series.chunks:
+                    if chunk.mapped:
+                        live[chunk.block[0]] = live.get(chunk.block[0], 0) + chunk.nbytes
+            rewrite = {
+                name for name, segment in self._segments.items()
+                if segment.size < settings.TSDB_SMALL_SEGMENT_BYTES or live.get(name, 0) < segment.size / 2
+            }
+            if len(rewrite) > 1 or any(live.get(name, 0) < self._segments[name].size / 2 for name in rewrite):
+                for series in self._series.values():
+                    for chunk in series.chunks:
+                        if chunk.mapped and chunk.block[0] in rewrite:
+                            chunk.timestamps, chunk.values = chunk.timestamps.copy(), chunk.values.copy()
+                            chunk.mapped = False
+                            chunk.dirty = True
+                rewritten = len(rewrite)
+
+            for series in self._series.values():
+                merged += series.merge_small()
+
+        self.seal(force=True)
+        after = self._footprint()
+        return {
+            "dropped_points": dropped_points,
+            "dropped_buckets": dropped_buckets,
+            "merged_chunks": merged,
+            "rewritten_segments": rewritten,
+            "reclaimed_heap_bytes": before["heap"] - after["heap"],
+            "reclaimed_disk_bytes": before["disk"] - after["disk"],
+        }
+
+    def _footprint(self) -> dict:
+        with self._lock:
+            return {
+                "heap": sum(series.nbytes + series.rollup_nbytes for series in self._series.values()),
+                "disk": sum(segment.size for segment in self._segments.values()),
+            }
+
+    def _manifest(self, wal_gen: int, rollups_name: str) -> dict:
+        return {
+            "wal_gen": wal_gen,
+            "next_segment": self._next_segment,
+            "rollups": rollups_name,
+            "series": [
+                {
+                    "measurement": measurement,
+                    "device_id": device_id,
+                    "blocks": [list(chunk.block) for chunk in series.chunks if chunk.block],
+                }
+                for (measurement, device_id), series in self._series.items()
+            ],
+        }
+
+    def _remove_unreferenced(self, manifest: dict):
+        """Delete segments and rollup snapshots the manifest no longer points at"""
+        live = {name for entry in manifest["series"] for name, _, _ in entry["blocks"]}
+        # Readers iterate _segments under the lock; the files go after it is released
+        with self._lock:
+            for name in [name for name in self._segments if name not in live]:
+                del self._segments[name]
+        segment_dir = os.path.join(self.data_dir, "segments")
+        for name in os.listdir(segment_dir):
+            if name not in live:
+                os.remove(os.path.join(segment_dir, name))
+        for name in os.listdir(self.data_dir):
+            if name.startswith("rollups-") and name != manifest["rollups"]:
+                os.remove(os.path.join(self.data_dir, name))
+
+    def _snapshot_rollups(self) -> Dict[str, np.ndarray]:
+        arrays = {"keys": np.array([f"{m}\0{d}" for m, d in self._series], dtype=str)}
+        for i, series in enumerate(self._series.values()):
+            for tier, rollup in series.rollups.items():
+                for field, column in rollup.snapshot().items():
+                    arrays[f"{i}_{tier}_{field}"] = column
+        return arrays
+
+    def _load_rollups(self, path: str):
+        with np.load(path) as data:
+            for i, key in enumerate(data["keys"].tolist()):
+                measurement, device_id = key.split("\0", 1)
+                series = self._series_for(measurement, device_id)
+                for tier, width in ROLLUP_TIERS.items():
+                    columns = {field: data[f"{i}_{tier}_{field}"] for field, _ in ROLLUP_FIELDS}
+                    series.rollups[tier] = Rollup.from_columns(width, columns)
+
+    def _series_for(self, measurement: str, device_id: str) -> Series:
+        series = self._series.get((measurement, device_id))
+        if series is None:
+            series = self._series[(measurement, device_id)] = Series(self.chunk_size, self.lateness)
+        return series
+
     def write_data(self, data):
-        logger.info(f"Writing data to mock InfluxDB: {data}")
-        self.data.append(data)
-        return True
+        return self.write_points([data])
+
+    def write_points(self, points: List[dict], accepted: Optional[list] = None) -> int:
+        """Write InfluxDB-style point dicts, grouped into one columnar append per series.
+
+        If `accepted` is given, each series' accepted points are appended to it
+        (see write_arrays).
+        """
+        grouped: Dict[Tuple[str, str], Tuple[List[int], List[float]]] = {}
+        for point in points:
+            key = (point.get("measurement", DEFAULT_MEASUREMENT), str(point["tags"]["device_id"]))
+            timestamps, values = grouped.setdefault(key, ([], []))
+            timestamps.append(to_epoch_ms(point["time"]))
+            values.append(float(point["fields"]["value"]))
+
+        written = 0
+        with self._lock:
+            for (measurement, device_id), (timestamps, values) in grouped.items():
+                written += self.write_arrays(
+                    device_id,
+                    np.asarray(timestamps, dtype=np.int64),
+                    np.asarray(values, dtype=np.float64),
+                    measurement,
+                    accepted,
+                )
+        logger.debug(f"Wrote {written} of {len(points)} points to {len(grouped)} series")
+        return written
+
+    def write_arrays(self, device_id: str, timestamps: np.ndarray, values: np.ndarray,
+                     measurement: str = DEFAULT_MEASUREMENT, accepted: Optional[list] = None) -> int:
+        """Write already-columnar points for a single series; returns how many were accepted.
+
+        Late and duplicate points are dropped by the series. If `accepted` is
+        given, the points that were stored are appended to it as a
+        (measurement, device_id, timestamps, values) block in time order.
+        """
+        with self._lock:
+            if self._wal is not None:
+                self._wal.append(measurement, device_id, timestamps, values)
+            timestamps, values, duplicates, too_late = self._series_for(measurement, device_id).write(timestamps, values)
+            self.duplicates += duplicates
+            self.too_late += too_late
+        if accepted is not None and len(timestamps):
+            accepted.append((measurement, device_id, timestamps, values))
+        return len(timestamps)
+
+    def watermark(self, device_id: str, measurement: str = DEFAULT_MEASUREMENT) -> Optional[int]:
+        """Newest timestamp accepted for a series (epoch ms), or None if it has no data"""
+        with self._lock:
+            series = self._series.get((measurement, device_id))
+            return None if series is None else series.watermark
+
+    def query(self, device_id: str, start: Optional[int] = None, end: Optional[int] = None,
+              measurement: str = DEFAULT_MEASUREMENT) -> Tuple[np.ndarray, np.ndarray]:
+        """Return copies of the (timestamps, values) columns in [start, end] (epoch ms)"""
+        with self._lock:
+            series = self._series.get((measurement, device_id))
+            if series is None:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+            return series.range(start, end)
+
+    def iter_query(self, device_id: str, start: Optional[int] = None, end: Optional[int] = None,
+                   measurement: str = DEFAULT_MEASUREMENT) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """Yield copies of the points in [start, end] one chunk at a time.
+
+        The lock is only held while a chunk is copied, so long exports don't
+        stall writers and peak memory is bounded by the chunk size.
+        """
+        with self._lock:
+            series = self._series.get((measurement, device_id))
+            if series is None:
+                return
+            chunks = list(series._overlapping(start, end))
+        for chunk in chunks:
+            with self._lock:
+                ts, vs = chunk.slice(start, end)
+                ts, vs = ts.copy(), vs.copy()
+            if len(ts):
+                yield ts, vs
+
+    def count(self, device_id: str, start: Optional[int] = None, end: Optional[int] = None,
+              measurement: str = DEFAULT_MEASUREMENT) -> int:
+        """Number of raw points in [start, end] without materialising them"""
+        with self._lock:
+            series = self._series.get((measurement, device_id))
+            if series is None:
+                return 0
+            return sum(len(ts) for ts, _ in series.iter_range(start, end))
+
+    def epoch(self, device_id: str, measurement: str = DEFAULT_MEASUREMENT) -> int:
+        """Retention epoch of a series; with count() it fingerprints a range's contents"""
+        with self._lock:
+            series = self._series.get((measurement, device_id))
+            return 0 if series is None else series.epoch
+
+    def query_rollup(self, device_id: str, tier: str, start: Optional[int] = None, end: Optional[int] = None,
+                     measurement: str = DEFAULT_MEASUREMENT) -> Dict[str, np.ndarray]:
+        """Return the rollup rows of one tier whose buckets overlap [start, end]"""
+        with self._lock:
+            series = self._series.get((measurement, device_id))
+            if series is None:
+                return empty_rollup()
+            return series.rollups[tier].range(start, end)
+
+    def query_many(self, device_ids: List[str], start: Optional[int] = None, end: Optional[int] = None,
+                   measurement: str = DEFAULT_MEASUREMENT) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Points of several series in [start, end] as flat (device_index, timestamps, values) columns"""
+        parts = []
+        with self._lock:
+            for i, device_id in enumerate(device_ids):
+                series = self._series.get((measurement, device_id))
+                if series is not None:
+                    parts.extend((i, ts, vs) for ts, vs in series.iter_range(start, end))
+            if not parts:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+            # Concatenate while locked: the views may point into chunks still taking writes
+            return (
+                np.repeat([i for i, ts, _ in parts], [len(ts) for _, ts, _ in parts]).astype(np.int64),
+                np.concatenate([ts for _, ts, _ in parts]),
+                np.concatenate([vs for _, _, vs in parts]),
+            )
+
+    def query_rollup_many(self, device_ids: List[str], tier: str, start: Optional[int] = None,
+                          end: Optional[int] = None, measurement: str = DEFAULT_MEASUREMENT) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        """Rollup rows of several series as (device_index, rows) with the rows concatenated"""
+        parts = []
+        with self._lock:
+            for i, device_id in enumerate(device_ids):
+                series = self._series.get((measurement, device_id))
+                if series is not None:
+                    parts.append((i, series.rollups[tier].range(start, end)))
+        if not parts:
+            return np.empty(0, dtype=np.int64), empty_rollup()
+        index = np.repeat([i for i, _ in parts], [len(rows["bucket"]) for _, rows in parts]).astype(np.int64)
+        return index, {name: np.concatenate([rows[name] for _, rows in parts]) for name, _ in ROLLUP_FIELDS}
+
+    def devices(self, measurement: str = DEFAULT_MEASUREMENT) -> List[str]:
+        with self._lock:
+            return sorted(device for m, device in self._series if m == measurement)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "series": len(self._series),
+                "points": sum(len(series) for series in self._series.values()),
+                "chunks": sum(len(series.chunks) for series in self._series.values()),
+                "bytes": sum(series.nbytes for series in self._series.values()),
+                "mapped_bytes": sum(series.mapped_nbytes for series in self._series.values()),
+                "segments": len(self._segments),
+                "segment_bytes": sum(segment.size for segment in self._segments.values()),
+                "last_seal_seconds": self.last_seal_seconds,
+                "duplicates_dropped": self.duplicates,
+                "late_rejected": self.too_late,
+                "rollup_bytes": sum(series.rollup_nbytes for series in self._series.values()),
+            }
 
-influx_client = InfluxDB()
\ No newline at end of file
+influx_client = InfluxDB()
@@ -0,0 +1,97 @@
+from app.core.config import settings
+from typing import Dict, List, Optional, Tuple
+import threading
+import numpy as np
+
+class _Ring:
+    """Fixed-size ring of one device's most recent readings, tagged with write versions"""
+
+    def __init__(self, capacity: int):
+        self.timestamps = np.zeros(capacity, dtype=np.int64)
+        self.values = np.zeros(capacity, dtype=np.float64)
+        self.versions = np.zeros(capacity, dtype=np.int64)
+        self.head = 0
+        self.size = 0
+        self.version = 0
+
+    def push(self, timestamps: np.ndarray, values: np.ndarray, versions: np.ndarray):
+        capacity = len(self.timestamps)
+        if len(timestamps) > capacity:
+            timestamps, values, versions = timestamps[-capacity:], values[-capacity:], versions[-capacity:]
+        idx = (self.head + np.arange(len(timestamps))) % capacity
+        self.timestamps[idx] = timestamps
+        self.values[idx] = values
+        self.versions[idx] = versions
+        self.head = int(idx[-1] + 1) % capacity
+        self.size = min(self.size + len(timestamps), capacity)
+        self.version = int(versions[-1])
+
+    def read(self, since: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Time-sorted, de-duplicated copies of the readings written after version `since`"""
+        keep = self.versions[:self.size] > since
+        timestamps, values = self.timestamps[:self.size][keep], self.values[:self.size][keep]
+        # Stable sort by time; the store accepts a timestamp again only after dropping
+        # the old point, so for a repeated timestamp the later write is the stored one
+        order = np.lexsort((self.versions[:self.size][keep], timestamps))
+        timestamps, values = timestamps[order], values[order]
+        last = np.r_[timestamps[1:] != timestamps[:-1], True]
+        return timestamps[last], values[last]
+
+class LatestValues:
+    """Last-N readings per device, updated as the store accepts them and read by the realtime endpoint.
+
+    Every stored reading gets a process-wide, monotonically increasing
+    version, so pollers can ask only for what changed since the version they
+    last saw. Devices untouched since then are skipped without reading their
+    buffers, which keeps a poll O(devices).
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.version = 0
+        self._rings: Dict[str, _Ring] = {}
+        self._lock = threading.Lock()
+
+    def update(self, blocks: List[Tuple[str, np.ndarray, np.ndarray]]):
+        """Record (device_id, timestamps, values) blocks of readings the store accepted"""
+        with self._lock:
+            for device_id, timestamps, values in blocks:
+                if not len(timestamps):
+                    continue
+                ring = self._rings.get(device_id)
+                if ring is None:
+                    ring = self._rings[device_id] = _Ring(self.capacity)
+                versions = np.arange(self.version + 1, self.version + len(timestamps) + 1, dtype=np.int64)
+                self.version += len(timestamps)
+                ring.push(np.asarray(timestamps, dtype=np.int64), np.asarray(values, dtype=np.float64), versions)
+
+    def read(self, device_ids: Optional[List[str]] = None,
+             since: Optional[int] = None) -> Tuple[int, List[Tuple[str, np.ndarray, np.ndarray]]]:
+        """Current version plus (device_id, timestamps, values) blocks changed after `since`.
+
+        A `since` ahead of the current version (e.g. from before a restart)
+        is treated as no version at all and returns everything buffered.
+        """
+        with self._lock:
+            version = self.version
+            if since is None or since > version:
+                since = 0
+            rings = self._rings if device_ids is None else {
+                device_id: self._rings[device_id] for device_id in device_ids if device_id in self._rings
+            }
+            blocks = [
+                (device_id, *ring.read(since))
+                for device_id, ring in sorted(rings.items())
+                if ring.version > since
+            ]
+        return version, blocks
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "version": self.version,
+                "devices": len(self._rings),
+                "capacity_per_device": self.capacity,
+            }
+
+latest_values = LatestValues(capacity=settings.REALTIME_BUFFER_POINTS)
@@ -2,8 +2,6 @@ from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from app.core.config import settings
-from contextlib import contextmanager
-import backoff
 
 # For development, we'll use SQLite instead of PostgreSQL
 engine = create_engine(
@@ -13,11 +11,10 @@ engine = create_engine(
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
-@contextmanager
-@backoff.on_exception(backoff.expo, Exception, max_tries=3)
 def get_db():
+    """Session for one request, closed once the response has been sent"""
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
@@ -0,0 +1,129 @@
+from typing import Dict, Optional
+import numpy as np
+
+# Bucket widths (ms) of the continuous aggregates kept next to every raw series.
+# Buckets are aligned to the epoch, so daily buckets are UTC days.
+ROLLUP_TIERS = {
+    "1m": 60_000,
+    "1h": 3_600_000,
+    "1d": 86_400_000,
+}
+
+ROLLUP_FIELDS = (
+    ("bucket", np.int64),
+    ("sum", np.float64),
+    ("min", np.float64),
+    ("max", np.float64),
+    ("count", np.int64),
+    ("last", np.float64),
+    ("last_ts", np.int64),
+)
+
+def empty_rollup() -> Dict[str, np.ndarray]:
+    return {name: np.empty(0, dtype=dtype) for name, dtype in ROLLUP_FIELDS}
+
+class Rollup:
+    """Sorted, growable per-bucket aggregates (sum, min, max, count, last) for one tier"""
+
+    def __init__(self, width: int, capacity: int = 64):
+        self.width = width
+        self.size = 0
+        self.columns = {name: np.empty(capacity, dtype=dtype) for name, dtype in ROLLUP_FIELDS}
+
+    @classmethod
+    def from_columns(cls, width: int, columns: Dict[str, np.ndarray]) -> "Rollup":
+        rollup = cls(width, capacity=max(len(columns["bucket"]), 64))
+        rollup.size = len(columns["bucket"])
+        for name, _ in ROLLUP_FIELDS:
+            rollup.columns[name][:rollup.size] = columns[name]
+        return rollup
+
+    @property
+    def nbytes(self) -> int:
+        return sum(column.nbytes for column in self.columns.values())
+
+    def snapshot(self) -> Dict[str, np.ndarray]:
+        return {name: self.columns[name][:self.size].copy() for name, _ in ROLLUP_FIELDS}
+
+    def _reserve(self, extra: int):
+        capacity = len(self.columns["bucket"])
+        if self.size + extra <= capacity:
+            return
+        capacity = max(capacity * 2, self.size + extra)
+        for name, column in self.columns.items():
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            self.columns[name] = grown
+
+    def update(self, timestamps: np.ndarray, values: np.ndarray):
+        """Fold time-sorted points into their buckets"""
+        if not len(timestamps):
+            return
+        buckets = timestamps // self.width * self.width
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        ends = np.r_[starts[1:], len(buckets)] - 1
+        new = {
+            "bucket": buckets[starts],
+            "sum": np.add.reduceat(values, starts),
+            "min": np.minimum.reduceat(values, starts),
+            "max": np.maximum.reduceat(values, starts),
+            "count": ends - starts + 1,
+            "last": values[ends],
+            "last_ts": timestamps[ends],
+        }
+
+        cols = self.columns
+        existing = cols["bucket"][:self.size]
+        pos = np.searchsorted(existing, new["bucket"])
+        hit = pos < self.size
+        hit[hit] = existing[pos[hit]] == new["bucket"][hit]
+
+        # Merge into buckets that already exist
+        if hit.any():
+            idx = pos[hit]
+            cols["sum"][idx] += new["sum"][hit]
+            cols["min"][idx] = np.minimum(cols["min"][idx], new["min"][hit])
+            cols["max"][idx] = np.maximum(cols["max"][idx], new["max"][hit])
+            cols["count"][idx] += new["count"][hit]
+            newer = new["last_ts"][hit] >= cols["last_ts"][idx]
+            cols["last"][idx[newer]] = new["last"][hit][newer]
+            cols["last_ts"][idx[newer]] = new["last_ts"][hit][newer]
+
+        # Add buckets we have not seen; normally these are appended at the end
+        miss = ~hit
+        if not miss.any():
+            return
+        n = int(miss.sum())
+        self._reserve(n)
+        at = pos[miss]
+        if at[0] == self.size:
+            for name, _ in ROLLUP_FIELDS:
+                self.columns[name][self.size:self.size + n] = new[name][miss]
+        else:
+            for name, _ in ROLLUP_FIELDS:
+                merged = np.insert(self.columns[name][:self.size], at, new[name][miss])
+                self.columns[name][:self.size + n] = merged
+        self.size += n
+
+    def drop_before(self, cutoff: int) -> int:
+        """Remove buckets that start before `cutoff`, shrinking storage when mostly empty"""
+        lo = int(np.searchsorted(self.columns["bucket"][:self.size], cutoff, side="left"))
+        if not lo:
+            return 0
+        self.size -= lo
+        capacity = len(self.columns["bucket"])
+        if self.size < capacity // 4:
+            capacity = max(self.size * 2, 64)
+        for name, column in self.columns.items():
+            kept = column[lo:lo + self.size].copy()
+            if capacity != len(column):
+                column = self.columns[name] = np.empty(capacity, dtype=column.dtype)
+            column[:self.size] = kept
+        return lo
+
+    def range(self, start: Optional[int] = None, end: Optional[int] = None) -> Dict[str, np.ndarray]:
+        """Copies of the rows whose bucket overlaps [start, end]"""
+        buckets = self.columns["bucket"][:self.size]
+        lo = 0 if start is None else int(np.searchsorted(buckets, start // self.width * self.width, side="left"))
+        hi = self.size if end is None else int(np.searchsorted(buckets, end, side="right"))
+        return {name: self.columns[name][lo:hi].copy() for name, _ in ROLLUP_FIELDS}
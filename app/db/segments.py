@@ -0,0 +1,187 @@
+"""On-disk formats for the time-series store: write-ahead log, sealed segments
+and the manifest that ties them together.
+
+Segment file layout (little-endian)::
+
+    b"TSEG" | version u32 | index offset u64 | index length u64
+    block 0: timestamps int64[n] | values float64[n]
+    block 1: ...
+    index:   JSON list of [measurement, device_id, offset, count]
+
+Blocks are 8-byte aligned so they can be served as zero-copy NumPy views over
+an mmap of the file.
+
+WAL record layout::
+
+    crc32 u32 | point count u32 | key length u16 | key | timestamps | values
+
+where key is ``measurement\\0device_id`` and the CRC covers everything after
+the header. A short or corrupt record marks the torn tail of a crash.
+"""
+from typing import Dict, Iterator, List, Optional, Tuple
+import json
+import logging
+import mmap
+import os
+import struct
+import zlib
+import numpy as np
+
+logger = logging.getLogger("segments")
+
+SEGMENT_MAGIC = b"TSEG"
+SEGMENT_VERSION = 1
+SEGMENT_HEADER = struct.Struct("<4sIQQ")
+WAL_HEADER = struct.Struct("<IIH")
+MANIFEST = "MANIFEST.json"
+
+def _fsync_dir(path: str):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def atomic_write(path: str, data: bytes):
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _fsync_dir(os.path.dirname(path))
+
+def write_segment(path: str, blocks: List[Tuple[str, str, np.ndarray, np.ndarray]]) -> List[Tuple[int, int]]:
+    """Write (measurement, device_id, timestamps, values) blocks; returns (offset, count) per block"""
+    tmp = f"{path}.tmp"
+    locations = []
+    index = []
+    with open(tmp, "wb") as f:
+        f.write(b"\0" * SEGMENT_HEADER.size)
+        offset = SEGMENT_HEADER.size
+        for measurement, device_id, timestamps, values in blocks:
+            count = len(timestamps)
+            f.write(np.ascontiguousarray(timestamps, dtype="<i8").tobytes())
+            f.write(np.ascontiguousarray(values, dtype="<f8").tobytes())
+            locations.append((offset, count))
+            index.append([measurement, device_id, offset, count])
+            offset += 16 * count
+        index_bytes = json.dumps(index).encode("utf-8")
+        f.write(index_bytes)
+        f.seek(0)
+        f.write(SEGMENT_HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION, offset, len(index_bytes)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _fsync_dir(os.path.dirname(path))
+    return locations
+
+class Segment:
+    """Read-only mmap of a sealed segment file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.name = os.path.basename(path)
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, _ = SEGMENT_HEADER.unpack_from(self._mmap, 0)
+        if magic != SEGMENT_MAGIC or version != SEGMENT_VERSION:
+            raise ValueError(f"{path} is not a v{SEGMENT_VERSION} segment file")
+
+    @property
+    def size(self) -> int:
+        return len(self._mmap)
+
+    def block(self, offset: int, count: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Zero-copy (timestamps, values) views of a block"""
+        timestamps = np.frombuffer(self._mmap, dtype="<i8", count=count, offset=offset)
+        values = np.frombuffer(self._mmap, dtype="<f8", count=count, offset=offset + 8 * count)
+        return timestamps, values
+
+    def index(self) -> List[list]:
+        _, _, index_offset, index_len = SEGMENT_HEADER.unpack_from(self._mmap, 0)
+        return json.loads(bytes(self._mmap[index_offset:index_offset + index_len]))
+
+class WriteAheadLog:
+    """Generation-numbered append-only log of raw writes not yet sealed into segments"""
+
+    def __init__(self, directory: str, fsync: bool = False):
+        self.directory = directory
+        self.fsync = fsync
+        self.generation = 0
+        self._file = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, generation: int) -> str:
+        return os.path.join(self.directory, f"{generation:08d}.wal")
+
+    def generations(self) -> List[int]:
+        return sorted(int(name[:-4]) for name in os.listdir(self.directory) if name.endswith(".wal"))
+
+    def open(self, generation: int):
+        self.close()
+        self.generation = generation
+        self._file = open(self._path(generation), "ab")
+
+    def rotate(self) -> int:
+        """Start a new generation; returns the one that was just closed"""
+        closed = self.generation
+        self.open(closed + 1)
+        return closed
+
+    def append(self, measurement: str, device_id: str, timestamps: np.ndarray, values: np.ndarray):
+        key = f"{measurement}\0{device_id}".encode("utf-8")
+        body = key + np.asarray(timestamps, dtype="<i8").tobytes() + np.asarray(values, dtype="<f8").tobytes()
+        self._file.write(WAL_HEADER.pack(zlib.crc32(body), len(timestamps), len(key)) + body)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def replay(self, generation: int) -> Iterator[Tuple[str, str, np.ndarray, np.ndarray]]:
+        """Yield records from one generation, stopping at a torn or corrupt tail"""
+        with open(self._path(generation), "rb") as f:
+            data = f.read()
+        pos = 0
+        while pos + WAL_HEADER.size <= len(data):
+            crc, count, key_len = WAL_HEADER.unpack_from(data, pos)
+            start = pos + WAL_HEADER.size
+            end = start + key_len + 16 * count
+            body = data[start:end]
+            if len(body) < end - start or zlib.crc32(body) != crc:
+                logger.warning(f"Discarding torn WAL tail in generation {generation} at byte {pos}")
+                break
+            measurement, device_id = body[:key_len].decode("utf-8").split("\0", 1)
+            timestamps = np.frombuffer(body, dtype="<i8", count=count, offset=key_len)
+            values = np.frombuffer(body, dtype="<f8", count=count, offset=key_len + 8 * count)
+            yield measurement, device_id, timestamps.copy(), values.copy()
+            pos = end
+
+    def remove_before(self, generation: int):
+        for old in self.generations():
+            if old < generation:
+                os.remove(self._path(old))
+
+    def close(self):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+
+def read_manifest(directory: str) -> Optional[dict]:
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def write_manifest(directory: str, manifest: dict):
+    atomic_write(os.path.join(directory, MANIFEST), json.dumps(manifest).encode("utf-8"))
+
+def save_rollups(path: str, rollups: Dict[str, np.ndarray]):
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, **rollups)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
@@ -0,0 +1,162 @@
+from app.core.config import settings
+from app.core.metrics import Histogram, LATENCY_BUCKETS, SIZE_BUCKETS
+from app.db.influxdb import DEFAULT_MEASUREMENT, influx_client, to_epoch_ms
+from app.db.latest import latest_values
+from app.services.online_model import online_models
+from typing import List, Optional
+import logging
+import threading
+import time
+import numpy as np
+
+logger = logging.getLogger("write_buffer")
+
+class WriteBuffer:
+    """Accumulates points and writes them to the store in batches.
+
+    A batch is flushed when it reaches `max_points`, when its oldest point has
+    waited `max_age` seconds (checked by a background thread), or on close().
+    Energy readings the store accepts are passed on to `latest` and `online`,
+    so neither sees a reading the store rejected as late or duplicate.
+    """
+
+    def __init__(self, client, max_points: int, max_age: float, latest=None, online=None):
+        self.client = client
+        self.latest = latest
+        self.online = online
+        self.max_points = max_points
+        self.max_age = max_age
+        self._points: List[dict] = []
+        self._oldest: Optional[float] = None
+        self._lock = threading.Lock()
+        # Serialises writes to the store so batches land in submission order
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.flush_latency = Histogram(LATENCY_BUCKETS)
+        self.batch_size = Histogram(SIZE_BUCKETS)
+        self.flushes = {"size": 0, "age": 0, "manual": 0}
+        self.points_written = 0
+        self.points_rejected = 0
+        self.write_errors = 0
+
+    def _normalise(self, batch: List[dict]) -> List[dict]:
+        """Points with epoch-ms times and float values; malformed points are dropped and counted"""
+        points = []
+        for point in batch:
+            try:
+                points.append({
+                    "measurement": point.get("measurement", DEFAULT_MEASUREMENT),
+                    "tags": {"device_id": str(point["tags"]["device_id"])},
+                    "fields": {"value": float(point["fields"]["value"])},
+                    "time": to_epoch_ms(point["time"]),
+                })
+            except (KeyError, TypeError, ValueError, AttributeError) as e:
+                self.points_rejected += 1
+                logger.warning(f"Rejected malformed point {point!r}: {str(e)}")
+        return points
+
+    def write_points(self, batch: List[dict]) -> int:
+        """Buffer points for the next flush; returns how many were well-formed"""
+        # Converting here means one bad point can't fail a whole flush
+        batch = self._normalise(batch)
+        if not batch:
+            return 0
+        with self._lock:
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            self._points.extend(batch)
+            full = len(self._points) >= self.max_points
+        if full:
+            self.flush(reason="size")
+        return len(batch)
+
+    def write_data(self, data: dict) -> int:
+        return self.write_points([data])
+
+    def flush(self, reason: str = "manual") -> int:
+        with self._flush_lock:
+            with self._lock:
+                points, self._points = self._points, []
+                self._oldest = None
+            if not points:
+                return 0
+
+            start = time.perf_counter()
+            accepted = []
+            try:
+                self.client.write_points(points, accepted)
+            except Exception as e:
+                self.write_errors += 1
+                logger.error(f"Failed to flush {len(points)} points: {str(e)}")
+                return 0
+            finally:
+                self.flush_latency.observe(time.perf_counter() - start)
+                # Series written before a failure are stored, so they are published either way
+                blocks = [
+                    (device_id, timestamps, values)
+                    for measurement, device_id, timestamps, values in accepted
+                    if measurement == DEFAULT_MEASUREMENT
+                ]
+                if self.latest is not None:
+                    self.latest.update(blocks)
+                if self.online is not None and blocks:
+                    self.online.observe(
+                        [device_id for device_id, timestamps, _ in blocks for _ in range(len(timestamps))],
+                        np.concatenate([timestamps for _, timestamps, _ in blocks]),
+                        np.concatenate([values for _, _, values in blocks]),
+                    )
+
+            self.batch_size.observe(len(points))
+            self.flushes[reason] += 1
+            self.points_written += len(points)
+            logger.debug(f"Flushed {len(points)} points ({reason})")
+            return len(points)
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._points)
+
+    def _age(self) -> float:
+        with self._lock:
+            return 0.0 if self._oldest is None else time.monotonic() - self._oldest
+
+    def _run(self):
+        while not self._stop.wait(self.max_age / 4):
+            if self._age() >= self.max_age:
+                self.flush(reason="age")
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="write-buffer", daemon=True)
+            self._thread.start()
+
+    def close(self):
+        """Stop the age-based flusher and write out anything still buffered"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        flushed = self.flush()
+        logger.info(f"Write buffer closed, flushed {flushed} pending points")
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending(),
+            "points_written": self.points_written,
+            "points_rejected": self.points_rejected,
+            "write_errors": self.write_errors,
+            "flushes": dict(self.flushes),
+            "flush_latency_seconds": self.flush_latency.snapshot(),
+            "batch_size": self.batch_size.snapshot(),
+        }
+
+write_buffer = WriteBuffer(
+    influx_client,
+    max_points=settings.WRITE_BUFFER_MAX_POINTS,
+    max_age=settings.WRITE_BUFFER_MAX_AGE_SECONDS,
+    latest=latest_values,
+    online=online_models,
+)
@@ -3,9 +3,24 @@ from fastapi.middleware.cors import CORSMiddleware
 import logging
 import time
 from app.db.postgres import Base, engine
+from app.db.influxdb import influx_client
 from app.core.errors import setup_exception_handlers
 from app.routes import auth, users, energy_data, devices, alerts, budgets, ml, voice, ws
 from app.services.mqtt_client import mqtt_client
+from app.services.simulator import fleet_simulator
+from app.services.ingest import ingest_service
+from app.services.compaction import compaction_service
+from app.services.forecaster import seasonal_forecaster
+from app.services.model_registry import model_registry
+from app.services.ml_service import ml_service
+from app.services.compute_pool import compute_pool
+from app.services.anomaly import anomaly_detector
+from app.services.anomaly_scan import anomaly_scanner
+from app.services.forecast_cache import forecast_cache
+from app.services.online_model import online_models
+from app.db.write_buffer import write_buffer
+from app.db.latest import latest_values
+from app.core.response_cache import response_cache
 import uvicorn
 
 # Configure logging
@@ -60,14 +75,43 @@ app.include_router(ws.router, tags=["WebSocket"])
 @app.on_event("startup")
 async def startup_event():
     logger.info("Starting up the application")
+    # Worker processes for CPU-bound model fitting
+    compute_pool.start()
+    # Load ML models in the background; /ready reports when they are warm
+    await model_registry.start()
+    await ml_service.batcher.start()
+    # Restore the incrementally updated device models before ingest feeds them
+    await online_models.start()
+    # Recover the time-series store from its segments and WAL
+    influx_client.open()
+    # Start the age-based flusher for buffered time-series writes
+    write_buffer.start()
+    # Start the ingest consumers before anything can publish into the queue
+    await ingest_service.start()
     # Connect to MQTT broker
-    mqtt_client.connect()
+    await mqtt_client.connect()
+    # Apply retention and compact the store in the background
+    await compaction_service.start()
 
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("Shutting down the application")
+    await anomaly_scanner.stop()
+    await ml_service.batcher.stop()
+    compute_pool.stop()
+    await compaction_service.stop()
     # Disconnect from MQTT broker
-    mqtt_client.disconnect()
+    await mqtt_client.disconnect()
+    # Drain the ingest queue into the write buffer
+    await ingest_service.stop()
+    # Apply what ingest handed over and checkpoint the device models
+    await online_models.stop()
+    # Fold the online and fitted models into the packed parameter file
+    await model_registry.stop()
+    # Flush buffered points so they are not lost on restart
+    write_buffer.close()
+    # Seal in-memory chunks to disk and close the WAL
+    influx_client.close()
 
 @app.get("/")
 async def root():
@@ -77,5 +121,32 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/ready")
+async def readiness_check(response: Response):
+    if not model_registry.ready.is_set():
+        response.status_code = 503
+        return {"status": "loading models"}
+    return {"status": "ready"}
+
+@app.get("/metrics")
+async def metrics():
+    return {
+        "simulator": fleet_simulator.stats(),
+        "ingest": ingest_service.stats(),
+        "write_buffer": write_buffer.stats(),
+        "latest_values": latest_values.stats(),
+        "response_cache": response_cache.stats(),
+        "influxdb": influx_client.stats(),
+        "compaction": compaction_service.stats(),
+        "forecast_cache": forecast_cache.stats(),
+        "online_models": online_models.stats(),
+        "forecaster": seasonal_forecaster.stats(),
+        "models": model_registry.stats(),
+        "predict_batching": ml_service.batcher.stats(),
+        "compute_pool": compute_pool.stats(),
+        "anomaly_detector": anomaly_detector.stats(),
+        "anomaly_scans": anomaly_scanner.stats(),
+    }
+
 if __name__ == "__main__":
     uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from app.db.postgres import Base
 from datetime import datetime
@@ -27,6 +27,9 @@ class Device(Base):
     user_id = Column(String, ForeignKey("users.id"))
     
     user = relationship("User", back_populates="devices")
+    
+    # Serves the per-user keyset pagination in GET /api/devices
+    __table_args__ = (Index("ix_devices_user_id_id", "user_id", "id"),)
 
 class Budget(Base):
     __tablename__ = "budgets"
@@ -48,4 +51,22 @@ class Alert(Base):
     message = Column(String, nullable=False)
     timestamp = Column(DateTime, default=datetime.utcnow)
     read = Column(Boolean, default=False)
-    user_id = Column(String, ForeignKey("users.id"))
\ No newline at end of file
+    user_id = Column(String, ForeignKey("users.id"))
+    
+    # Serves the per-user, newest-first keyset pagination in GET /api/alerts
+    __table_args__ = (Index("ix_alerts_user_id_timestamp_id", "user_id", "timestamp", "id"),)
+
+class Anomaly(Base):
+    __tablename__ = "anomalies"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    device_id = Column(String, nullable=False)
+    timestamp = Column(DateTime, nullable=False)
+    value = Column(Float, nullable=False)
+    expected = Column(Float)
+    score = Column(Float)  # Deviation in standard deviations
+    confidence = Column(Float)
+    type = Column(String, nullable=False)  # spike, drop, unusual_pattern
+    
+    # Serves the per-device time-range lookup in GET /api/ml/anomalies
+    __table_args__ = (Index("ix_anomalies_device_id_timestamp", "device_id", "timestamp"),)
@@ -1,10 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Path
+from fastapi import APIRouter, Depends, HTTPException, status, Path, Query
+from sqlalchemy import and_, or_
 from sqlalchemy.orm import Session
 from app.db.postgres import get_db
 from app.models.models import Alert
+from app.core.config import settings
+from app.core.pagination import decode_cursor, encode_cursor
 from app.core.security import get_current_user
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional, Union
 import uuid
 from datetime import datetime, timedelta
 import random
@@ -18,15 +21,30 @@ class AlertResponse(BaseModel):
     timestamp: str
     read: bool
 
-@router.get("", response_model=List[AlertResponse])
+class AlertPage(BaseModel):
+    items: List[AlertResponse]
+    next_cursor: Optional[str] = None
+
+@router.get("", response_model=Union[List[AlertResponse], AlertPage])
 async def get_alerts(
+    limit: Optional[int] = Query(None, ge=1, le=settings.PAGE_MAX_LIMIT, description="Alerts per page"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    alerts = db.query(Alert).filter(Alert.user_id == current_user["sub"]).all()
+    # Newest first; the cursor is the (timestamp, id) of the last alert on the page
+    query = db.query(Alert).filter(Alert.user_id == current_user["sub"])
+    if cursor:
+        timestamp, alert_id = decode_cursor(cursor, datetime.fromisoformat, str)
+        query = query.filter(or_(
+            Alert.timestamp < timestamp,
+            and_(Alert.timestamp == timestamp, Alert.id < alert_id)
+        ))
+    query = query.order_by(Alert.timestamp.desc(), Alert.id.desc())
+    alerts = query.limit(limit + 1).all() if limit else query.all()
     
     # If no alerts exist, create some mock alerts for development
-    if not alerts:
+    if not alerts and not cursor:
         alert_types = ["budget", "anomaly", "system"]
         alert_messages = [
             "Energy usage exceeded daily budget by 15%",
@@ -60,9 +78,14 @@ async def get_alerts(
         db.add_all(mock_alerts)
         db.commit()
         
-        alerts = mock_alerts
+        alerts = sorted(mock_alerts, key=lambda alert: (alert.timestamp, alert.id), reverse=True)
+    
+    next_cursor = None
+    if limit and len(alerts) > limit:
+        alerts = alerts[:limit]
+        next_cursor = encode_cursor(alerts[-1].timestamp.isoformat(), alerts[-1].id)
     
-    return [
+    items = [
         {
             "id": alert.id,
             "type": alert.type,
@@ -72,6 +95,9 @@ async def get_alerts(
         }
         for alert in alerts
     ]
+    if limit or cursor:
+        return {"items": items, "next_cursor": next_cursor}
+    return items
 
 @router.put("/{id}/read")
 async def mark_alert_as_read(
@@ -1,10 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Path
+from fastapi import APIRouter, Depends, HTTPException, status, Path, Query
 from sqlalchemy.orm import Session
 from app.db.postgres import get_db
 from app.models.models import Device
+from app.core.config import settings
+from app.core.pagination import decode_cursor, encode_cursor
 from app.core.security import get_current_user
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Optional, Union
 import uuid
 
 router = APIRouter()
@@ -27,15 +29,27 @@ class DeviceResponse(BaseModel):
     location: str
     status: str
 
-@router.get("", response_model=List[DeviceResponse])
+class DevicePage(BaseModel):
+    items: List[DeviceResponse]
+    next_cursor: Optional[str] = None
+
+@router.get("", response_model=Union[List[DeviceResponse], DevicePage])
 async def get_devices(
+    limit: Optional[int] = Query(None, ge=1, le=settings.PAGE_MAX_LIMIT, description="Devices per page"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    devices = db.query(Device).filter(Device.user_id == current_user["sub"]).all()
+    # Ordered by id; the cursor is the id of the last device on the page
+    query = db.query(Device).filter(Device.user_id == current_user["sub"])
+    if cursor:
+        (device_id,) = decode_cursor(cursor, str)
+        query = query.filter(Device.id > device_id)
+    query = query.order_by(Device.id)
+    devices = query.limit(limit + 1).all() if limit else query.all()
     
     # If no devices exist, create some mock devices for development
-    if not devices:
+    if not devices and not cursor:
         mock_devices = [
             Device(
                 id=str(uuid.uuid4()),
@@ -66,9 +80,14 @@ async def get_devices(
         db.add_all(mock_devices)
         db.commit()
         
-        devices = mock_devices
+        devices = sorted(mock_devices, key=lambda device: device.id)
+    
+    next_cursor = None
+    if limit and len(devices) > limit:
+        devices = devices[:limit]
+        next_cursor = encode_cursor(devices[-1].id)
     
-    return [
+    items = [
         {
             "id": device.id,
             "name": device.name,
@@ -78,6 +97,9 @@ async def get_devices(
         }
         for device in devices
     ]
+    if limit or cursor:
+        return {"items": items, "next_cursor": next_cursor}
+    return items
 
 @router.get("/{id}", response_model=DeviceResponse)
 async def get_device_by_id(
@@ -1,87 +1,413 @@
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from app.core.columnar import COLUMNAR_MEDIA_TYPE, columnar_response, encode_stream, wants_columnar
+from app.core.config import settings
+from app.core.pagination import decode_cursor, encode_cursor
+from app.core.response_cache import CachedResponse, response_cache
 from app.core.security import get_current_user
-from app.db.influxdb import influx_client
-from typing import List, Optional
+from app.db.aggregation import AGGREGATES, auto_window, format_window, parse_window, query_matrix, query_series
+from app.db.influxdb import influx_client, from_epoch_ms, to_epoch_ms
+from app.db.latest import latest_values
+from app.db.postgres import get_db
+from app.models.models import Device
+from app.services.ingest import ingest_service
+from app.services.mqtt_client import mqtt_client
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple, Union
 from pydantic import BaseModel
-from datetime import datetime, timedelta
-import random
+from sqlalchemy.orm import Session
+from datetime import datetime
+import csv
+import hashlib
+import io
+import json
+import math
+import numpy as np
 
 router = APIRouter()
 
+# Rejected lines reported back individually in a batch upload response
+MAX_REPORTED_ERRORS = 20
+
 class EnergyDataResponse(BaseModel):
     timestamp: str
     value: float
     deviceId: str
 
-@router.get("", response_model=List[EnergyDataResponse])
-async def get_energy_data(
+class EnergyDataPage(BaseModel):
+    items: List[EnergyDataResponse]
+    next_cursor: Optional[str] = None
+
+class BulkEnergyDataResponse(BaseModel):
+    window: str
+    agg: str
+    source: str
+    timestamps: List[str]
+    series: Dict[str, List[Optional[float]]]
+
+class BatchLineError(BaseModel):
+    line: int
+    error: str
+
+class BatchIngestResponse(BaseModel):
+    accepted: int
+    rejected: int
+    errors: List[BatchLineError]
+
+async def _iter_lines(request: Request) -> AsyncIterator[bytes]:
+    """Yield raw lines from the request body as chunks arrive; callers decode them per line"""
+    pending = b""
+    async for chunk in request.stream():
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line.rstrip(b"\r")
+    if pending:
+        yield pending.rstrip(b"\r")
+
+def _normalize_reading(payload) -> dict:
+    """Apply the MQTT payload rules and coerce value/timestamp, raising ValueError if invalid"""
+    if not isinstance(payload, dict) or not mqtt_client.validate_payload(payload):
+        raise ValueError("Invalid payload structure")
+    timestamp = payload["timestamp"]
+    if isinstance(timestamp, str) and timestamp.isdigit():
+        timestamp = int(timestamp)
+    value = float(payload["value"])
+    if not math.isfinite(value):
+        raise ValueError(f"Invalid value: {payload['value']!r}")
+    return {
+        "device_id": str(payload["device_id"]),
+        "value": value,
+        "timestamp": to_epoch_ms(timestamp),
+    }
+
+def _parse_range(startDate: Optional[str], endDate: Optional[str]) -> Tuple[int, int]:
+    # Default to last 24 hours if no dates provided
+    try:
+        end = to_epoch_ms(endDate) if endDate else to_epoch_ms(datetime.now())
+        start = to_epoch_ms(startDate) if startDate else end - 24 * 3_600_000
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if start > end:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="startDate must not be after endDate")
+    return start, end
+
+def _parse_aggregation(window: Optional[str], agg: str) -> Optional[int]:
+    if agg not in AGGREGATES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"agg must be one of: {', '.join(AGGREGATES)}"
+        )
+    try:
+        return parse_window(window) if window else None
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+def _iter_series(device_ids: List[str], start: int, end: int, window_ms: Optional[int], agg: str,
+                 auto: bool = False) -> Iterator[Tuple[str, np.ndarray, np.ndarray]]:
+    """Yield (device_id, timestamps, values) blocks for every requested device.
+
+    With `auto`, ranges too dense to return raw are downsampled when no window
+    is given; streamed formats leave it off and always get raw points.
+    """
+    for device_id in device_ids:
+        device_window = window_ms
+        if auto and device_window is None and influx_client.count(device_id, start, end) > settings.ENERGY_DATA_MAX_POINTS:
+            device_window = auto_window(start, end, settings.ENERGY_DATA_MAX_POINTS)
+
+        if device_window is None:
+            for timestamps, values in influx_client.iter_query(device_id, start, end):
+                yield device_id, timestamps, values
+        else:
+            timestamps, values, _ = query_series(influx_client, device_id, start, end, device_window, agg)
+            yield device_id, timestamps, values
+
+def _page_series(device_ids: List[str], start: int, end: int, window_ms: Optional[int], agg: str,
+                 limit: int, after: Optional[Tuple[int, str]]) -> Tuple[List[Tuple[str, np.ndarray, np.ndarray]], Optional[str]]:
+    """One page of points ordered by (device_id, timestamp), seeking past `after`.
+
+    Returns the page's blocks and the cursor of the following page, if any.
+    """
+    blocks = []
+    # Read one point past the page to learn whether another page exists
+    remaining = limit + 1
+    for device_id in sorted(device_ids):
+        if remaining <= 0:
+            break
+        seek = None
+        if after is not None:
+            if device_id < after[1]:
+                continue
+            if device_id == after[1]:
+                seek = after[0]
+        lo = start if seek is None else max(start, seek + 1)
+        if lo > end:
+            continue
+
+        if window_ms is None:
+            parts = influx_client.iter_query(device_id, lo, end)
+        else:
+            timestamps, values, _ = query_series(influx_client, device_id, lo, end, window_ms, agg)
+            if seek is not None:
+                keep = timestamps > seek
+                timestamps, values = timestamps[keep], values[keep]
+            parts = [(timestamps, values)]
+
+        for timestamps, values in parts:
+            if len(timestamps):
+                blocks.append((device_id, timestamps[:remaining], values[:remaining]))
+                remaining -= len(blocks[-1][1])
+            if remaining <= 0:
+                break
+
+    if remaining > 0:
+        return blocks, None
+    # Drop the look-ahead point; the page ends at the point before it
+    device_id, timestamps, values = blocks.pop()
+    if len(timestamps) > 1:
+        blocks.append((device_id, timestamps[:-1], values[:-1]))
+    last_device, last_timestamps, _ = blocks[-1]
+    return blocks, encode_cursor(int(last_timestamps[-1]), last_device)
+
+def _rows(device_id: str, timestamps: np.ndarray, values: np.ndarray) -> Iterator[Tuple[str, float, str]]:
+    for timestamp, value in zip(timestamps.tolist(), np.round(values, 2).tolist()):
+        yield from_epoch_ms(timestamp).isoformat(), value, device_id
+
+def _stream_ndjson(blocks) -> Iterator[bytes]:
+    for device_id, timestamps, values in blocks:
+        yield "".join(
+            json.dumps({"timestamp": timestamp, "value": value, "deviceId": device}) + "\n"
+            for timestamp, value, device in _rows(device_id, timestamps, values)
+        ).encode("utf-8")
+
+def _stream_csv(blocks) -> Iterator[bytes]:
+    yield b"timestamp,value,deviceId\n"
+    for device_id, timestamps, values in blocks:
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="\n").writerows(_rows(device_id, timestamps, values))
+        yield buffer.getvalue().encode("utf-8")
+
+def _etag(key: tuple, device_ids: List[str], start: int, end: int, window_ms: Optional[int], auto: bool) -> str:
+    """Strong ETag for a query over a finished range.
+
+    Late writes are de-duplicated, so a series' point count over the range
+    (widened to whole windows when aggregated) only changes when new data
+    lands in it; the retention epoch covers points and buckets being dropped.
+    """
+    parts = [repr(key)]
+    for device_id in device_ids:
+        count = influx_client.count(device_id, start, end)
+        window = window_ms
+        if auto and window is None and count > settings.ENERGY_DATA_MAX_POINTS:
+            window = auto_window(start, end, settings.ENERGY_DATA_MAX_POINTS)
+        if window is not None:
+            count = influx_client.count(device_id, start // window * window, (end // window + 1) * window - 1)
+        parts.append(f"{device_id}:{count}:{influx_client.epoch(device_id)}")
+    return '"' + hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest() + '"'
+
+def _if_none_match(request: Request) -> List[str]:
+    return [tag.strip() for tag in request.headers.get("if-none-match", "").split(",") if tag.strip()]
+
+# A plain def, so FastAPI runs it in its threadpool: the store reads, ETag
+# counts, row building and JSON encoding would otherwise stall the event loop
+@router.get("", response_model=Union[List[EnergyDataResponse], EnergyDataPage])
+def get_energy_data(
+    request: Request,
     deviceId: Optional[str] = Query(None),
     startDate: Optional[str] = Query(None),
     endDate: Optional[str] = Query(None),
-    current_user: dict = Depends(get_current_user)
+    window: Optional[str] = Query(None, description="Aggregation window, e.g. 5m, 1h, 1d"),
+    agg: str = Query("mean", description="sum, mean, min, max or p95"),
+    format: str = Query("json", description="json, or ndjson/csv to stream the rows"),
+    limit: Optional[int] = Query(None, ge=1, le=settings.PAGE_MAX_LIMIT, description="Points per page"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
 ):
-    # For development, generate mock historical data
-    data = []
-    
-    # Default to last 24 hours if no dates provided
-    if not startDate:
-        start_dt = datetime.now() - timedelta(days=1)
+    start, end = _parse_range(startDate, endDate)
+    window_ms = _parse_aggregation(window, agg)
+    if format not in ("json", "ndjson", "csv"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="format must be one of: json, ndjson, csv"
+        )
+    if deviceId:
+        device_ids = [deviceId]
+    else:
+        device_ids = [
+            device_id for (device_id,) in
+            db.query(Device.id).filter(Device.user_id == current_user["sub"]).order_by(Device.id)
+        ]
+    columnar = wants_columnar(request)
+    paged = limit is not None or cursor is not None
+    streamed = columnar or format != "json"
+
+    # A JSON body for a range with an explicit end in the past only changes when
+    # late data lands in it, so it gets a strong ETag and is cached under that
+    # tag. Streamed formats are never rendered whole, and ranges without an
+    # endDate run up to now
+    cache_key = etag = None
+    if not streamed and endDate and end < to_epoch_ms(datetime.now()):
+        cache_key = (current_user["sub"], deviceId, start, end, window, agg, limit, cursor)
+        etag = _etag(cache_key, device_ids, start, end, window_ms, not paged)
+        if etag in _if_none_match(request):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+        cached = response_cache.get(cache_key, etag)
+        if cached is not None:
+            return Response(cached.body, media_type=cached.media_type, headers={**cached.headers, "ETag": etag})
+
+    # Pages are cut from raw points unless a window is given, so a range is
+    # never re-bucketed halfway through paging it
+    headers = {}
+    next_cursor = None
+    if paged:
+        after = decode_cursor(cursor, int, str) if cursor else None
+        blocks, next_cursor = _page_series(
+            device_ids, start, end, window_ms, agg, limit or settings.ENERGY_DATA_MAX_POINTS, after
+        )
+        if next_cursor:
+            headers["X-Next-Cursor"] = next_cursor
+    else:
+        # Only the JSON body, built in memory, is downsampled automatically
+        blocks = _iter_series(device_ids, start, end, window_ms, agg, auto=not streamed)
+
+    # Packed binary columns come straight from the NumPy buffers, no per-row objects
+    if columnar:
+        media_type, chunks = COLUMNAR_MEDIA_TYPE, encode_stream(blocks)
+    elif format == "ndjson":
+        media_type, chunks = "application/x-ndjson", _stream_ndjson(blocks)
+    elif format == "csv":
+        media_type, chunks = "text/csv", _stream_csv(blocks)
+        headers["Content-Disposition"] = "attachment; filename=energy-data.csv"
     else:
-        start_dt = datetime.fromisoformat(startDate)
-    
-    if not endDate:
-        end_dt = datetime.now()
+        items = [
+            {"timestamp": timestamp, "value": value, "deviceId": device}
+            for block in blocks
+            for timestamp, value, device in _rows(*block)
+        ]
+        body = {"items": items, "next_cursor": next_cursor} if paged else items
+        if cache_key is None:
+            return body
+        content = json.dumps(body, separators=(",", ":")).encode("utf-8")
+        response_cache.put(cache_key, CachedResponse(etag, content, "application/json", headers))
+        return Response(content, media_type="application/json", headers={**headers, "ETag": etag})
+
+    # Streamed formats are produced chunk by chunk from a sync generator, which
+    # Starlette runs in its threadpool, so memory stays bounded by the chunk size
+    return StreamingResponse(chunks, media_type=media_type, headers=headers)
+
+@router.get("/bulk", response_model=BulkEnergyDataResponse)
+async def get_energy_data_bulk(
+    deviceIds: Optional[List[str]] = Query(None, description="Repeat or comma-separate; defaults to all of your devices"),
+    startDate: Optional[str] = Query(None),
+    endDate: Optional[str] = Query(None),
+    window: Optional[str] = Query(None, description="Aggregation window, e.g. 5m, 1h, 1d"),
+    agg: str = Query("mean", description="sum, mean, min, max or p95"),
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Several devices' series on one shared window grid, in a single pass over the store"""
+    start, end = _parse_range(startDate, endDate)
+    window_ms = _parse_aggregation(window, agg) or auto_window(start, end, settings.ENERGY_DATA_MAX_POINTS)
+
+    if deviceIds:
+        device_ids = list(dict.fromkeys(d.strip() for ids in deviceIds for d in ids.split(",") if d.strip()))
     else:
-        end_dt = datetime.fromisoformat(endDate)
-    
-    # Generate data points at 1-hour intervals
-    current_dt = start_dt
-    device_ids = ["device1", "device2", "device3"] if not deviceId else [deviceId]
-    
-    while current_dt <= end_dt:
-        for device_id in device_ids:
-            # Generate a value with some randomness but following a pattern
-            hour = current_dt.hour
-            # More usage during day, less at night
-            base_value = 2.0 + 3.0 * (1 - abs(hour - 12) / 12)
-            value = base_value + random.uniform(-0.5, 0.5)
-            
-            data.append({
-                "timestamp": current_dt.isoformat(),
-                "value": round(value, 2),
-                "deviceId": device_id
-            })
-        
-        current_dt += timedelta(hours=1)
-    
-    return data
+        device_ids = [
+            device_id for (device_id,) in
+            db.query(Device.id).filter(Device.user_id == current_user["sub"]).order_by(Device.id)
+        ]
+
+    n_buckets = end // window_ms - start // window_ms + 1
+    if len(device_ids) * n_buckets > settings.BULK_MAX_CELLS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Query would return more than {settings.BULK_MAX_CELLS} points; use a larger window or fewer devices"
+        )
+
+    grid, matrix, source = await run_in_threadpool(query_matrix, influx_client, device_ids, start, end, window_ms, agg)
+    # NaN marks buckets a device has no data for; JSON gets null
+    rounded = np.round(matrix, 2).astype(object)
+    rounded[np.isnan(matrix)] = None
+    return {
+        "window": format_window(window_ms),
+        "agg": agg,
+        "source": source,
+        "timestamps": [from_epoch_ms(timestamp).isoformat() for timestamp in grid.tolist()],
+        "series": dict(zip(device_ids, rounded.tolist())),
+    }
 
 @router.get("/realtime", response_model=List[EnergyDataResponse])
 async def get_realtime_energy_data(
+    request: Request,
+    response: Response,
     deviceId: Optional[str] = Query(None),
+    since: Optional[int] = Query(None, ge=0, description="X-Data-Version of the last poll; only newer readings are returned"),
+    current_user: dict = Depends(get_current_user)
+):
+    # Served from the latest-value cache, which holds what the store accepted, without querying the store
+    version, blocks = latest_values.read([deviceId] if deviceId else None, since)
+    headers = {"X-Data-Version": str(version)}
+
+    if wants_columnar(request):
+        return columnar_response(blocks, headers)
+    response.headers.update(headers)
+    return [
+        {"timestamp": timestamp, "value": value, "deviceId": device}
+        for block in blocks
+        for timestamp, value, device in _rows(*block)
+    ]
+
+@router.post("/batch", response_model=BatchIngestResponse)
+async def ingest_energy_data_batch(
+    request: Request,
     current_user: dict = Depends(get_current_user)
 ):
-    # For development, generate mock realtime data
-    data = []
-    
-    # Generate data points for the last hour at 5-minute intervals
-    end_dt = datetime.now()
-    start_dt = end_dt - timedelta(hours=1)
-    
-    current_dt = start_dt
-    device_ids = ["device1", "device2", "device3"] if not deviceId else [deviceId]
-    
-    while current_dt <= end_dt:
-        for device_id in device_ids:
-            # Generate a value with some randomness
-            value = 5.0 + random.uniform(-2.0, 2.0)
-            
-            data.append({
-                "timestamp": current_dt.isoformat(),
-                "value": round(value, 2),
-                "deviceId": device_id
-            })
-        
-        current_dt += timedelta(minutes=5)
-    
-    return data
\ No newline at end of file
+    """Bulk upload of readings as NDJSON (default) or CSV with a header row"""
+    is_csv = request.headers.get("content-type", "").startswith("text/csv")
+    accepted = 0
+    rejected = 0
+    errors = []
+    batch = []
+    header = None
+
+    async def flush():
+        nonlocal accepted, rejected, batch
+        # The queue keeps a reference to the list, so hand it off rather than reuse it
+        submitted, batch = batch, []
+        if await ingest_service.submit(submitted):
+            accepted += len(submitted)
+        else:
+            rejected += len(submitted)
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append({"line": line_no, "error": "Ingest queue full"})
+
+    line_no = 0
+    async for raw in _iter_lines(request):
+        line_no += 1
+        try:
+            line = raw.decode("utf-8")
+            if not line.strip():
+                continue
+            if is_csv:
+                row = next(csv.reader([line]))
+                if header is None:
+                    header = [column.strip() for column in row]
+                    continue
+                payload = dict(zip(header, row))
+            else:
+                payload = json.loads(line)
+            batch.append(_normalize_reading(payload))
+        except (ValueError, TypeError) as e:
+            rejected += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append({"line": line_no, "error": str(e)})
+            continue
+
+        if len(batch) >= settings.INGEST_MAX_BATCH:
+            await flush()
+
+    if batch:
+        await flush()
+
+    return {"accepted": accepted, "rejected": rejected, "errors": errors}
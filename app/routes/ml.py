@@ -1,10 +1,21 @@
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+from app.core.columnar import columnar_response, wants_columnar
+from app.core.config import settings
 from app.core.security import get_current_user
+from app.db.influxdb import from_epoch_ms, to_epoch_ms
+from app.db.postgres import get_db
+from app.db.aggregation import parse_window
+from app.models.models import Anomaly, Device
+from app.services.anomaly_scan import SEASONS, ScanJob, anomaly_scanner
+from app.services.compute_pool import ComputeTimeout
+from app.services.forecaster import HOUR_MS
 from app.services.ml_service import ml_service
 from typing import List, Optional
 from pydantic import BaseModel
 from datetime import datetime, timedelta
-import random
+import numpy as np
 
 router = APIRouter()
 
@@ -20,82 +31,149 @@ class AnomalyResponse(BaseModel):
     confidence: float
     type: str
 
+class AnomalyScanRequest(BaseModel):
+    deviceIds: Optional[List[str]] = None  # Defaults to all of the caller's devices
+    startDate: str
+    endDate: Optional[str] = None
+    window: str = "15m"  # Bucket width the history is averaged to before scanning
+    season: str = "day"  # none, day or week; the profile removed before rolling statistics
+    windowPoints: int = 25  # Buckets in the centered rolling median/MAD window
+    threshold: float = settings.ANOMALY_Z_THRESHOLD
+    shiftThreshold: float = settings.ANOMALY_SHIFT_THRESHOLD
+
+class AnomalyScanJobResponse(BaseModel):
+    jobId: str
+    status: str
+    progress: float
+    devicesDone: int
+    devicesTotal: int
+    anomalies: int
+    error: Optional[str]
+    createdAt: float
+    finishedAt: Optional[float]
+
 @router.get("/forecast", response_model=List[EnergyForecastResponse])
 async def get_energy_forecast(
+    request: Request,
     deviceId: str = Query(...),
     days: int = Query(7, ge=1, le=30),
     current_user: dict = Depends(get_current_user)
 ):
-    # For development, generate mock forecast data
-    forecast_data = []
-    
-    # Start from tomorrow
-    start_date = datetime.now() + timedelta(days=1)
-    
-    # Generate hourly forecasts for the requested number of days
-    for day in range(days):
-        current_date = start_date + timedelta(days=day)
-        
-        # Generate 24 hourly data points for each day
-        for hour in range(24):
-            timestamp = current_date.replace(hour=hour, minute=0, second=0)
-            
-            # Create a realistic pattern: higher usage during day, lower at night
-            hour_factor = 1 - abs(hour - 12) / 12  # Peaks at noon
-            day_factor = 0.8 + 0.4 * (day % 7) / 6  # Weekly pattern
-            
-            # Base value with some randomness
-            base_value = 5.0 * hour_factor * day_factor
-            value = base_value + random.uniform(-0.5, 0.5)
-            
-            forecast_data.append({
-                "timestamp": timestamp.isoformat(),
-                "value": round(value, 2),
-                "deviceId": deviceId
-            })
-    
-    return forecast_data
+    # Hourly forecast from the device's model, starting next hour
+    start = to_epoch_ms(datetime.now()) + HOUR_MS
+    try:
+        forecast = await run_in_threadpool(ml_service.forecast, deviceId, start, days * 24)
+    except ComputeTimeout:
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail="Forecast model fitting timed out"
+        )
+    if forecast is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Not enough history to forecast this device"
+        )
+    timestamps, values = forecast
+
+    if wants_columnar(request):
+        return columnar_response([(deviceId, timestamps, values)])
+    return [
+        {"timestamp": from_epoch_ms(timestamp).isoformat(), "value": value, "deviceId": deviceId}
+        for timestamp, value in zip(timestamps.tolist(), np.round(values, 2).tolist())
+    ]
 
 @router.get("/anomalies", response_model=List[AnomalyResponse])
 async def detect_anomalies(
     deviceId: str = Query(...),
-    current_user: dict = Depends(get_current_user)
+    startDate: Optional[str] = Query(None),
+    endDate: Optional[str] = Query(None),
+    limit: int = Query(100, ge=1, le=settings.PAGE_MAX_LIMIT, description="Most recent anomalies to return"),
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
 ):
-    # For development, generate mock anomaly data
-    anomaly_data = []
-    
-    # Generate a few random anomalies in the past week
-    end_date = datetime.now()
-    start_date = end_date - timedelta(days=7)
-    
-    # Generate 3-5 anomalies
-    num_anomalies = random.randint(3, 5)
-    anomaly_types = ["spike", "drop", "unusual_pattern"]
-    
-    for _ in range(num_anomalies):
-        # Random timestamp within the past week
-        days_ago = random.uniform(0, 7)
-        timestamp = end_date - timedelta(days=days_ago)
-        
-        # Anomaly value (significantly higher or lower than normal)
-        anomaly_type = random.choice(anomaly_types)
-        
-        if anomaly_type == "spike":
-            value = random.uniform(10.0, 15.0)  # Higher than normal
-        elif anomaly_type == "drop":
-            value = random.uniform(0.1, 0.5)  # Lower than normal
-        else:
-            value = random.uniform(5.0, 8.0)  # Within normal range but unusual pattern
-        
-        anomaly_data.append({
-            "timestamp": timestamp.isoformat(),
-            "value": round(value, 2),
-            "deviceId": deviceId,
-            "confidence": round(random.uniform(0.7, 0.98), 2),
-            "type": anomaly_type
-        })
-    
-    # Sort by timestamp
-    anomaly_data.sort(key=lambda x: x["timestamp"])
+    # Anomalies are flagged on ingest; this is an indexed (device_id, timestamp) range read
+    try:
+        end = datetime.fromisoformat(endDate) if endDate else datetime.now()
+        start = datetime.fromisoformat(startDate) if startDate else end - timedelta(days=7)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    anomalies = db.query(Anomaly).filter(
+        Anomaly.device_id == deviceId,
+        Anomaly.timestamp >= start,
+        Anomaly.timestamp <= end
+    ).order_by(Anomaly.timestamp.desc()).limit(limit).all()
     
-    return anomaly_data
\ No newline at end of file
+    # Oldest first, like the other time series endpoints
+    return [
+        {
+            "timestamp": anomaly.timestamp.isoformat(),
+            "value": round(anomaly.value, 2),
+            "deviceId": anomaly.device_id,
+            "confidence": round(anomaly.confidence, 2),
+            "type": anomaly.type
+        }
+        for anomaly in reversed(anomalies)
+    ]
+
+@router.post("/anomalies/scan", response_model=AnomalyScanJobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def start_anomaly_scan(
+    scan: AnomalyScanRequest,
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Re-detect anomalies over a historical range as a background job; poll it for progress"""
+    try:
+        start = to_epoch_ms(datetime.fromisoformat(scan.startDate))
+        end = to_epoch_ms(datetime.fromisoformat(scan.endDate) if scan.endDate else datetime.now())
+        window = parse_window(scan.window)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if end <= start:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="endDate must be after startDate")
+    if scan.season not in SEASONS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"season must be one of {', '.join(SEASONS)}")
+    if SEASONS[scan.season] is not None and SEASONS[scan.season] % window:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="window must divide the season length")
+    if scan.windowPoints < 3:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="windowPoints must be at least 3")
+
+    if scan.deviceIds:
+        device_ids = list(dict.fromkeys(scan.deviceIds))
+    else:
+        device_ids = [
+            device_id for (device_id,) in
+            db.query(Device.id).filter(Device.user_id == current_user["sub"]).order_by(Device.id)
+        ]
+
+    n_buckets = end // window - start // window + 1
+    if len(device_ids) * n_buckets > settings.BULK_MAX_CELLS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Scan would cover more than {settings.BULK_MAX_CELLS} buckets; use a larger window, a shorter range or fewer devices"
+        )
+
+    job = anomaly_scanner.submit(ScanJob(
+        device_ids, start, end, window, scan.season, scan.windowPoints, scan.threshold, scan.shiftThreshold
+    ))
+    return job.info()
+
+@router.get("/anomalies/scan/{job_id}", response_model=AnomalyScanJobResponse)
+async def get_anomaly_scan(
+    job_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    job = anomaly_scanner.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Scan job not found")
+    return job.info()
+
+@router.delete("/anomalies/scan/{job_id}", response_model=AnomalyScanJobResponse)
+async def cancel_anomaly_scan(
+    job_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    job = anomaly_scanner.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Scan job not found")
+    return job.info()
@@ -0,0 +1,186 @@
+from app.core.config import settings
+from app.db.influxdb import from_epoch_ms
+from app.db.postgres import SessionLocal
+from app.models.models import Anomaly
+from typing import Dict, List, Optional, Tuple
+import logging
+import math
+import threading
+import numpy as np
+
+logger = logging.getLogger("anomaly")
+
+STATE_FIELDS = ("mean", "var", "fast", "count", "last_ts", "shifted", "run")
+# Consecutive same-direction outliers that make a level shift rather than spikes
+PATTERN_RUN = 3
+
+class OnlineAnomalyDetector:
+    """Per-device EWMA detector run on readings as they are ingested.
+
+    Each device keeps O(1) state: an EWMA mean and variance, a faster EWMA
+    of the level, the current outlier run and the last timestamp seen. After `warmup` readings, a
+    reading more than `threshold` standard deviations above or below the
+    mean is a spike or drop (and is clipped before it updates the state),
+    and the fast level drifting more than `shift_threshold` deviations from
+    the slow mean, or a run of PATTERN_RUN outliers in one direction, flags
+    an unusual_pattern once per excursion. Readings at
+    or before a device's last timestamp (duplicates, late arrivals) are
+    ignored, so state only moves forward in time.
+    """
+
+    def __init__(self, alpha: float, shift_alpha: float, threshold: float, shift_threshold: float, warmup: int):
+        self.alpha = alpha
+        self.shift_alpha = shift_alpha
+        self.threshold = threshold
+        self.shift_threshold = shift_threshold
+        self.warmup = warmup
+        self._slots: Dict[str, int] = {}
+        self._state = {name: np.zeros(64) for name in STATE_FIELDS}
+        self._state["last_ts"][:] = -np.inf
+        self._lock = threading.Lock()
+
+        self.readings = 0
+        self.flagged = {"spike": 0, "drop": 0, "unusual_pattern": 0}
+
+    def _slots_for(self, device_ids: List[str]) -> np.ndarray:
+        for device_id in device_ids:
+            if device_id not in self._slots:
+                self._slots[device_id] = len(self._slots)
+        capacity = len(self._state["mean"])
+        if len(self._slots) > capacity:
+            grown = max(capacity * 2, len(self._slots))
+            for name, column in self._state.items():
+                fill = -np.inf if name == "last_ts" else 0.0
+                self._state[name] = np.concatenate([column, np.full(grown - capacity, fill)])
+        return np.fromiter((self._slots[d] for d in device_ids), dtype=np.int64, count=len(device_ids))
+
+    def update(self, device_ids: List[str], timestamps: np.ndarray, values: np.ndarray) -> List[dict]:
+        """Feed a batch of readings; returns the anomalies it contains"""
+        if not device_ids:
+            return []
+        anomalies = []
+        with self._lock:
+            slots = self._slots_for(device_ids)
+            order = np.lexsort((timestamps, slots))
+            slots, timestamps, values = slots[order], timestamps[order], values[order]
+            starts = np.flatnonzero(np.r_[True, slots[1:] != slots[:-1]])
+            rank = np.arange(len(slots)) - np.repeat(starts, np.diff(np.r_[starts, len(slots)]))
+            names = np.array(list(self._slots), dtype=object)
+
+            # Round k updates every device's k-th reading at once, so devices are
+            # vectorized while each device's readings stay sequential
+            st = self._state
+            for k in range(int(rank.max()) + 1):
+                sel = np.flatnonzero(rank == k)
+                s, t, v = slots[sel], timestamps[sel], values[sel]
+                fresh = t > st["last_ts"][s]
+                s, t, v = s[fresh], t[fresh], v[fresh]
+                if not len(s):
+                    continue
+
+                mean, var, fast, count = st["mean"][s], st["var"][s], st["fast"][s], st["count"][s]
+                first = count == 0
+                mean = np.where(first, v, mean)
+                fast = np.where(first, v, fast)
+                std = np.maximum(np.sqrt(var), 1e-3)
+                warm = count >= self.warmup
+                z = (v - mean) / std
+                outlier = warm & (np.abs(z) > self.threshold)
+                clipped = np.clip(v, mean - self.threshold * std, mean + self.threshold * std)
+                clipped = np.where(outlier, clipped, v)
+
+                delta = clipped - mean
+                new_mean = mean + self.alpha * delta
+                new_var = (1 - self.alpha) * (var + self.alpha * delta * delta)
+                fast = fast + self.shift_alpha * (clipped - fast)
+                shift_z = (fast - new_mean) / np.maximum(np.sqrt(new_var), 1e-3)
+                sign = np.where(outlier, np.sign(z), 0.0)
+                run = st["run"][s]
+                run = np.where(sign == 0, 0.0, np.where(np.sign(run) == sign, run + sign, sign))
+                shifted = st["shifted"][s] > 0
+                # Hysteresis: flag on crossing, re-arm once the level is back near the mean.
+                # Outliers inside a sustained excursion belong to it rather than being spikes
+                pattern = warm & ~shifted & ((np.abs(shift_z) > self.shift_threshold) | (np.abs(run) >= PATTERN_RUN))
+                isolated = outlier & ~shifted & ~pattern
+                spike = isolated & (z > 0)
+                drop = isolated & (z < 0)
+                shifted = np.where(shifted, outlier | (np.abs(shift_z) > self.shift_threshold / 2), pattern)
+
+                st["mean"][s], st["var"][s], st["fast"][s] = new_mean, new_var, fast
+                st["count"][s] = count + 1
+                st["last_ts"][s] = t
+                st["shifted"][s] = shifted
+                st["run"][s] = run
+
+                pattern_z = np.where(outlier, z, shift_z)
+                for kind, mask, score in (("spike", spike, z), ("drop", drop, z), ("unusual_pattern", pattern, pattern_z)):
+                    for i in np.flatnonzero(mask):
+                        anomalies.append({
+                            "device_id": names[s[i]],
+                            "timestamp": int(t[i]),
+                            "value": float(v[i]),
+                            "expected": float(mean[i]),
+                            "score": float(score[i]),
+                            # Two-sided normal probability of a deviation this small
+                            "confidence": math.erf(abs(float(score[i])) / math.sqrt(2)),
+                            "type": kind,
+                        })
+                        self.flagged[kind] += 1
+            self.readings += len(device_ids)
+        return anomalies
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "devices": len(self._slots),
+                "readings": self.readings,
+                "flagged": dict(self.flagged),
+            }
+
+def save_anomalies(anomalies: List[dict], replace: Optional[Tuple[List[str], int, int]] = None,
+                   raise_errors: bool = False):
+    """Persist flagged readings; failures are logged rather than failing ingest.
+
+    `replace` is (device_ids, start, end): those devices' stored anomalies in
+    that range are deleted in the same transaction, as a re-scan supersedes them.
+    With `raise_errors` a failure is re-raised after the rollback.
+    """
+    if not anomalies and replace is None:
+        return
+    db = SessionLocal()
+    try:
+        if replace is not None:
+            device_ids, start, end = replace
+            db.query(Anomaly).filter(
+                Anomaly.device_id.in_(device_ids),
+                Anomaly.timestamp >= from_epoch_ms(start),
+                Anomaly.timestamp <= from_epoch_ms(end)
+            ).delete(synchronize_session=False)
+        db.add_all([
+            Anomaly(
+                device_id=anomaly["device_id"],
+                timestamp=from_epoch_ms(anomaly["timestamp"]),
+                value=anomaly["value"],
+                expected=anomaly["expected"],
+                score=anomaly["score"],
+                confidence=anomaly["confidence"],
+                type=anomaly["type"],
+            )
+            for anomaly in anomalies
+        ])
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to persist {len(anomalies)} anomalies: {str(e)}")
+        if raise_errors:
+            raise
+    finally:
+        db.close()
+
+anomaly_detector = OnlineAnomalyDetector(
+    alpha=settings.ANOMALY_EWMA_ALPHA,
+    shift_alpha=settings.ANOMALY_SHIFT_ALPHA,
+    threshold=settings.ANOMALY_Z_THRESHOLD,
+    shift_threshold=settings.ANOMALY_SHIFT_THRESHOLD,
+    warmup=settings.ANOMALY_WARMUP_POINTS,
+)
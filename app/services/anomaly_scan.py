@@ -0,0 +1,301 @@
+from app.core.config import settings
+from app.db.aggregation import query_matrix
+from app.db.influxdb import influx_client
+from app.services.anomaly import save_anomalies
+from app.services.compute_pool import compute_pool
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import asyncio
+import functools
+import logging
+import math
+import time
+import uuid
+import numpy as np
+
+logger = logging.getLogger("anomaly_scan")
+
+DAY_MS = 86_400_000
+SEASONS = {"none": None, "day": DAY_MS, "week": 7 * DAY_MS}
+# Scales a median absolute deviation to a normal standard deviation
+MAD_SCALE = 1.4826
+# Elements of the (rows, buckets, window) block the rolling statistics sort at once
+SCAN_BLOCK_ELEMENTS = 8_000_000
+
+def _nanmedian(a: np.ndarray, axis: int) -> np.ndarray:
+    """Median ignoring NaNs via one sort (NaNs sort last); NaN where nothing is left"""
+    a = np.sort(a, axis=axis)
+    valid = (~np.isnan(a)).sum(axis=axis, keepdims=True)
+    lo = np.take_along_axis(a, np.maximum(valid - 1, 0) // 2, axis=axis)
+    hi = np.take_along_axis(a, valid // 2, axis=axis)
+    median = (lo + np.where(valid % 2 == 1, lo, hi)) / 2
+    median[valid == 0] = np.nan
+    return np.squeeze(median, axis=axis)
+
+def seasonal_level(matrix: np.ndarray, period: int) -> np.ndarray:
+    """Each row's level: the median of every `period` consecutive buckets, broadcast over them.
+
+    A span of one full season covers every seasonal position once, so its
+    median moves with the level but not with the seasonal shape. A trailing
+    partial span takes the level of the last full one.
+    """
+    n, t = matrix.shape
+    if t < period:
+        return np.broadcast_to(_nanmedian(matrix, axis=1)[:, None], matrix.shape)
+    spans = t // period
+    levels = _nanmedian(matrix[:, :spans * period].reshape(n, spans, period), axis=2)
+    level = np.repeat(levels, period, axis=1)
+    if t > spans * period:
+        tail = _nanmedian(matrix[:, t - period:], axis=1)
+        level = np.concatenate([level, np.repeat(tail[:, None], t - spans * period, axis=1)], axis=1)
+    return level
+
+def seasonal_profile(matrix: np.ndarray, phase: int, period: Optional[int]) -> np.ndarray:
+    """Each row's median per seasonal position, broadcast back over its buckets.
+
+    `period` is the season length in buckets and `phase` the first bucket's
+    position within it; without a period the profile is the row median.
+    The profile is taken after removing the seasonal level, so it holds only
+    the seasonal shape: a level shift part way through a season would
+    otherwise split each position's median between the two levels and
+    repeat the step in every season.
+    """
+    if period is None:
+        return np.broadcast_to(_nanmedian(matrix, axis=1)[:, None], matrix.shape)
+    n, t = matrix.shape
+    cycles = -(-(phase + t) // period)
+    padded = np.full((n, cycles * period), np.nan)
+    padded[:, phase:phase + t] = matrix - seasonal_level(matrix, period)
+    profile = _nanmedian(padded.reshape(n, cycles, period), axis=1)
+    return np.tile(profile, cycles)[:, phase:phase + t]
+
+def _rolling(matrix: np.ndarray, points: int, before: int, after: int):
+    """Median, MAD and count of each `points`-bucket window, padding `before`/`after` with NaN"""
+    padded = np.pad(matrix, ((0, 0), (before, after)), constant_values=np.nan)
+    windows = np.lib.stride_tricks.sliding_window_view(padded, points, axis=1)
+    median = _nanmedian(windows, axis=2)
+    mad = _nanmedian(np.abs(windows - median[..., None]), axis=2)
+    return median, mad, (~np.isnan(windows)).sum(axis=2)
+
+def scan_task(arrays, points: int, phase: int, period: Optional[int]):
+    """Compute-pool task: robust scores for a (devices x buckets) `matrix`.
+
+    Each row's seasonal profile is removed first. `score` is a bucket's
+    robust z-score against the centered rolling median/MAD of `points`
+    residuals, and `shift` the step between the medians of the `points`
+    buckets after and before it (when both sides are at least half full).
+    Both are in units of at least the row's noise level, estimated from the
+    MAD of successive differences so that shifts and trends don't inflate
+    it, since a few buckets' MAD alone is too noisy.
+    `expected` is the profile plus the centered (for spikes) or preceding
+    (for shifts, in `baseline`) median. Rows are processed in blocks,
+    checking for cancellation between them.
+    """
+    matrix = arrays["matrix"]
+    n, t = matrix.shape
+    rows = max(1, SCAN_BLOCK_ELEMENTS // max(2 * t * points, 1))
+    half = points // 2
+    for lo in range(0, n, rows):
+        if arrays.cancelled():
+            return
+        block = matrix[lo:lo + rows]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            profile = seasonal_profile(block, phase, period)
+            residual = block - profile
+            scale = MAD_SCALE * _nanmedian(np.abs(np.diff(residual, axis=1)), axis=1) / np.sqrt(2)
+            scale = np.maximum(scale, 1e-3)[:, None]
+
+            median, mad, _ = _rolling(residual, points, half, points - 1 - half)
+            # Window i of the padded residuals covers the `points` buckets before bucket i,
+            # window i + points the ones starting at it
+            sides, _, counts = _rolling(residual, points, points, points)
+            before, after = sides[:, :t], sides[:, points:points + t]
+            full = np.minimum(counts[:, :t], counts[:, points:points + t]) >= (points + 1) // 2
+
+            arrays["score"][lo:lo + rows] = (residual - median) / np.maximum(MAD_SCALE * mad, scale)
+            arrays["shift"][lo:lo + rows] = np.where(full, (after - before) / scale, np.nan)
+            arrays["expected"][lo:lo + rows] = profile + median
+            arrays["baseline"][lo:lo + rows] = profile + before
+
+def classify(device_ids: List[str], grid: np.ndarray, matrix: np.ndarray, scores: Dict[str, np.ndarray],
+             threshold: float, shift_threshold: float) -> List[dict]:
+    """Anomaly rows from scan_task output: spikes/drops per bucket, one unusual_pattern per shift"""
+    score, shift = scores["score"], scores["shift"]
+    n, t = matrix.shape
+    # Only buckets with data can be reported: an anomaly row needs a value
+    present = ~np.isnan(matrix)
+    with np.errstate(invalid="ignore"):
+        outlier = (np.abs(score) > threshold) & present
+        shifted = (np.abs(shift) > shift_threshold).ravel()
+
+    # The step score ramps up over a window around a level shift; report each
+    # run above the threshold once, at its strongest bucket that has data
+    flat = np.flatnonzero(shifted)
+    starts = np.ones(len(flat), dtype=bool)
+    starts[1:] = (np.diff(flat) > 1) | (flat[1:] % t == 0)
+    run = np.cumsum(starts) - 1
+    strength = np.where(present.ravel()[flat], np.abs(shift.ravel()[flat]), -1.0)
+    peaks = flat[np.lexsort((-strength, run))][np.flatnonzero(starts)]
+    # A run with no data at all has nothing to report
+    peaks = peaks[present.ravel()[peaks]]
+    pattern = np.zeros(n * t, dtype=bool)
+    pattern[peaks] = True
+
+    anomalies = []
+    for kind, mask, values, expected in (
+        ("spike", outlier & (score > 0), score, scores["expected"]),
+        ("drop", outlier & (score < 0), score, scores["expected"]),
+        ("unusual_pattern", pattern.reshape(n, t), shift, scores["baseline"]),
+    ):
+        rows, cols = np.nonzero(mask)
+        for row, col in zip(rows.tolist(), cols.tolist()):
+            anomalies.append({
+                "device_id": device_ids[row],
+                "timestamp": int(grid[col]),
+                "value": float(matrix[row, col]),
+                "expected": float(expected[row, col]),
+                "score": float(values[row, col]),
+                "confidence": math.erf(abs(float(values[row, col])) / math.sqrt(2)),
+                "type": kind,
+            })
+    return anomalies
+
+class ScanJob:
+    def __init__(self, device_ids: List[str], start: int, end: int, window: int, season: str,
+                 points: int, threshold: float, shift_threshold: float):
+        self.id = uuid.uuid4().hex
+        self.device_ids = device_ids
+        self.start = start
+        self.end = end
+        self.window = window
+        self.season = season
+        self.points = points
+        self.threshold = threshold
+        self.shift_threshold = shift_threshold
+        self.status = "queued"
+        self.devices_done = 0
+        self.anomalies = 0
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "failed", "cancelled")
+
+    def info(self) -> dict:
+        total = len(self.device_ids)
+        return {
+            "jobId": self.id,
+            "status": self.status,
+            "progress": self.devices_done / total if total else 1.0,
+            "devicesDone": self.devices_done,
+            "devicesTotal": total,
+            "anomalies": self.anomalies,
+            "error": self.error,
+            "createdAt": self.created_at,
+            "finishedAt": self.finished_at,
+        }
+
+class AnomalyScanner:
+    """Runs historical anomaly scans as background jobs on the event loop.
+
+    A job walks its devices in chunks: each chunk is aggregated onto the
+    job's window grid, scored in the compute pool, classified and written
+    back, replacing whatever the chunk's devices had stored for the range.
+    Progress is counted in devices. Cancelling a job cancels its task,
+    which also abandons the chunk being computed; chunks already written
+    stay written.
+    """
+
+    def __init__(self, client, max_cells: int, timeout: float, max_jobs: int = 100):
+        self.client = client
+        self.max_cells = max_cells
+        self.timeout = timeout
+        # Finished jobs are kept for polling until this many newer jobs exist
+        self.max_jobs = max_jobs
+        self._jobs: "OrderedDict[str, ScanJob]" = OrderedDict()
+
+        self.scanned_cells = 0
+
+    def submit(self, job: ScanJob) -> ScanJob:
+        self._jobs[job.id] = job
+        while len(self._jobs) > self.max_jobs:
+            oldest = next((key for key, queued in self._jobs.items() if queued.finished), None)
+            if oldest is None:
+                break
+            del self._jobs[oldest]
+        job.task = asyncio.create_task(self._run(job), name=f"anomaly-scan-{job.id}")
+        return job
+
+    def get(self, job_id: str) -> Optional[ScanJob]:
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[ScanJob]:
+        job = self._jobs.get(job_id)
+        if job is not None and not job.finished and job.task is not None:
+            job.task.cancel()
+        return job
+
+    async def stop(self):
+        tasks = [job.task for job in self._jobs.values() if job.task is not None and not job.finished]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, job: ScanJob):
+        loop = asyncio.get_running_loop()
+        job.status = "running"
+        started = time.perf_counter()
+        period = SEASONS[job.season]
+        try:
+            n_buckets = job.end // job.window - job.start // job.window + 1
+            chunk = max(1, self.max_cells // n_buckets)
+            for lo in range(0, len(job.device_ids), chunk):
+                device_ids = job.device_ids[lo:lo + chunk]
+                grid, matrix, _ = await loop.run_in_executor(
+                    None, query_matrix, self.client, device_ids, job.start, job.end, job.window, "mean"
+                )
+                shape = (matrix.shape, "f8")
+                scores = await compute_pool.run(
+                    scan_task, {"matrix": matrix},
+                    {"score": shape, "shift": shape, "expected": shape, "baseline": shape},
+                    job.points,
+                    0 if period is None else int(grid[0] % period // job.window),
+                    None if period is None else period // job.window,
+                    timeout=self.timeout,
+                )
+                anomalies = classify(device_ids, grid, matrix, scores, job.threshold, job.shift_threshold)
+                # Unlike ingest, a scan that can't store its results has failed
+                await loop.run_in_executor(None, functools.partial(
+                    save_anomalies, anomalies, (device_ids, job.start, job.end), raise_errors=True
+                ))
+                job.devices_done += len(device_ids)
+                job.anomalies += len(anomalies)
+                self.scanned_cells += matrix.size
+            job.status = "completed"
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            logger.error(f"Anomaly scan {job.id} failed: {str(e)}")
+        finally:
+            job.finished_at = time.time()
+            logger.info(
+                f"Anomaly scan {job.id} {job.status}: {job.devices_done}/{len(job.device_ids)} devices, "
+                f"{job.anomalies} anomalies in {time.perf_counter() - started:.1f}s"
+            )
+
+    def stats(self) -> dict:
+        statuses: Dict[str, int] = {}
+        for job in self._jobs.values():
+            statuses[job.status] = statuses.get(job.status, 0) + 1
+        return {"jobs": statuses, "scanned_cells": self.scanned_cells}
+
+anomaly_scanner = AnomalyScanner(
+    influx_client,
+    max_cells=settings.BULK_MAX_CELLS,
+    timeout=settings.ANOMALY_SCAN_TIMEOUT_SECONDS,
+)
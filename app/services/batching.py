@@ -0,0 +1,127 @@
+from app.core.metrics import Histogram, LATENCY_BUCKETS, SIZE_BUCKETS
+from typing import Any, Callable, List, Optional
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger("batching")
+
+class MicroBatcher:
+    """Coalesces concurrent async calls into batched calls of a sync handler.
+
+    `submit()` queues one item and waits for its result. A collector task
+    takes the first queued item, keeps collecting until `max_batch` items or
+    `max_wait` seconds after that first item, then runs `handler(items)` in
+    the default executor. The handler returns one result per item, in order;
+    a result that is an Exception is raised in that caller only.
+    """
+
+    def __init__(self, handler: Callable[[List[Any]], List[Any]], max_batch: int, max_wait: float, name: str):
+        self.handler = handler
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.name = name
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # Items taken off the queue by the collector but not yet answered
+        self._current: list = []
+
+        self.batches = 0
+        self.items = 0
+        self.errors = 0
+        self.batch_size = Histogram(SIZE_BUCKETS)
+        self.queue_wait = Histogram(LATENCY_BUCKETS)
+        self.handler_latency = Histogram(LATENCY_BUCKETS)
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    async def start(self):
+        if self.running:
+            return
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run(), name=f"batcher-{self.name}")
+
+    async def stop(self):
+        if not self.running:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        # Whatever was still queued or mid-batch is answered in one last batch
+        pending = [entry for entry in self._current if not entry[2].done()]
+        self._current = []
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        if pending:
+            await self._dispatch(pending)
+
+    async def submit(self, item: Any) -> Any:
+        if not self.running:
+            # Not started (scripts, shutdown): answer the call on its own
+            result = (await asyncio.get_running_loop().run_in_executor(None, self.handler, [item]))[0]
+            if isinstance(result, Exception):
+                raise result
+            return result
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((time.monotonic(), item, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            batch = self._current = [await self._queue.get()]
+            deadline = batch[0][0] + self.max_wait
+            while len(batch) < self.max_batch:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._dispatch(batch)
+            self._current = []
+
+    async def _dispatch(self, batch: list):
+        now = time.monotonic()
+        for enqueued_at, _, _ in batch:
+            self.queue_wait.observe(now - enqueued_at)
+        self.batch_size.observe(len(batch))
+        self.batches += 1
+        self.items += len(batch)
+
+        started = time.perf_counter()
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(
+                None, self.handler, [item for _, item, _ in batch]
+            )
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Batch of {len(batch)} failed in {self.name}: {str(e)}")
+            results = [e] * len(batch)
+        finally:
+            self.handler_latency.observe(time.perf_counter() - started)
+
+        for (_, _, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "batches": self.batches,
+            "items": self.items,
+            "errors": self.errors,
+            "batch_size": self.batch_size.snapshot(),
+            "queue_wait_seconds": self.queue_wait.snapshot(),
+            "handler_seconds": self.handler_latency.snapshot(),
+        }
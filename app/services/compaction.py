@@ -0,0 +1,81 @@
+from app.core.config import settings
+from app.core.metrics import Histogram, LATENCY_BUCKETS
+from app.db.influxdb import influx_client
+from typing import Optional
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger("compaction")
+
+HOUR_MS = 3_600_000
+
+class CompactionService:
+    """Periodically applies retention policies and compacts the time-series store"""
+
+    def __init__(self, client, interval: float):
+        self.client = client
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+        self.runs = 0
+        self.errors = 0
+        self.duration = Histogram(LATENCY_BUCKETS + (10.0, 30.0, 60.0))
+        self.reclaimed_heap_bytes = 0
+        self.reclaimed_disk_bytes = 0
+        self.last_result: dict = {}
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="compaction")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await loop.run_in_executor(None, self.run_once)
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Compaction failed: {str(e)}")
+
+    def run_once(self, now_ms: Optional[int] = None) -> dict:
+        now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+        raw_cutoffs = {
+            measurement: now_ms - int(hours * HOUR_MS)
+            for measurement, hours in settings.RETENTION_HOURS.items()
+        }
+        rollup_cutoffs = {
+            tier: now_ms - int(hours * HOUR_MS)
+            for tier, hours in settings.ROLLUP_RETENTION_HOURS.items()
+        }
+
+        started = time.perf_counter()
+        result = self.client.compact(raw_cutoffs, rollup_cutoffs)
+        elapsed = time.perf_counter() - started
+
+        self.runs += 1
+        self.duration.observe(elapsed)
+        self.reclaimed_heap_bytes += result["reclaimed_heap_bytes"]
+        self.reclaimed_disk_bytes += result["reclaimed_disk_bytes"]
+        self.last_result = {**result, "duration_seconds": elapsed}
+        logger.info(f"Compaction finished in {elapsed:.3f}s: {result}")
+        return self.last_result
+
+    def stats(self) -> dict:
+        return {
+            "runs": self.runs,
+            "errors": self.errors,
+            "reclaimed_heap_bytes": self.reclaimed_heap_bytes,
+            "reclaimed_disk_bytes": self.reclaimed_disk_bytes,
+            "duration_seconds": self.duration.snapshot(),
+            "last_run": self.last_result,
+        }
+
+compaction_service = CompactionService(influx_client, interval=settings.COMPACTION_INTERVAL_SECONDS)
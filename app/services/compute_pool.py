@@ -0,0 +1,220 @@
+from app.core.config import settings
+from app.core.metrics import Histogram, LATENCY_BUCKETS
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeout
+from multiprocessing import get_context, shared_memory
+from typing import Callable, Dict, List, Optional, Tuple
+import asyncio
+import importlib
+import logging
+import time
+import numpy as np
+
+logger = logging.getLogger("compute_pool")
+
+# (name, dtype, shape, byte offset) of every array in a task's shared block
+Layout = List[Tuple[str, str, Tuple[int, ...], int]]
+# Byte 0 of the block is the cancel flag; arrays start 8-byte aligned after it
+HEADER_BYTES = 8
+
+class ComputeTimeout(TimeoutError):
+    pass
+
+class TaskArrays(dict):
+    """Named array views over a task's shared block plus its cancel flag"""
+
+    def __init__(self, buffer, layout: Layout):
+        super().__init__(
+            (name, np.ndarray(shape, dtype=dtype, buffer=buffer, offset=offset))
+            for name, dtype, shape, offset in layout
+        )
+        self._flag = np.ndarray((1,), dtype=np.uint8, buffer=buffer, offset=0)
+
+    def cancelled(self) -> bool:
+        """Long tasks check this between steps and return early once it is set"""
+        return bool(self._flag[0])
+
+    def cancel(self):
+        self._flag[0] = 1
+
+def _layout(inputs: Dict[str, np.ndarray], outputs: Dict[str, Tuple[Tuple[int, ...], str]]) -> Tuple[Layout, int]:
+    layout: Layout = []
+    offset = HEADER_BYTES
+    specs = [(name, array.dtype.str, array.shape) for name, array in inputs.items()]
+    specs += [(name, np.dtype(dtype).str, tuple(shape)) for name, (shape, dtype) in outputs.items()]
+    for name, dtype, shape in specs:
+        layout.append((name, dtype, shape, offset))
+        offset += -(-int(np.prod(shape, dtype=np.int64)) * np.dtype(dtype).itemsize // 8) * 8
+    return layout, offset
+
+def _invoke(fn: Callable, shm_name: str, layout: Layout, args: tuple):
+    """Worker-side entry: attach to the shared block and run the task in place"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        arrays = TaskArrays(shm.buf, layout)
+        result = fn(arrays, *args)
+        # Views must be gone before the mapping can be closed
+        del arrays
+        return result
+    finally:
+        try:
+            shm.close()
+        except BufferError:
+            # A failed task's traceback can still hold views; the mapping goes with them
+            pass
+
+def _preload(modules: Tuple[str, ...]):
+    for module in modules:
+        importlib.import_module(module)
+
+def _warm():
+    pass
+
+class ComputePool:
+    """Process pool for CPU-bound ML work, fed through shared memory.
+
+    A task's input arrays are copied once into a shared memory block that also
+    holds its preallocated outputs, so only the block name and layout are
+    pickled. `run_sync` (for executor threads) and `run` (for the event loop)
+    wait at most `timeout` seconds; on timeout the task is cancelled if still
+    queued, or flagged so a running task stops at its next checkpoint, and the
+    caller gets ComputeTimeout straight away. With zero workers, or before
+    start(), tasks run in the calling thread.
+    """
+
+    def __init__(self, workers: int, timeout: float, preload: Tuple[str, ...] = ()):
+        self.workers = workers
+        self.timeout = timeout
+        # Modules holding task functions, imported as each worker starts
+        self.preload = preload
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+        self.tasks = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.latency = Histogram(LATENCY_BUCKETS + (10.0, 30.0, 60.0))
+
+    def start(self):
+        if self._executor is None and self.workers > 0:
+            # forkserver children don't inherit this process' threads and locks
+            self._executor = ProcessPoolExecutor(
+                self.workers, mp_context=get_context("forkserver"), initializer=_preload, initargs=(self.preload,)
+            )
+            # Start the workers now rather than on the first request
+            for _ in range(self.workers):
+                self._executor.submit(_warm)
+            logger.info(f"Compute pool started with {self.workers} workers")
+
+    def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def _submit(self, fn: Callable, inputs: Dict[str, np.ndarray],
+                outputs: Dict[str, Tuple[Tuple[int, ...], str]], args: tuple):
+        layout, size = _layout(inputs, outputs)
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        arrays = TaskArrays(shm.buf, layout)
+        arrays._flag[0] = 0
+        for name, array in inputs.items():
+            arrays[name][...] = array
+        future = self._executor.submit(_invoke, fn, shm.name, layout, args)
+        return shm, arrays, future
+
+    @staticmethod
+    def _collect(shm, arrays: TaskArrays, outputs) -> Dict[str, np.ndarray]:
+        result = {name: arrays[name].copy() for name in outputs}
+        arrays.clear()
+        del arrays._flag
+        shm.close()
+        shm.unlink()
+        return result
+
+    def _abandon(self, shm, arrays: TaskArrays, future: Future):
+        """Cancel a task, releasing its block once no worker can touch it"""
+        arrays.cancel()
+        arrays.clear()
+        del arrays._flag
+        future.cancel()
+
+        def release(_):
+            shm.close()
+            shm.unlink()
+        future.add_done_callback(release)
+
+    def _inline(self, fn: Callable, inputs: Dict[str, np.ndarray],
+                outputs: Dict[str, Tuple[Tuple[int, ...], str]], args: tuple) -> Dict[str, np.ndarray]:
+        layout, size = _layout(inputs, outputs)
+        buffer = bytearray(size)
+        arrays = TaskArrays(buffer, layout)
+        for name, array in inputs.items():
+            arrays[name][...] = array
+        fn(arrays, *args)
+        return {name: arrays[name] for name in outputs}
+
+    def run_sync(self, fn: Callable, inputs: Dict[str, np.ndarray], outputs: Dict[str, Tuple[Tuple[int, ...], str]],
+                 *args, timeout: Optional[float] = None) -> Dict[str, np.ndarray]:
+        """Run `fn(arrays, *args)` in a worker and return its output arrays"""
+        started = time.perf_counter()
+        self.tasks += 1
+        try:
+            if self._executor is None:
+                return self._inline(fn, inputs, outputs, args)
+            shm, arrays, future = self._submit(fn, inputs, outputs, args)
+            try:
+                future.result(timeout=self.timeout if timeout is None else timeout)
+            except FutureTimeout:
+                self.timeouts += 1
+                self._abandon(shm, arrays, future)
+                raise ComputeTimeout(f"{fn.__name__} exceeded {self.timeout if timeout is None else timeout}s")
+            except BaseException:
+                self._collect(shm, arrays, outputs)
+                raise
+            return self._collect(shm, arrays, outputs)
+        except ComputeTimeout:
+            raise
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.latency.observe(time.perf_counter() - started)
+
+    async def run(self, fn: Callable, inputs: Dict[str, np.ndarray], outputs: Dict[str, Tuple[Tuple[int, ...], str]],
+                  *args, timeout: Optional[float] = None) -> Dict[str, np.ndarray]:
+        """Awaitable run_sync; cancelling the awaiting task cancels the computation too"""
+        loop = asyncio.get_running_loop()
+        if self._executor is None:
+            return await loop.run_in_executor(None, lambda: self._inline(fn, inputs, outputs, args))
+        started = time.perf_counter()
+        self.tasks += 1
+        shm, arrays, future = self._submit(fn, inputs, outputs, args)
+        try:
+            await asyncio.wait_for(asyncio.wrap_future(future), self.timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            self._abandon(shm, arrays, future)
+            raise ComputeTimeout(f"{fn.__name__} exceeded {self.timeout if timeout is None else timeout}s")
+        except asyncio.CancelledError:
+            self._abandon(shm, arrays, future)
+            raise
+        except Exception:
+            self.errors += 1
+            self._collect(shm, arrays, outputs)
+            raise
+        finally:
+            self.latency.observe(time.perf_counter() - started)
+        return self._collect(shm, arrays, outputs)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers if self._executor is not None else 0,
+            "tasks": self.tasks,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "latency_seconds": self.latency.snapshot(),
+        }
+
+compute_pool = ComputePool(
+    workers=settings.ML_COMPUTE_WORKERS,
+    timeout=settings.ML_COMPUTE_TIMEOUT_SECONDS,
+    preload=("app.services.forecaster", "app.services.anomaly_scan"),
+)
@@ -0,0 +1,96 @@
+from app.core.config import settings
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Tuple
+import threading
+import time
+
+class _Flight:
+    """One in-progress computation that identical callers wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Any = None
+
+class ForecastCache:
+    """TTL + LRU cache of computed forecasts with single-flight misses.
+
+    Keys carry everything a forecast depends on (model versions, the data
+    watermark hour, the horizon), so a changed model or new data simply
+    produces a new key and old entries age out. On a miss the first caller
+    computes while identical concurrent callers wait for its result, or
+    its exception, instead of computing again. Errors are not cached.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        leader = False
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+                self.expirations += 1
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.shared += 1
+            else:
+                flight = self._flights[key] = _Flight()
+                self.misses += 1
+                leader = True
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = compute()
+        except BaseException as e:
+            flight.error = e
+            raise
+        else:
+            with self._lock:
+                self._entries[key] = (time.monotonic() + self.ttl, flight.value)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+            return flight.value
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "shared": self.shared,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+                "in_flight": len(self._flights),
+            }
+
+forecast_cache = ForecastCache(
+    max_entries=settings.FORECAST_CACHE_MAX_ENTRIES,
+    ttl=settings.FORECAST_CACHE_TTL_SECONDS,
+)
@@ -0,0 +1,184 @@
+from app.core.config import settings
+from app.db.influxdb import influx_client
+from app.services.compute_pool import compute_pool
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import logging
+import threading
+import time
+import numpy as np
+
+logger = logging.getLogger("forecaster")
+
+HOUR_MS = 3_600_000
+DAY_MS = 24 * HOUR_MS
+# Hour-of-week slots (epoch-aligned, UTC), i.e. hour-of-day x day-of-week
+SLOTS = 7 * 24
+
+class SeasonalModel(NamedTuple):
+    """Per-device hour-of-week levels plus a linear trend (per day) around `t_ref`"""
+    levels: np.ndarray
+    slope: float
+    t_ref: int
+    fitted_through: int
+
+    def predict(self, timestamps: np.ndarray) -> np.ndarray:
+        slots = timestamps // HOUR_MS % SLOTS
+        trend = self.slope * (timestamps - self.t_ref) / DAY_MS
+        # Consumption can't go negative however the trend extrapolates
+        return np.maximum(self.levels[slots] + trend, 0.0)
+
+def _nanmean(a: np.ndarray, axis: int) -> np.ndarray:
+    seen = ~np.isnan(a)
+    return np.nansum(a, axis=axis, keepdims=True) / seen.sum(axis=axis, keepdims=True)
+
+def _fit_arrays(index: np.ndarray, timestamps: np.ndarray, values: np.ndarray, n_series: int,
+                min_points: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """(levels, slope, t_ref, fitted) for many series; see fit_many"""
+    t_ref = np.zeros(n_series, dtype=np.int64)
+    np.maximum.at(t_ref, index, timestamps)
+    t = (timestamps - t_ref[index]) / DAY_MS
+    cells = index * SLOTS + timestamps // HOUR_MS % SLOTS
+    size = n_series * SLOTS
+
+    counts = np.bincount(cells, minlength=size)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_t = np.bincount(cells, weights=t, minlength=size) / counts
+        mean_y = np.bincount(cells, weights=values, minlength=size) / counts
+        dt = t - mean_t[cells]
+        dy = values - mean_y[cells]
+        sxy = np.bincount(index, weights=dt * dy, minlength=n_series)
+        sxx = np.bincount(index, weights=dt * dt, minlength=n_series)
+        # No variation of time within any slot (e.g. under a week of data): no trend
+        slope = np.where(sxx > 1e-12, sxy / sxx, 0.0)
+
+        levels = (mean_y - slope.repeat(SLOTS) * mean_t).reshape(n_series, 7, 24)
+        levels = np.where(np.isnan(levels), _nanmean(levels, axis=1), levels).reshape(n_series, SLOTS)
+        levels = np.where(np.isnan(levels), _nanmean(levels, axis=1), levels)
+
+    fitted = np.bincount(index, minlength=n_series) >= max(min_points, 1)
+    return levels, slope, t_ref, fitted
+
+def fit_many(index: np.ndarray, timestamps: np.ndarray, values: np.ndarray, n_series: int,
+             min_points: int = 1) -> List[Optional[SeasonalModel]]:
+    """Least-squares fit of slot levels plus trend for many series at once.
+
+    With one-hot slot columns the trend slope is the regression of values on
+    time after both are demeaned within each (series, slot) cell, and each
+    level is that cell's mean minus slope x its mean time. Everything reduces
+    to bincounts over the flat points, so the cost is linear in the history.
+    Slots a series has never seen fall back to that hour-of-day across the
+    week, then to the series mean. Series with fewer than `min_points`
+    observations get None.
+    """
+    if not len(timestamps):
+        return [None] * n_series
+    levels, slope, t_ref, fitted = _fit_arrays(index, timestamps, values, n_series, min_points)
+    return _models(levels, slope, t_ref, fitted)
+
+def _models(levels: np.ndarray, slope: np.ndarray, t_ref: np.ndarray, fitted: np.ndarray) -> List[Optional[SeasonalModel]]:
+    return [
+        SeasonalModel(levels[i].copy(), float(slope[i]), int(t_ref[i]), int(t_ref[i])) if fitted[i] else None
+        for i in range(len(fitted))
+    ]
+
+def fit_task(arrays, n_series: int, min_points: int, chunk: int = 256):
+    """Compute-pool task: fit_many over shared `index`/`timestamps`/`values`, `chunk` series at a time.
+
+    Expects `index` sorted and fills the `levels`, `slope`, `t_ref` and
+    `fitted` outputs, checking for cancellation between chunks.
+    """
+    index = arrays["index"]
+    bounds = np.searchsorted(index, np.arange(0, n_series + chunk, chunk))
+    for step, lo in enumerate(range(0, n_series, chunk)):
+        if arrays.cancelled():
+            return
+        a, b = bounds[step], bounds[step + 1]
+        n = min(chunk, n_series - lo)
+        if a == b:
+            arrays["fitted"][lo:lo + n] = False
+            continue
+        levels, slope, t_ref, fitted = _fit_arrays(
+            index[a:b] - lo, arrays["timestamps"][a:b], arrays["values"][a:b], n, min_points
+        )
+        arrays["levels"][lo:lo + n] = levels
+        arrays["slope"][lo:lo + n] = slope
+        arrays["t_ref"][lo:lo + n] = t_ref
+        arrays["fitted"][lo:lo + n] = fitted
+
+class SeasonalForecaster:
+    """Fits and caches a SeasonalModel per device from the hourly rollups.
+
+    A device's cached model is refitted once a newer hour of data has
+    arrived for it; `fit_devices` refreshes many devices in one pass.
+    """
+
+    def __init__(self, client, history_days: int, min_hours: int):
+        self.client = client
+        self.history_days = history_days
+        self.min_hours = min_hours
+        self._models: Dict[str, SeasonalModel] = {}
+        self._lock = threading.Lock()
+
+        self.fits = 0
+        self.fit_seconds = 0.0
+
+    def outdated(self, device_id: str, model: SeasonalModel) -> bool:
+        """Whether a newer hour of data than `model` was fitted through has arrived for the device"""
+        watermark = self.client.watermark(device_id)
+        return watermark is not None and watermark // HOUR_MS > model.fitted_through // HOUR_MS
+
+    def _stale(self, device_id: str) -> bool:
+        model = self._models.get(device_id)
+        return model is None or self.outdated(device_id, model)
+
+    def fit_devices(self, device_ids: List[str], now_ms: Optional[int] = None) -> int:
+        """Refit the given devices from their hourly history; returns how many got a model"""
+        if not device_ids:
+            return 0
+        now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+        started = time.perf_counter()
+        index, rows = self.client.query_rollup_many(device_ids, "1h", now_ms - self.history_days * DAY_MS, now_ms)
+        values = rows["sum"] / np.maximum(rows["count"], 1)
+        n = len(device_ids)
+        # The least-squares fit runs in a worker process so request threads only wait on it
+        fit = compute_pool.run_sync(
+            fit_task,
+            {"index": index, "timestamps": rows["bucket"], "values": values},
+            {"levels": ((n, SLOTS), "f8"), "slope": ((n,), "f8"), "t_ref": ((n,), "i8"), "fitted": ((n,), "?")},
+            n, self.min_hours,
+        )
+        models = _models(fit["levels"], fit["slope"], fit["t_ref"], fit["fitted"])
+
+        with self._lock:
+            for device_id, model in zip(device_ids, models):
+                if model is None:
+                    self._models.pop(device_id, None)
+                else:
+                    self._models[device_id] = model
+            self.fits += len(device_ids)
+            self.fit_seconds += time.perf_counter() - started
+        return sum(model is not None for model in models)
+
+    def model(self, device_id: str) -> Optional[SeasonalModel]:
+        if self._stale(device_id):
+            self.fit_devices([device_id])
+        return self._models.get(device_id)
+
+    def models(self) -> Dict[str, SeasonalModel]:
+        """Snapshot of the fitted models, for checkpointing"""
+        with self._lock:
+            return dict(self._models)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "models": len(self._models),
+                "fits": self.fits,
+                "fit_seconds": self.fit_seconds,
+            }
+
+seasonal_forecaster = SeasonalForecaster(
+    influx_client,
+    history_days=settings.FORECAST_HISTORY_DAYS,
+    min_hours=settings.FORECAST_MIN_HOURS,
+)
@@ -0,0 +1,231 @@
+from app.core.config import settings
+from app.core.metrics import Histogram, LATENCY_BUCKETS, SIZE_BUCKETS
+from app.db.influxdb import to_epoch_ms
+from app.db.write_buffer import write_buffer
+from app.services.anomaly import anomaly_detector, save_anomalies
+from typing import List, Optional, Tuple
+import asyncio
+import itertools
+import logging
+import threading
+import time
+import numpy as np
+
+logger = logging.getLogger("ingest")
+
+QUEUE_POLICIES = ("block", "drop_newest", "drop_oldest")
+
+class IngestService:
+    """Bounded asyncio queue between message receipt and storage.
+
+    Receivers call `submit()` with a list of validated payloads; a pool of
+    consumer tasks drains the queue in batches and hands them to `process()`.
+    Batches are numbered as they leave the queue and stored strictly in
+    that order, even though several consumers run at once, because the
+    detectors and models downstream only move forward in time.
+    When the queue is full the configured policy either blocks the receiver
+    (backpressure) or drops the newest / oldest message.
+    """
+
+    def __init__(self, queue_size: int, workers: int, policy: str, max_batch: int):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"Unknown ingest queue policy: {policy}")
+        self.queue_size = queue_size
+        self.workers = workers
+        self.policy = policy
+        self.max_batch = max_batch
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        # Batches take tickets in queue order and are stored when theirs is served;
+        # tickets whose job was cancelled before it started are skipped
+        self._tickets = itertools.count()
+        self._turn = threading.Condition()
+        self._serving = 0
+        self._started = set()
+        self._cancelled = set()
+
+        self.enqueued = 0
+        self.processed = 0
+        self.dropped = 0
+        self.invalid = 0
+        self.errors = 0
+        self.last_lag = 0.0
+        self.queue_wait = Histogram(LATENCY_BUCKETS)
+        self.batch_size = Histogram(SIZE_BUCKETS)
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    async def start(self):
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [
+            asyncio.create_task(self._consume(), name=f"ingest-worker-{i}")
+            for i in range(self.workers)
+        ]
+        logger.info(f"Ingest service started with {self.workers} workers (policy={self.policy})")
+
+    async def stop(self, timeout: float = 10.0):
+        """Drain whatever is queued, then cancel the consumers"""
+        if not self.running:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Ingest queue not drained on shutdown, {self._queue.qsize()} messages left")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info("Ingest service stopped")
+
+    async def submit(self, payloads: List[dict]) -> bool:
+        """Queue payloads for storage; returns False if they were dropped"""
+        if not payloads:
+            return True
+        item = (time.monotonic(), payloads)
+
+        if self.policy == "block":
+            await self._queue.put(item)
+        else:
+            try:
+                self._queue.put_nowait(item)
+            except asyncio.QueueFull:
+                if self.policy == "drop_newest":
+                    self.dropped += len(payloads)
+                    return False
+                _, evicted = self._queue.get_nowait()
+                self._queue.task_done()
+                self.dropped += len(evicted)
+                self._queue.put_nowait(item)
+
+        self.enqueued += len(payloads)
+        return True
+
+    async def _consume(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self._queue.get()]
+            count = len(items[0][1])
+            while count < self.max_batch and not self._queue.empty():
+                items.append(self._queue.get_nowait())
+                count += len(items[-1][1])
+
+            now = time.monotonic()
+            for enqueued_at, _ in items:
+                self.queue_wait.observe(now - enqueued_at)
+            self.last_lag = now - items[0][0]
+
+            payloads = [payload for _, batch in items for payload in batch]
+            # Taken before yielding so tickets follow queue order
+            ticket = next(self._tickets)
+            try:
+                # Storage work runs off the event loop so request handlers stay responsive
+                stored = await loop.run_in_executor(None, self.process, payloads, ticket)
+                self.processed += stored
+            except asyncio.CancelledError:
+                self._cancel(ticket)
+                raise
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Error processing ingest batch: {str(e)}")
+            finally:
+                self.batch_size.observe(len(payloads))
+                for _ in items:
+                    self._queue.task_done()
+
+    def _skip_cancelled(self):
+        """Move past tickets whose job was cancelled and wake the waiters; call with `_turn` held"""
+        while self._serving in self._cancelled:
+            self._cancelled.discard(self._serving)
+            self._serving += 1
+        self._turn.notify_all()
+
+    def _cancel(self, ticket: int):
+        """Give up a ticket whose job was cancelled, unless the job already started"""
+        with self._turn:
+            if ticket not in self._started and ticket >= self._serving:
+                self._cancelled.add(ticket)
+                self._skip_cancelled()
+
+    def _convert(self, payloads: List[dict]) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        """(device_ids, epoch-ms timestamps, values) of the well-formed payloads; the rest are counted"""
+        device_ids, timestamps, values = [], [], []
+        for payload in payloads:
+            try:
+                device_id = str(payload["device_id"])
+                timestamp = to_epoch_ms(payload["timestamp"])
+                value = float(payload["value"])
+            except (KeyError, TypeError, ValueError) as e:
+                self.invalid += 1
+                logger.warning(f"Dropped invalid payload {payload!r}: {str(e)}")
+                continue
+            device_ids.append(device_id)
+            timestamps.append(timestamp)
+            values.append(value)
+        return device_ids, np.asarray(timestamps, dtype=np.int64), np.asarray(values, dtype=np.float64)
+
+    def process(self, payloads: List[dict], ticket: Optional[int] = None) -> int:
+        """Store a batch of validated payloads and flag anomalies.
+
+        The write buffer feeds what the store accepts to the online models, so
+        duplicates and late readings it drops are not counted twice.
+
+        Returns how many payloads were well-formed enough to store. The batch
+        waits for its ticket's turn, but only the turn itself is taken under
+        the lock; however the batch ends, its ticket is served.
+        """
+        if ticket is None:
+            ticket = next(self._tickets)
+        with self._turn:
+            # Cancelled, and possibly already skipped past
+            if ticket in self._cancelled or ticket < self._serving:
+                return 0
+            self._started.add(ticket)
+        try:
+            device_ids, timestamps, values = self._convert(payloads)
+            with self._turn:
+                self._turn.wait_for(lambda: self._serving == ticket)
+            if not device_ids:
+                return 0
+            write_buffer.write_points([
+                {
+                    "measurement": "energy_consumption",
+                    "tags": {"device_id": device_id},
+                    "fields": {"value": value},
+                    "time": timestamp,
+                }
+                for device_id, timestamp, value in zip(device_ids, timestamps.tolist(), values.tolist())
+            ])
+            save_anomalies(anomaly_detector.update(device_ids, timestamps, values))
+            return len(device_ids)
+        finally:
+            with self._turn:
+                self._turn.wait_for(lambda: self._serving == ticket)
+                self._started.discard(ticket)
+                self._serving += 1
+                self._skip_cancelled()
+
+    def stats(self) -> dict:
+        return {
+            "policy": self.policy,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "queue_capacity": self.queue_size,
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "invalid": self.invalid,
+            "errors": self.errors,
+            "lag_seconds": self.last_lag,
+            "queue_wait_seconds": self.queue_wait.snapshot(),
+            "batch_size": self.batch_size.snapshot(),
+        }
+
+ingest_service = IngestService(
+    queue_size=settings.INGEST_QUEUE_SIZE,
+    workers=settings.INGEST_WORKERS,
+    policy=settings.INGEST_QUEUE_POLICY,
+    max_batch=settings.INGEST_MAX_BATCH,
+)
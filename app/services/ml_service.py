@@ -1,36 +1,126 @@
 import numpy as np
 from app.core.config import settings
-from functools import lru_cache
+from app.db.influxdb import influx_client, to_epoch_ms
+from app.services.forecaster import HOUR_MS, SLOTS, SeasonalModel, seasonal_forecaster
+from app.services.batching import MicroBatcher
+from app.services.forecast_cache import forecast_cache
+from app.services.model_registry import DEFAULT_MODEL, LoadedModel, model_registry
+from app.services.online_model import online_models
 import logging
-from typing import Optional
-import random
+from typing import Dict, List, Optional, Tuple
 
 logger = logging.getLogger("ml")
 
+def evaluate(model, timestamps: np.ndarray) -> np.ndarray:
+    """Predictions of a fitted or registry model at epoch-ms timestamps"""
+    if isinstance(model, SeasonalModel):
+        return model.predict(timestamps)
+    # Keras models take a one-hot hour-of-week row per timestamp
+    features = np.zeros((len(timestamps), SLOTS), dtype=np.float32)
+    features[np.arange(len(timestamps)), timestamps // HOUR_MS % SLOTS] = 1.0
+    return np.asarray(model.predict(features, verbose=0), dtype=np.float64).reshape(-1)
+
 class MLService:
     def __init__(self):
-        self.model = None
         self.fallback_enabled = True
         self.last_prediction = None
-    
-    @lru_cache(maxsize=1)
-    def load_model(self):
-        try:
-            # Mock model loading for development
-            logger.info("Mock ML model loaded successfully")
-            self.model = "mock_model"
-        except Exception as e:
-            logger.error(f"Model loading failed: {str(e)}")
-            self.model = None
-    
+        # Concurrent predict() calls are answered together, one vectorized evaluation per model
+        self.batcher = MicroBatcher(
+            self.predict_batch,
+            max_batch=settings.ML_BATCH_MAX_SIZE,
+            max_wait=settings.ML_BATCH_MAX_WAIT_MS / 1000,
+            name="predict",
+        )
+
+    @property
+    def model(self) -> Optional[LoadedModel]:
+        return model_registry.get(DEFAULT_MODEL)
+
+    def model_for(self, device_id: str):
+        """The model a device is forecast with, in order of precedence: its own model
+        file (an explicit override); its online profile, unless its packed row is
+        newer; its packed row, while no newer hour of data has arrived; a seasonal
+        fit of its history; a stale packed row; the default model.
+
+        The packed file checkpoints the online and fitted models, so after a
+        restart devices are served from it until their live models catch up.
+        """
+        loaded = model_registry.get(device_id)
+        if loaded is not None:
+            return loaded.model
+        packed = model_registry.packed(device_id)
+        online = online_models.model(device_id)
+        if online is not None and (packed is None or online.fitted_through >= packed.model.fitted_through):
+            return online
+        if packed is not None and not seasonal_forecaster.outdated(device_id, packed.model):
+            return packed.model
+        fitted = seasonal_forecaster.model(device_id)
+        if fitted is not None:
+            return fitted
+        if packed is not None:
+            return packed.model
+        return self.model.model if self.model is not None else None
+
+    def forecast(self, device_id: str, start: int, hours: int) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Hourly (timestamps, values) for `hours` hours from `start`, or None if no model applies.
+
+        Results are cached and shared between callers, so the arrays are read-only.
+        """
+        start = start // HOUR_MS * HOUR_MS
+        device_model = model_registry.get(device_id)
+        packed = model_registry.packed(device_id)
+        watermark = influx_client.watermark(device_id)
+        # Everything model_for's choice and the seasonal fit depend on; the fit only
+        # changes once a newer hour of data arrives
+        key = (
+            device_id, start, hours,
+            device_model.version if device_model is not None else None,
+            packed.version if packed is not None else None,
+            online_models.version(device_id),
+            self.model.version if self.model is not None else None,
+            watermark // HOUR_MS if watermark is not None else None,
+        )
+        return forecast_cache.get_or_compute(key, lambda: self._forecast(device_id, start, hours))
+
+    def _forecast(self, device_id: str, start: int, hours: int) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        model = self.model_for(device_id)
+        if model is None:
+            return None
+        timestamps = start + HOUR_MS * np.arange(hours, dtype=np.int64)
+        values = evaluate(model, timestamps)
+        timestamps.flags.writeable = False
+        values.flags.writeable = False
+        return timestamps, values
+
+    def predict_batch(self, payloads: List[dict]) -> List[object]:
+        """Predictions for {device_id, timestamp} payloads; failed items get their exception"""
+        results: List[object] = [None] * len(payloads)
+        groups: Dict[int, Tuple[object, List[int], List[int]]] = {}
+        for i, payload in enumerate(payloads):
+            try:
+                model = self.model_for(str(payload["device_id"]))
+                if model is None:
+                    raise ValueError(f"No model available for device {payload['device_id']}")
+                timestamp = to_epoch_ms(payload["timestamp"])
+            except Exception as e:
+                results[i] = e
+                continue
+            _, positions, timestamps = groups.setdefault(id(model), (model, [], []))
+            positions.append(i)
+            timestamps.append(timestamp)
+
+        for model, positions, timestamps in groups.values():
+            try:
+                predictions = evaluate(model, np.asarray(timestamps, dtype=np.int64)).tolist()
+            except Exception as e:
+                predictions = [e] * len(positions)
+            for i, prediction in zip(positions, predictions):
+                results[i] = prediction
+        return results
+
     async def predict(self, data: dict) -> Optional[float]:
         try:
-            if not self.model:
-                self.load_model()
-            
-            # Mock prediction for development
-            # In a real scenario, we would use the actual model
-            prediction = random.uniform(0.5, 10.0)
+            prediction = await self.batcher.submit(data)
             self.last_prediction = float(prediction)
             return self.last_prediction
         
@@ -40,4 +130,4 @@ class MLService:
                 return self.last_prediction
             raise
 
-ml_service = MLService()
\ No newline at end of file
+ml_service = MLService()
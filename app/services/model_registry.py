@@ -0,0 +1,267 @@
+from app.core.config import settings
+from app.services.forecaster import SLOTS, SeasonalModel, seasonal_forecaster
+from app.services.online_model import online_models
+from app.services.param_store import PackedModels, index_path, newest_rows, pack, write_packed, write_params
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+import asyncio
+import logging
+import os
+import threading
+import time
+import numpy as np
+
+logger = logging.getLogger("model_registry")
+
+DEFAULT_MODEL = "default"
+MODEL_EXTENSIONS = (".npz", ".h5")
+
+class LoadedModel(NamedTuple):
+    name: str
+    path: str
+    # mtime_ns of the file the model was loaded from; changes on every retrain
+    version: int
+    model: Any
+    loaded_at: float
+
+def load_npz(path: str) -> SeasonalModel:
+    """Seasonal parameters saved with np.savez(levels=..., slope=..., t_ref=...)"""
+    with np.load(path) as data:
+        levels = np.asarray(data["levels"], dtype=np.float64)
+        if levels.shape != (SLOTS,):
+            raise ValueError(f"{path}: expected {SLOTS} hour-of-week levels, got shape {levels.shape}")
+        t_ref = int(data["t_ref"])
+        return SeasonalModel(levels, float(data["slope"]), t_ref, t_ref)
+
+def load_h5(path: str):
+    # Keras is optional; without it .h5 models are skipped rather than failing startup
+    try:
+        from tensorflow import keras
+    except ImportError:
+        try:
+            import keras
+        except ImportError:
+            raise RuntimeError("keras is not installed, cannot load .h5 models")
+    model = keras.models.load_model(path, compile=False)
+    # Build the graph now so the first request doesn't pay for it
+    model.predict(np.zeros((1, SLOTS), dtype=np.float32), verbose=0)
+    return model
+
+LOADERS = {".npz": load_npz, ".h5": load_h5}
+
+def pack_directory(directory: str, path: str) -> int:
+    """Pack every <device_id>.npz seasonal model in `directory` into one parameter file"""
+    device_ids, models = [], []
+    for entry in sorted(os.scandir(directory), key=lambda entry: entry.name):
+        name, ext = os.path.splitext(entry.name)
+        if ext == ".npz" and entry.is_file():
+            device_ids.append(name)
+            models.append(load_npz(entry.path))
+    return write_packed(path, device_ids, models)
+
+class ModelRegistry:
+    """Loads the default model and per-device models and keeps them current.
+
+    The initial load runs in a background executor so startup isn't blocked;
+    `ready` is set once it has finished. Afterwards the files are polled for
+    mtime changes and a changed model is loaded completely before it replaces
+    the old entry, so requests always see either the old or the new model.
+
+    Device models come from individual files in `device_models_dir` and
+    from the packed parameter file at `params_path`, which is
+    memory-mapped rather than read. Every `checkpoint_interval` seconds and
+    on shutdown, the rows of each of `sources` (the fitted and online
+    models) are merged into the packed file, so after a restart every
+    device is served from the mapping until its live models catch up. A
+    device keeps its newest row by fitted_through, with ties going to the
+    later source.
+    """
+
+    def __init__(self, model_path: str, device_models_dir: str, params_path: str, poll_interval: float,
+                 checkpoint_interval: float = 0.0,
+                 sources: Sequence[Callable[[], Tuple[List[str], np.ndarray]]] = ()):
+        self.model_path = model_path
+        self.device_models_dir = device_models_dir
+        self.params_path = params_path
+        self.poll_interval = poll_interval
+        self.checkpoint_interval = checkpoint_interval
+        self.sources = list(sources)
+        self.ready = threading.Event()
+        self._models: Dict[str, LoadedModel] = {}
+        # LoadedModel whose model is the PackedModels of params_path
+        self._packed: Optional[LoadedModel] = None
+        self._failed: Dict[str, int] = {}
+        # Serialises refreshes and checkpoints of the packed file
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+        self.loads = 0
+        self.load_errors = 0
+        self.checkpoints = 0
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="model-registry")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            await asyncio.get_running_loop().run_in_executor(None, self.checkpoint)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        await loop.run_in_executor(None, self.refresh)
+        self.ready.set()
+        logger.info(f"Model registry ready with {len(self._models)} models in {time.perf_counter() - started:.3f}s")
+        last_checkpoint = time.monotonic()
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await loop.run_in_executor(None, self.refresh)
+                if self.checkpoint_interval and time.monotonic() - last_checkpoint >= self.checkpoint_interval:
+                    await loop.run_in_executor(None, self.checkpoint)
+                    last_checkpoint = time.monotonic()
+            except Exception as e:
+                logger.error(f"Model refresh failed: {str(e)}")
+
+    def _files(self) -> Dict[str, Tuple[str, int]]:
+        """name -> (path, mtime_ns) of every model file currently on disk"""
+        files = {}
+        if os.path.isfile(self.model_path):
+            files[DEFAULT_MODEL] = (self.model_path, os.stat(self.model_path).st_mtime_ns)
+        if os.path.isdir(self.device_models_dir):
+            for entry in os.scandir(self.device_models_dir):
+                name, ext = os.path.splitext(entry.name)
+                if ext in MODEL_EXTENSIONS and entry.is_file():
+                    files[name] = (entry.path, entry.stat().st_mtime_ns)
+        return files
+
+    def refresh(self) -> int:
+        """Load new or changed model files and drop deleted ones; returns models (re)loaded"""
+        files = self._files()
+        loaded = 0
+        for name, (path, version) in files.items():
+            current = self._models.get(name)
+            if current is not None and current.version == version and current.path == path:
+                continue
+            if self._failed.get(path) == version:
+                continue
+            try:
+                model = LOADERS[os.path.splitext(path)[1]](path)
+            except Exception as e:
+                # Keep serving the previous version until a loadable file appears
+                self.load_errors += 1
+                self._failed[path] = version
+                logger.error(f"Failed to load model {path}: {str(e)}")
+                continue
+            self._models[name] = LoadedModel(name, path, version, model, time.time())
+            self._failed.pop(path, None)
+            self.loads += 1
+            loaded += 1
+            logger.info(f"Loaded model {name} from {path}")
+
+        for name in [name for name in self._models if name not in files]:
+            logger.info(f"Model file for {name} removed, unloading")
+            del self._models[name]
+        with self._lock:
+            return loaded + self._refresh_packed()
+
+    def _refresh_packed(self) -> int:
+        if not self.params_path or not os.path.isfile(self.params_path) or not os.path.isfile(index_path(self.params_path)):
+            if self._packed is not None:
+                logger.info(f"Packed parameter file {self.params_path} removed, unloading")
+                self._packed = None
+            return 0
+        # The index is replaced last, so its mtime versions the pair
+        version = os.stat(index_path(self.params_path)).st_mtime_ns
+        if self._packed is not None and self._packed.version == version:
+            return 0
+        if self._failed.get(self.params_path) == version:
+            return 0
+        try:
+            packed = PackedModels(self.params_path)
+        except Exception as e:
+            self.load_errors += 1
+            self._failed[self.params_path] = version
+            logger.error(f"Failed to load packed parameters {self.params_path}: {str(e)}")
+            return 0
+        self._packed = LoadedModel("packed", self.params_path, packed.version, packed, time.time())
+        self._failed.pop(self.params_path, None)
+        self.loads += 1
+        logger.info(f"Mapped {len(packed)} device models from {self.params_path}")
+        return 1
+
+    def checkpoint(self) -> int:
+        """Merge the sources' models into the packed file and map it; returns rows written"""
+        if not self.params_path or not self.sources:
+            return 0
+        started = time.perf_counter()
+        with self._lock:
+            self._refresh_packed()
+            packed = self._packed
+            merged = [(packed.model.device_ids, packed.model.params)] if packed is not None else []
+            merged += [source() for source in self.sources]
+            device_ids, params = newest_rows(merged)
+            if not device_ids:
+                return 0
+            written = write_params(self.params_path, device_ids, params)
+            self._refresh_packed()
+        self.checkpoints += 1
+        logger.info(f"Checkpointed {written} device models to {self.params_path} in {time.perf_counter() - started:.3f}s")
+        return written
+
+    def get(self, name: str = DEFAULT_MODEL) -> Optional[LoadedModel]:
+        """The default model or a device's individual model file"""
+        return self._models.get(name)
+
+    def packed(self, device_id: str) -> Optional[LoadedModel]:
+        """A device's row of the packed parameter file"""
+        packed = self._packed
+        model = packed.model.get(device_id) if packed is not None else None
+        if model is None:
+            return None
+        return LoadedModel(device_id, packed.path, packed.version, model, packed.loaded_at)
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready.is_set(),
+            "models": {
+                name: {"path": entry.path, "version": entry.version, "loaded_at": entry.loaded_at}
+                for name, entry in list(self._models.items())
+            },
+            "packed": None if self._packed is None else {
+                "path": self._packed.path,
+                "version": self._packed.version,
+                "devices": len(self._packed.model),
+                "loaded_at": self._packed.loaded_at,
+            },
+            "loads": self.loads,
+            "load_errors": self.load_errors,
+            "checkpoints": self.checkpoints,
+        }
+
+def _fitted_params() -> Tuple[List[str], np.ndarray]:
+    models = seasonal_forecaster.models()
+    return list(models), pack(list(models.values()))
+
+model_registry = ModelRegistry(
+    model_path=settings.ML_MODEL_PATH,
+    device_models_dir=settings.ML_DEVICE_MODELS_DIR,
+    params_path=settings.ML_DEVICE_PARAMS_PATH,
+    poll_interval=settings.ML_MODEL_POLL_SECONDS,
+    checkpoint_interval=settings.ML_DEVICE_PARAMS_CHECKPOINT_SECONDS,
+    # Least to most preferred when two rows of a device were fitted through the same hour
+    sources=[_fitted_params, online_models.params],
+)
+
+if __name__ == "__main__":
+    # Offline migration: pack a directory of per-device .npz models into the parameter file
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Pack <device_id>.npz seasonal models into one parameter file")
+    parser.add_argument("directory", nargs="?", default=settings.ML_DEVICE_MODELS_DIR)
+    parser.add_argument("--output", default=settings.ML_DEVICE_PARAMS_PATH)
+    args = parser.parse_args()
+    print(f"Packed {pack_directory(args.directory, args.output)} models into {args.output}")
@@ -0,0 +1,271 @@
+from app.core.config import settings
+from app.services.forecaster import HOUR_MS, SLOTS, SeasonalModel, _nanmean
+from app.services.param_store import FITTED_THROUGH_COLUMN, PARAM_COLUMNS, T_REF_COLUMN, load_columns, write_columns
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import logging
+import os
+import threading
+import time
+import numpy as np
+
+logger = logging.getLogger("online_model")
+
+STATE_COLUMNS = ("levels", "seen", "hours", "open_hour", "open_sum", "open_count")
+
+def _fill(levels: np.ndarray, seen: np.ndarray) -> np.ndarray:
+    """Levels with unseen slots taking that hour of day across the week, then the row mean"""
+    n = len(levels)
+    levels = np.where(seen > 0, levels, np.nan)
+    with np.errstate(invalid="ignore"):
+        levels = levels.reshape(n, 7, 24)
+        levels = np.where(np.isnan(levels), _nanmean(levels, axis=1), levels).reshape(n, SLOTS)
+        return np.where(np.isnan(levels), _nanmean(levels, axis=1), levels)
+
+class OnlineSeasonalModels:
+    """Per-device hour-of-week averages updated incrementally from ingest.
+
+    The write buffer hands the readings the store accepted to `observe()`,
+    which only buffers them; a background task applies the buffer every
+    `update_interval` seconds.
+    Readings are averaged per device-hour, and when a newer hour starts
+    the finished hour updates its hour-of-week slot: a plain running mean
+    for the first readings of a slot, then an exponential average with
+    weight `alpha` so the profile follows seasonal drift. Readings for
+    hours already closed are ignored. All devices' state lives in flat
+    arrays and is checkpointed to the directory `path` every
+    `checkpoint_interval` seconds and on shutdown, one .npy file per array.
+    At startup those files are memory-mapped copy-on-write, so the models
+    survive restarts without a retrain or a full read. The served profiles
+    are also checkpointed into the packed parameter file by the model
+    registry (see `params`).
+    """
+
+    def __init__(self, path: str, alpha: float, min_hours: int, update_interval: float, checkpoint_interval: float):
+        self.path = path
+        self.alpha = alpha
+        self.min_hours = min_hours
+        self.update_interval = update_interval
+        self.checkpoint_interval = checkpoint_interval
+        self._rows: Dict[str, int] = {}
+        self._levels = np.zeros((0, SLOTS))
+        self._seen = np.zeros((0, SLOTS), dtype=np.int64)
+        # Completed hours per device, bumped on every update so callers can key caches on it
+        self._hours = np.zeros(0, dtype=np.int64)
+        self._open_hour = np.zeros(0, dtype=np.int64)
+        self._open_sum = np.zeros(0)
+        self._open_count = np.zeros(0, dtype=np.int64)
+        self._lock = threading.Lock()
+        self._pending: List[tuple] = []
+        self._pending_lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._dirty = False
+
+        self.readings = 0
+        self.hours_applied = 0
+        self.checkpoints = 0
+        self.errors = 0
+
+    async def start(self):
+        if self._task is None:
+            await asyncio.get_running_loop().run_in_executor(None, self.load)
+            self._task = asyncio.create_task(self._run(), name="online-models")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self.apply)
+            await loop.run_in_executor(None, self.checkpoint)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        last_checkpoint = time.monotonic()
+        while True:
+            await asyncio.sleep(self.update_interval)
+            try:
+                await loop.run_in_executor(None, self.apply)
+                if time.monotonic() - last_checkpoint >= self.checkpoint_interval:
+                    await loop.run_in_executor(None, self.checkpoint)
+                    last_checkpoint = time.monotonic()
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Online model update failed: {str(e)}")
+
+    def observe(self, device_ids: List[str], timestamps: np.ndarray, values: np.ndarray):
+        """Queue readings for the next update; cheap enough for the ingest path"""
+        with self._pending_lock:
+            self._pending.append((device_ids, timestamps, values))
+
+    def _grow(self, device_ids: List[str]) -> np.ndarray:
+        for device_id in device_ids:
+            if device_id not in self._rows:
+                self._rows[device_id] = len(self._rows)
+        extra = len(self._rows) - len(self._hours)
+        if extra > 0:
+            extra = max(extra, len(self._hours))
+            self._levels = np.concatenate([self._levels, np.zeros((extra, SLOTS))])
+            self._seen = np.concatenate([self._seen, np.zeros((extra, SLOTS), dtype=np.int64)])
+            self._hours = np.concatenate([self._hours, np.zeros(extra, dtype=np.int64)])
+            self._open_hour = np.concatenate([self._open_hour, np.full(extra, -1, dtype=np.int64)])
+            self._open_sum = np.concatenate([self._open_sum, np.zeros(extra)])
+            self._open_count = np.concatenate([self._open_count, np.zeros(extra, dtype=np.int64)])
+        return np.fromiter((self._rows[d] for d in device_ids), dtype=np.int64, count=len(device_ids))
+
+    def apply(self) -> int:
+        """Fold buffered readings into the models; returns device-hours completed"""
+        with self._pending_lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return 0
+        device_ids = [device_id for batch in pending for device_id in batch[0]]
+        timestamps = np.concatenate([batch[1] for batch in pending])
+        values = np.concatenate([batch[2] for batch in pending])
+
+        with self._lock:
+            rows = self._grow(device_ids)
+            hours = timestamps // HOUR_MS
+            keep = hours >= self._open_hour[rows]
+            rows, hours, values = rows[keep], hours[keep], values[keep]
+            order = np.lexsort((hours, rows))
+            rows, hours, values = rows[order], hours[order], values[order]
+            if not len(rows):
+                return 0
+
+            # One group per (device, hour), with the device's open hour merged into its group
+            starts = np.flatnonzero(np.r_[True, (rows[1:] != rows[:-1]) | (hours[1:] != hours[:-1])])
+            g_rows, g_hours = rows[starts], hours[starts]
+            g_sums = np.add.reduceat(values, starts)
+            g_counts = np.diff(np.r_[starts, len(rows)])
+            merged = g_hours == self._open_hour[g_rows]
+            g_sums[merged] += self._open_sum[g_rows[merged]]
+            g_counts[merged] += self._open_count[g_rows[merged]]
+
+            # Open hours superseded by a newer hour are complete too
+            touched = np.unique(g_rows)
+            closing = touched[(self._open_count[touched] > 0) & ~np.isin(touched, g_rows[merged])]
+            g_rows = np.r_[closing, g_rows]
+            g_hours = np.r_[self._open_hour[closing], g_hours]
+            g_sums = np.r_[self._open_sum[closing], g_sums]
+            g_counts = np.r_[self._open_count[closing], g_counts]
+            order = np.lexsort((g_hours, g_rows))
+            g_rows, g_hours, g_sums, g_counts = g_rows[order], g_hours[order], g_sums[order], g_counts[order]
+
+            # Each device's newest hour stays open; everything before it is complete
+            last = np.r_[g_rows[1:] != g_rows[:-1], True]
+            self._open_hour[g_rows[last]] = g_hours[last]
+            self._open_sum[g_rows[last]] = g_sums[last]
+            self._open_count[g_rows[last]] = g_counts[last]
+
+            done = ~last
+            c_rows, c_slots = g_rows[done], g_hours[done] % SLOTS
+            c_means = g_sums[done] / g_counts[done]
+            firsts = np.flatnonzero(np.r_[True, c_rows[1:] != c_rows[:-1]]) if len(c_rows) else np.zeros(0, dtype=np.int64)
+            rank = np.arange(len(c_rows)) - np.repeat(firsts, np.diff(np.r_[firsts, len(c_rows)]))
+            # Round k applies every device's k-th completed hour, so a device's hours stay in order
+            for k in range(int(rank.max()) + 1 if len(rank) else 0):
+                sel = rank == k
+                r, s = c_rows[sel], c_slots[sel]
+                seen = self._seen[r, s] + 1
+                weight = np.maximum(1.0 / seen, self.alpha)
+                self._levels[r, s] += weight * (c_means[sel] - self._levels[r, s])
+                self._seen[r, s] = seen
+            np.add.at(self._hours, c_rows, 1)
+
+            self.readings += len(device_ids)
+            self.hours_applied += len(c_rows)
+            self._dirty = True
+        return len(c_rows)
+
+    def version(self, device_id: str) -> Optional[int]:
+        row = self._rows.get(device_id)
+        return None if row is None else int(self._hours[row])
+
+    def model(self, device_id: str) -> Optional[SeasonalModel]:
+        """The device's profile as a trend-free SeasonalModel, once it has `min_hours` completed hours"""
+        with self._lock:
+            row = self._rows.get(device_id)
+            if row is None or self._hours[row] < max(self.min_hours, 1):
+                return None
+            levels, seen = self._levels[row:row + 1].copy(), self._seen[row:row + 1].copy()
+            fitted_through = int(self._open_hour[row]) * HOUR_MS
+        return SeasonalModel(_fill(levels, seen)[0], 0.0, fitted_through, fitted_through)
+
+    def params(self) -> Tuple[List[str], np.ndarray]:
+        """(device_ids, packed parameter rows) of every device `model()` would serve"""
+        with self._lock:
+            device_ids = np.array(list(self._rows), dtype=object)
+            n = len(device_ids)
+            ready = np.flatnonzero(self._hours[:n] >= max(self.min_hours, 1))
+            levels, seen = self._levels[ready], self._seen[ready]
+            fitted_through = self._open_hour[ready] * HOUR_MS
+        params = np.zeros((len(ready), PARAM_COLUMNS))
+        params[:, :SLOTS] = _fill(levels, seen)
+        params[:, T_REF_COLUMN] = fitted_through
+        params[:, FITTED_THROUGH_COLUMN] = fitted_through
+        return device_ids[ready].tolist(), params
+
+    def checkpoint(self) -> bool:
+        """Write all state under `path` atomically per file; returns False if there was nothing new"""
+        if not self.path:
+            return False
+        with self._lock:
+            if not self._dirty:
+                return False
+            n = len(self._rows)
+            device_ids = list(self._rows)
+            state = {
+                "levels": self._levels[:n].copy(),
+                "seen": self._seen[:n].copy(),
+                "hours": self._hours[:n].copy(),
+                "open_hour": self._open_hour[:n].copy(),
+                "open_sum": self._open_sum[:n].copy(),
+                "open_count": self._open_count[:n].copy(),
+            }
+            self._dirty = False
+        write_columns(self.path, device_ids, state)
+        self.checkpoints += 1
+        return True
+
+    def load(self) -> int:
+        """Map the last checkpoint, if any; returns devices loaded"""
+        if not self.path or not os.path.isfile(os.path.join(self.path, "index.npy")):
+            return 0
+        try:
+            device_ids, state = load_columns(self.path, STATE_COLUMNS)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Failed to load online model checkpoint {self.path}: {str(e)}")
+            return 0
+        with self._lock:
+            self._rows = {device_id: row for row, device_id in enumerate(device_ids)}
+            self._levels = state["levels"]
+            self._seen = state["seen"]
+            self._hours = state["hours"]
+            self._open_hour = state["open_hour"]
+            self._open_sum = state["open_sum"]
+            self._open_count = state["open_count"]
+        logger.info(f"Mapped online models for {len(self._rows)} devices from {self.path}")
+        return len(self._rows)
+
+    def stats(self) -> dict:
+        with self._pending_lock:
+            pending = sum(len(batch[0]) for batch in self._pending)
+        return {
+            "devices": len(self._rows),
+            "pending_readings": pending,
+            "readings": self.readings,
+            "hours_applied": self.hours_applied,
+            "checkpoints": self.checkpoints,
+            "errors": self.errors,
+        }
+
+online_models = OnlineSeasonalModels(
+    path=settings.ONLINE_MODEL_PATH,
+    alpha=settings.ONLINE_MODEL_ALPHA,
+    min_hours=settings.FORECAST_MIN_HOURS,
+    update_interval=settings.ONLINE_MODEL_UPDATE_SECONDS,
+    checkpoint_interval=settings.ONLINE_MODEL_CHECKPOINT_SECONDS,
+)
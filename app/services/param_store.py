@@ -0,0 +1,137 @@
+"""Packed parameter file holding many devices' seasonal models.
+
+Layout: ``<name>.npy`` is a float64 matrix with one row per device::
+
+    levels[168] | slope | t_ref | fitted_through
+
+and ``<name>.index.npy`` holds the device ids in row order. The matrix is
+memory-mapped, so opening the file costs the same for ten devices or a
+hundred thousand, and a device's model is a view of its row.
+
+Writers replace the matrix first and the index last, so the index's mtime
+versions a complete pair; see PackedModels for how readers check it.
+"""
+from app.services.forecaster import SLOTS, SeasonalModel
+from typing import Dict, List, Optional, Sequence, Tuple
+import os
+import numpy as np
+
+SLOPE_COLUMN = SLOTS
+T_REF_COLUMN = SLOTS + 1
+FITTED_THROUGH_COLUMN = SLOTS + 2
+PARAM_COLUMNS = SLOTS + 3
+
+def index_path(path: str) -> str:
+    return f"{os.path.splitext(path)[0]}.index.npy"
+
+def _save(path: str, array: np.ndarray):
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        np.save(f, array, allow_pickle=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def pack(models: Sequence[SeasonalModel]) -> np.ndarray:
+    """Parameter rows for models, in the packed layout"""
+    params = np.zeros((len(models), PARAM_COLUMNS), dtype="<f8")
+    for row, model in enumerate(models):
+        params[row, :SLOTS] = model.levels
+        params[row, SLOPE_COLUMN] = model.slope
+        # Epoch ms fit in a float64 exactly
+        params[row, T_REF_COLUMN] = model.t_ref
+        params[row, FITTED_THROUGH_COLUMN] = model.fitted_through
+    return params
+
+def write_params(path: str, device_ids: Sequence[str], params: np.ndarray) -> int:
+    """Write parameter rows to a packed file, matrix first and index last; returns rows written"""
+    if params.shape != (len(device_ids), PARAM_COLUMNS):
+        raise ValueError(f"expected {len(device_ids)} x {PARAM_COLUMNS} parameters, got shape {params.shape}")
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    _save(path, np.ascontiguousarray(params, dtype="<f8"))
+    _save(index_path(path), np.array(device_ids, dtype=str))
+    return len(device_ids)
+
+def write_packed(path: str, device_ids: List[str], models: List[SeasonalModel]) -> int:
+    """Write models to a packed parameter file; returns rows written"""
+    return write_params(path, device_ids, pack(models))
+
+def newest_rows(sources: Sequence[Tuple[Sequence[str], np.ndarray]]) -> Tuple[List[str], np.ndarray]:
+    """Merge (device_ids, params) sources into one row per device.
+
+    A device keeps the row with the latest fitted_through; on a tie the
+    later source wins, so sources go from least to most preferred.
+    """
+    device_ids = [device_id for ids, _ in sources for device_id in ids]
+    if not device_ids:
+        return [], np.zeros((0, PARAM_COLUMNS))
+    params = np.concatenate([np.asarray(rows, dtype=np.float64).reshape(-1, PARAM_COLUMNS) for _, rows in sources])
+    names, codes = np.unique(np.array(device_ids, dtype=str), return_inverse=True)
+    order = np.lexsort((np.arange(len(codes)), params[:, FITTED_THROUGH_COLUMN], codes))
+    last = order[np.r_[codes[order][1:] != codes[order][:-1], True]]
+    return names.tolist(), params[last]
+
+def write_columns(directory: str, device_ids: Sequence[str], columns: Dict[str, np.ndarray]) -> int:
+    """Write per-device state arrays as <directory>/<name>.npy, then the index; returns rows written"""
+    os.makedirs(directory, exist_ok=True)
+    for name, column in columns.items():
+        if len(column) != len(device_ids):
+            raise ValueError(f"{name}: {len(column)} rows for {len(device_ids)} device ids")
+        _save(os.path.join(directory, f"{name}.npy"), np.ascontiguousarray(column))
+    _save(os.path.join(directory, "index.npy"), np.array(device_ids, dtype=str))
+    return len(device_ids)
+
+def load_columns(directory: str, names: Sequence[str]) -> Tuple[List[str], Dict[str, np.ndarray]]:
+    """Map arrays written by write_columns copy-on-write: writable, paged in lazily, never written back"""
+    path = os.path.join(directory, "index.npy")
+    version = os.stat(path).st_mtime_ns
+    device_ids = np.load(path, allow_pickle=False).tolist()
+    columns = {}
+    for name in names:
+        column_path = os.path.join(directory, f"{name}.npy")
+        columns[name] = np.load(column_path, mmap_mode="c", allow_pickle=False)
+        if len(columns[name]) != len(device_ids) or os.stat(column_path).st_mtime_ns > version:
+            raise ValueError(f"{column_path}: does not match {path}")
+    return device_ids, columns
+
+class PackedModels:
+    """Read-only, memory-mapped view of a packed parameter file.
+
+    The index is read before the matrix is mapped, and the pair is only
+    accepted if neither file was replaced meanwhile and the matrix is no
+    newer than the index. A reader that catches a writer between its two
+    replaces therefore fails and retries at the next poll instead of
+    pairing a matrix with the wrong index.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.version = os.stat(index_path(path)).st_mtime_ns
+        device_ids = np.load(index_path(path), allow_pickle=False)
+        self.params = np.load(path, mmap_mode="r", allow_pickle=False)
+        if os.stat(index_path(path)).st_mtime_ns != self.version or os.stat(path).st_mtime_ns > self.version:
+            raise ValueError(f"{path}: rewritten while loading")
+        if self.params.ndim != 2 or self.params.shape[1] != PARAM_COLUMNS:
+            raise ValueError(f"{path}: expected {PARAM_COLUMNS} parameter columns, got shape {self.params.shape}")
+        if len(device_ids) != len(self.params):
+            raise ValueError(f"{path}: {len(device_ids)} device ids for {len(self.params)} parameter rows")
+        self.device_ids: List[str] = device_ids.tolist()
+        self.rows: Dict[str, int] = {device_id: row for row, device_id in enumerate(self.device_ids)}
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __contains__(self, device_id: str) -> bool:
+        return device_id in self.rows
+
+    def get(self, device_id: str) -> Optional[SeasonalModel]:
+        row = self.rows.get(device_id)
+        if row is None:
+            return None
+        params = np.asarray(self.params[row])
+        return SeasonalModel(
+            params[:SLOTS], float(params[SLOPE_COLUMN]),
+            int(params[T_REF_COLUMN]), int(params[FITTED_THROUGH_COLUMN]),
+        )
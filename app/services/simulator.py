@@ -0,0 +1,172 @@
+from app.core.config import settings
+from datetime import datetime
+from typing import Awaitable, Callable, List, Optional, Tuple
+import asyncio
+import logging
+import time
+import numpy as np
+
+logger = logging.getLogger("simulator")
+
+class FleetSimulator:
+    """Synthetic meter fleet producing readings in vectorized NumPy batches.
+
+    Every device reports at `hz` on its own phase offset. Values follow the
+    same day-peaking curve as the mock energy-data route, scaled per device
+    and with Gaussian noise. A batch can be a burst (rate multiplied by
+    `burst_factor`), and a fraction of readings is delivered late
+    (out-of-order) or twice (duplicates) to exercise the ingest path.
+    """
+
+    def __init__(
+        self,
+        devices: int,
+        hz: float,
+        burst_probability: float = 0.0,
+        burst_factor: float = 10.0,
+        out_of_order_ratio: float = 0.0,
+        duplicate_ratio: float = 0.0,
+        max_delay_seconds: float = 60.0,
+        seed: Optional[int] = None,
+        device_prefix: str = "device",
+    ):
+        self.rng = np.random.default_rng(seed)
+        self.hz = hz
+        self.burst_probability = burst_probability
+        self.burst_factor = burst_factor
+        self.out_of_order_ratio = out_of_order_ratio
+        self.duplicate_ratio = duplicate_ratio
+        self.max_delay_ms = max_delay_seconds * 1000
+        self.device_ids = np.array([f"{device_prefix}{i + 1}" for i in range(devices)], dtype=object)
+
+        # Per-device load scale and reporting phase so meters don't move in lockstep
+        self.scale = self.rng.uniform(0.5, 1.5, devices)
+        self.phase = self.rng.uniform(0.0, 1.0, devices)
+        self.utc_offset_ms = datetime.now().astimezone().utcoffset().total_seconds() * 1000
+
+        self.generated = 0
+        self.bursts = 0
+        self.out_of_order = 0
+        self.duplicates = 0
+
+    def base_profile(self, timestamps: np.ndarray) -> np.ndarray:
+        """More usage during the day, less at night (peaks at local noon)"""
+        hour = ((timestamps + self.utc_offset_ms) / 3_600_000.0) % 24
+        return 2.0 + 3.0 * (1 - np.abs(hour - 12) / 12)
+
+    def generate(self, start_ms: int, end_ms: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Readings due in [start_ms, end_ms) as (device index, timestamp ms, value) columns"""
+        hz = self.hz
+        if self.burst_probability and self.rng.random() < self.burst_probability:
+            hz *= self.burst_factor
+            self.bursts += 1
+        period = 1000.0 / hz
+        offsets = self.phase * period
+
+        # Per-device tick numbers falling inside the window, laid out as a masked grid
+        first = np.ceil((start_ms - offsets) / period).astype(np.int64)
+        counts = np.ceil((end_ms - offsets) / period).astype(np.int64) - first
+        width = int(counts.max()) if len(counts) else 0
+        steps = np.arange(width)
+        mask = steps[None, :] < counts[:, None]
+        devices = np.broadcast_to(np.arange(len(offsets))[:, None], mask.shape)[mask]
+        timestamps = ((first[:, None] + steps[None, :]) * period + offsets[:, None])[mask]
+
+        values = self.scale[devices] * self.base_profile(timestamps)
+        values = np.maximum(values + self.rng.normal(0.0, 0.25, len(values)), 0.0)
+
+        if self.out_of_order_ratio:
+            late = self.rng.random(len(timestamps)) < self.out_of_order_ratio
+            timestamps[late] -= self.rng.uniform(0, self.max_delay_ms, int(late.sum()))
+            self.out_of_order += int(late.sum())
+
+        if self.duplicate_ratio:
+            dup = np.flatnonzero(self.rng.random(len(timestamps)) < self.duplicate_ratio)
+            devices = np.concatenate([devices, devices[dup]])
+            timestamps = np.concatenate([timestamps, timestamps[dup]])
+            values = np.concatenate([values, values[dup]])
+            self.duplicates += len(dup)
+
+        self.generated += len(timestamps)
+        return devices, timestamps.astype(np.int64), np.round(values, 2)
+
+    def to_payloads(self, devices: np.ndarray, timestamps: np.ndarray, values: np.ndarray) -> List[dict]:
+        """Turn a generated batch into MQTT-style payloads"""
+        return [
+            {"device_id": device_id, "value": value, "timestamp": timestamp}
+            for device_id, timestamp, value in zip(
+                self.device_ids[devices].tolist(), timestamps.tolist(), values.tolist()
+            )
+        ]
+
+    async def run(self, submit: Callable[[List[dict]], Awaitable], tick: float = 1.0,
+                  max_batch: int = 500, duration: Optional[float] = None):
+        """Generate one batch per tick and feed it to `submit` until cancelled"""
+        started = time.time()
+        last = int(started * 1000)
+        while duration is None or time.time() - started < duration:
+            await asyncio.sleep(tick)
+            now = int(time.time() * 1000)
+            payloads = self.to_payloads(*self.generate(last, now))
+            last = now
+            for i in range(0, len(payloads), max_batch):
+                await submit(payloads[i:i + max_batch])
+
+    def stats(self) -> dict:
+        return {
+            "devices": len(self.device_ids),
+            "hz": self.hz,
+            "generated": self.generated,
+            "bursts": self.bursts,
+            "out_of_order": self.out_of_order,
+            "duplicates": self.duplicates,
+        }
+
+fleet_simulator = FleetSimulator(
+    devices=settings.SIMULATOR_DEVICES,
+    hz=settings.SIMULATOR_HZ,
+    burst_probability=settings.SIMULATOR_BURST_PROBABILITY,
+    burst_factor=settings.SIMULATOR_BURST_FACTOR,
+    out_of_order_ratio=settings.SIMULATOR_OUT_OF_ORDER_RATIO,
+    duplicate_ratio=settings.SIMULATOR_DUPLICATE_RATIO,
+    max_delay_seconds=settings.SIMULATOR_MAX_DELAY_SECONDS,
+)
+
+if __name__ == "__main__":
+    # Load test: push a simulated fleet through the real ingest path and report throughput
+    import argparse
+    from app.db.influxdb import influx_client
+    from app.db.write_buffer import write_buffer
+    from app.services.ingest import ingest_service
+
+    parser = argparse.ArgumentParser(description="Drive the ingest pipeline with a synthetic meter fleet")
+    parser.add_argument("--devices", type=int, default=1000)
+    parser.add_argument("--hz", type=float, default=1.0)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--burst-probability", type=float, default=0.0)
+    parser.add_argument("--out-of-order", type=float, default=0.0)
+    parser.add_argument("--duplicates", type=float, default=0.0)
+    args = parser.parse_args()
+
+    simulator = FleetSimulator(
+        devices=args.devices,
+        hz=args.hz,
+        burst_probability=args.burst_probability,
+        out_of_order_ratio=args.out_of_order,
+        duplicate_ratio=args.duplicates,
+    )
+
+    async def main():
+        write_buffer.start()
+        await ingest_service.start()
+        started = time.perf_counter()
+        await simulator.run(ingest_service.submit, max_batch=settings.INGEST_MAX_BATCH, duration=args.seconds)
+        await ingest_service.stop()
+        write_buffer.close()
+        elapsed = time.perf_counter() - started
+        stored = influx_client.stats()["points"]
+        print(f"generated={simulator.generated} stored={stored} "
+              f"elapsed={elapsed:.2f}s rate={stored / elapsed:,.0f} points/s")
+        print(f"ingest={ingest_service.stats()}")
+
+    asyncio.run(main())
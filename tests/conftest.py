@@ -0,0 +1,49 @@
+import os
+
+# Keep the time-series store in memory and skip the background services
+os.environ.setdefault("TSDB_DATA_DIR", "")
+os.environ.setdefault("SIMULATOR_DEVICES", "0")
+os.environ.setdefault("ML_COMPUTE_WORKERS", "0")
+os.environ.setdefault("ONLINE_MODEL_PATH", "")
+os.environ.setdefault("ML_DEVICE_PARAMS_PATH", "")
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from app.core.security import create_access_token
+from app.db import postgres
+from app.db.influxdb import InfluxDB
+from app.main import app
+from app.services import anomaly
+
+@pytest.fixture
+def db(monkeypatch):
+    """Point every session at a fresh in-memory database"""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    postgres.Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    monkeypatch.setattr(postgres, "SessionLocal", SessionLocal)
+    monkeypatch.setattr(anomaly, "SessionLocal", SessionLocal)
+    yield SessionLocal
+    engine.dispose()
+
+@pytest.fixture
+def store(monkeypatch):
+    """Give the routes and services a fresh in-memory time-series store instead of the shared one"""
+    store = InfluxDB()
+    monkeypatch.setattr("app.routes.energy_data.influx_client", store)
+    monkeypatch.setattr("app.services.ml_service.influx_client", store)
+    monkeypatch.setattr("app.services.anomaly_scan.anomaly_scanner.client", store)
+    monkeypatch.setattr("app.services.forecaster.seasonal_forecaster.client", store)
+    return store
+
+@pytest.fixture
+def client(db):
+    # Not entered as a context manager, so startup tasks (MQTT, simulator) don't run
+    return TestClient(app)
+
+@pytest.fixture
+def auth():
+    return {"Authorization": f"Bearer {create_access_token({'sub': 'user-1'})}"}
@@ -0,0 +1,102 @@
+from datetime import datetime, timedelta
+from fastapi.testclient import TestClient
+from app.db.influxdb import from_epoch_ms, to_epoch_ms
+from app.main import app
+from app.models.models import Device
+from app.services.anomaly import save_anomalies
+from app.services.anomaly_scan import classify
+import pytest
+import time
+import numpy as np
+
+def test_detect_anomalies_returns_stored_range(client, db, auth):
+    now = datetime.now().replace(microsecond=0)
+    save_anomalies([
+        {"device_id": device_id, "timestamp": to_epoch_ms(now - timedelta(hours=hours)), "value": 10.0 + hours,
+         "expected": 1.0, "score": 5.0, "confidence": 0.99, "type": "spike"}
+        for device_id, hours in (("a-1", 1), ("a-1", 2), ("a-1", 3), ("a-1", 24 * 30), ("a-2", 1))
+    ])
+
+    response = client.get("/api/ml/anomalies", params={"deviceId": "a-1"}, headers=auth)
+    assert response.status_code == 200
+    body = response.json()
+    # The default range is the last week, oldest first
+    assert [anomaly["value"] for anomaly in body] == [13.0, 12.0, 11.0]
+    assert {anomaly["deviceId"] for anomaly in body} == {"a-1"}
+
+    response = client.get("/api/ml/anomalies", params={"deviceId": "a-1", "limit": 2}, headers=auth)
+    assert [anomaly["value"] for anomaly in response.json()] == [12.0, 11.0]
+
+def _wait(client, auth, job_id):
+    for _ in range(500):
+        job = client.get(f"/api/ml/anomalies/scan/{job_id}", headers=auth).json()
+        if job["status"] not in ("queued", "running"):
+            return job
+        time.sleep(0.01)
+    raise AssertionError("scan did not finish")
+
+def test_scan_flags_a_level_shift_once(client, db, store, auth):
+    session = db()
+    session.add(Device(id="scan-1", name="Meter", type="Smart Meter", location="Home", status="online", user_id="user-1"))
+    session.commit()
+    session.close()
+
+    # 21 days of a daily cycle in 15-minute buckets, stepping up by 3 at 07:00 on day 10, which
+    # leaves the hours before 07:00 mostly at the old level and the rest mostly at the new one
+    rng = np.random.default_rng(0)
+    start = datetime(2024, 1, 1)
+    timestamps = to_epoch_ms(start) + np.arange(21 * 96, dtype=np.int64) * 15 * 60_000
+    values = 5 + 2 * np.sin(2 * np.pi * np.arange(len(timestamps)) / 96) + rng.normal(0, 0.2, len(timestamps))
+    step = 10 * 96 + 28
+    values[step:] += 3
+    store.write_arrays("scan-1", timestamps, values)
+
+    # Scans run as tasks on the app's event loop, which only lives inside the context.
+    # Without deviceIds the scan covers the caller's devices
+    with TestClient(app) as live:
+        response = live.post("/api/ml/anomalies/scan", json={
+            "startDate": start.isoformat(),
+            "endDate": (start + timedelta(days=21)).isoformat(),
+        }, headers=auth)
+        assert response.status_code == 202
+        job = _wait(live, auth, response.json()["jobId"])
+    assert job["status"] == "completed"
+    assert job["devicesTotal"] == 1
+
+    flagged = client.get("/api/ml/anomalies", params={
+        "deviceId": "scan-1", "startDate": start.isoformat(), "endDate": (start + timedelta(days=21)).isoformat(),
+    }, headers=auth).json()
+    patterns = [anomaly for anomaly in flagged if anomaly["type"] == "unusual_pattern"]
+    assert len(patterns) == 1
+    assert abs(datetime.fromisoformat(patterns[0]["timestamp"]) - from_epoch_ms(int(timestamps[step]))) <= timedelta(hours=2)
+    assert len(flagged) <= 3
+
+def test_scan_rejects_too_many_buckets(client, db, auth, monkeypatch):
+    monkeypatch.setattr("app.core.config.settings.BULK_MAX_CELLS", 1000)
+    response = client.post("/api/ml/anomalies/scan", json={
+        "deviceIds": ["a", "b"],
+        "startDate": datetime(2024, 1, 1).isoformat(),
+        "endDate": datetime(2024, 1, 8).isoformat(),
+        "window": "15m",
+    }, headers=auth)
+    assert response.status_code == 400
+
+def test_classify_reports_a_shift_at_a_bucket_with_data():
+    grid = np.arange(6, dtype=np.int64) * 60_000
+    matrix = np.array([[1.0, 1.0, np.nan, 4.0, 4.0, 4.0], [1.0, np.nan, np.nan, np.nan, 1.0, 1.0]])
+    zeros = np.zeros_like(matrix)
+    # Both rows have one run over the threshold peaking in a gap; the second row's run is all gap
+    shift = np.array([[0.0, 4.0, 9.0, 5.0, 0.0, 0.0], [0.0, 0.0, 9.0, 0.0, 0.0, 0.0]])
+    score = np.where(np.isnan(matrix), np.nan, 0.0)
+    scores = {"score": score, "shift": shift, "expected": zeros, "baseline": zeros}
+
+    anomalies = classify(["a", "b"], grid, matrix, scores, threshold=3.0, shift_threshold=3.0)
+    assert [(a["device_id"], a["timestamp"], a["value"]) for a in anomalies] == [("a", 3 * 60_000, 4.0)]
+
+def test_save_anomalies_can_raise(db):
+    bad = [{"device_id": "a-1", "timestamp": 0, "value": float("nan"), "expected": None,
+            "score": None, "confidence": None, "type": None}]
+    # Ingest keeps going past a failed write; a scan needs to know
+    save_anomalies(bad)
+    with pytest.raises(Exception):
+        save_anomalies(bad, raise_errors=True)
@@ -0,0 +1,105 @@
+from app.db.influxdb import from_epoch_ms
+from app.models.models import Device
+import numpy as np
+
+MINUTE = 60_000
+START = 1_600_000_000_000
+
+def _range(timestamps):
+    return {
+        "startDate": from_epoch_ms(int(timestamps[0])).isoformat(),
+        "endDate": from_epoch_ms(int(timestamps[-1])).isoformat(),
+    }
+
+def test_streamed_formats_return_raw_points(client, store, auth, monkeypatch):
+    monkeypatch.setattr("app.core.config.settings.ENERGY_DATA_MAX_POINTS", 100)
+    timestamps = START + np.arange(1000, dtype=np.int64) * MINUTE
+    store.write_arrays("stream-1", timestamps, np.ones(len(timestamps)))
+    params = {"deviceId": "stream-1", **_range(timestamps)}
+
+    for format, header_lines in (("ndjson", 0), ("csv", 1)):
+        response = client.get("/api/energy-data", params={**params, "format": format}, headers=auth)
+        assert response.status_code == 200
+        assert len(response.text.splitlines()) == len(timestamps) + header_lines
+        # Streamed bodies are never rendered whole, so they carry no ETag
+        assert "etag" not in response.headers
+
+    # JSON is downsampled to stay under the point limit
+    response = client.get("/api/energy-data", params=params, headers=auth)
+    assert response.status_code == 200
+    assert len(response.json()) <= 100
+
+def test_json_for_past_range_is_revalidated(client, store, auth):
+    timestamps = START + np.arange(10, dtype=np.int64) * MINUTE
+    store.write_arrays("etag-1", timestamps, np.arange(10, dtype=np.float64))
+    params = {"deviceId": "etag-1", **_range(timestamps)}
+
+    first = client.get("/api/energy-data", params=params, headers=auth)
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+    second = client.get("/api/energy-data", params=params, headers={**auth, "If-None-Match": etag})
+    assert second.status_code == 304
+
+    # Without an endDate the range runs up to now and is never cached
+    live = client.get("/api/energy-data", params={"deviceId": "etag-1"}, headers=auth)
+    assert live.status_code == 200
+    assert "etag" not in live.headers
+
+def test_bulk_defaults_to_the_callers_devices(client, db, store, auth):
+    session = db()
+    session.add_all([
+        Device(id=device_id, name=device_id, type="Smart Meter", location="Home", status="online", user_id=user_id)
+        for device_id, user_id in (("bulk-a", "user-1"), ("bulk-b", "user-1"), ("bulk-other", "user-2"))
+    ])
+    session.commit()
+    session.close()
+    timestamps = START + np.arange(60, dtype=np.int64) * MINUTE
+    for device_id in ("bulk-a", "bulk-b", "bulk-other"):
+        store.write_arrays(device_id, timestamps, np.full(len(timestamps), 2.0))
+
+    response = client.get("/api/energy-data/bulk", params={**_range(timestamps), "window": "1h"}, headers=auth)
+    assert response.status_code == 200
+    body = response.json()
+    assert sorted(body["series"]) == ["bulk-a", "bulk-b"]
+    assert all(value == 2.0 for series in body["series"].values() for value in series if value is not None)
+
+def test_batch_rejects_bad_lines_without_failing_the_upload(client, auth, monkeypatch):
+    submitted = []
+
+    async def submit(payloads):
+        submitted.extend(payloads)
+        return True
+
+    monkeypatch.setattr("app.routes.energy_data.ingest_service.submit", submit)
+    body = b"\n".join([
+        b'{"device_id": "batch-1", "value": 1.5, "timestamp": 1600000000000}',
+        b'{"device_id": "batch-1", "value": 1.5, "timestamp": 99999999999999999999999}',
+        b'{"device_id": "batch-1", "value": NaN, "timestamp": 1600000060000}',
+        b'{"device_id": "batch-1", "value": 1e400, "timestamp": 1600000060000}',
+        b'{"device_id": "batch-1", "value": 1.5, "timestamp": Infinity}',
+        b'{"device_id": "batch-\xff", "value": 1.5, "timestamp": 1600000060000}',
+        b'{"device_id": "batch-1", "value": 2.5, "timestamp": 1600000120000}',
+    ])
+
+    response = client.post("/api/energy-data/batch", content=body, headers={**auth, "Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200
+    result = response.json()
+    assert (result["accepted"], result["rejected"]) == (2, 5)
+    assert [error["line"] for error in result["errors"]] == [2, 3, 4, 5, 6]
+    assert [payload["timestamp"] for payload in submitted] == [1600000000000, 1600000120000]
+
+def test_all_devices_means_the_callers_devices(client, db, store, auth):
+    session = db()
+    session.add_all([
+        Device(id=device_id, name=device_id, type="Smart Meter", location="Home", status="online", user_id=user_id)
+        for device_id, user_id in (("own-1", "user-1"), ("foreign-1", "user-2"))
+    ])
+    session.commit()
+    session.close()
+    timestamps = START + np.arange(5, dtype=np.int64) * MINUTE
+    for device_id in ("own-1", "foreign-1"):
+        store.write_arrays(device_id, timestamps, np.ones(len(timestamps)))
+
+    response = client.get("/api/energy-data", params=_range(timestamps), headers=auth)
+    assert response.status_code == 200
+    assert {row["deviceId"] for row in response.json()} == {"own-1"}
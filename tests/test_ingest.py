@@ -0,0 +1,82 @@
+import asyncio
+import threading
+import time
+import pytest
+from app.services import ingest
+from app.services.ingest import IngestService
+
+class _SlowBuffer:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.batches = []
+        self.fail = False
+
+    def write_points(self, points):
+        time.sleep(self.delay)
+        if self.fail:
+            raise OSError("disk full")
+        self.batches.append([point["time"] for point in points])
+        return len(points)
+
+@pytest.fixture
+def buffer(monkeypatch):
+    buffer = _SlowBuffer()
+    monkeypatch.setattr(ingest, "write_buffer", buffer)
+    monkeypatch.setattr(ingest, "save_anomalies", lambda anomalies: None)
+    return buffer
+
+def _service():
+    return IngestService(queue_size=100, workers=4, policy="block", max_batch=1)
+
+def _reading(timestamp):
+    return {"device_id": "d1", "value": 1.0, "timestamp": timestamp}
+
+def test_failed_batch_still_serves_its_ticket(buffer):
+    service = _service()
+    buffer.fail = True
+    with pytest.raises(OSError):
+        service.process([_reading(500)])
+    buffer.fail = False
+    done = threading.Thread(target=service.process, args=([_reading(1000)],))
+    done.start()
+    done.join(timeout=2)
+    assert not done.is_alive()
+    assert buffer.batches == [[1000]]
+
+def test_out_of_range_timestamp_is_dropped(buffer):
+    service = _service()
+    # Fits a Python int but not the int64 column
+    assert service.process([_reading(10 ** 25), _reading(1000)]) == 1
+    assert service.invalid == 1
+    assert buffer.batches == [[1000]]
+
+def test_cancelled_ticket_is_skipped(buffer):
+    service = _service()
+    cancelled, ticket = next(service._tickets), next(service._tickets)
+    service._cancel(cancelled)
+    assert service.process([_reading(1000)], ticket) == 1
+    # The job of a cancelled ticket stores nothing if it starts anyway
+    assert service.process([_reading(2000)], cancelled) == 0
+    assert buffer.batches == [[1000]]
+
+def test_storage_keeps_queue_order_off_the_event_loop(buffer):
+    buffer.delay = 0.05
+    service = _service()
+
+    async def run():
+        await service.start()
+        loop = asyncio.get_running_loop()
+        worst = 0.0
+        for timestamp in range(1000, 9000, 1000):
+            await service.submit([_reading(timestamp)])
+        while service.processed < 8:
+            tick = loop.time()
+            await asyncio.sleep(0.005)
+            worst = max(worst, loop.time() - tick)
+        await service.stop()
+        return worst
+
+    worst = asyncio.run(run())
+    assert [batch[0] for batch in buffer.batches] == list(range(1000, 9000, 1000))
+    # The loop never waits on a batch being stored
+    assert worst < buffer.delay
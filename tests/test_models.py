@@ -0,0 +1,89 @@
+import os
+import numpy as np
+import pytest
+from app.services.forecaster import HOUR_MS, SLOTS, SeasonalModel
+from app.services.model_registry import ModelRegistry
+from app.services.online_model import OnlineSeasonalModels
+from app.services.param_store import PackedModels, index_path, pack, write_packed
+
+START = 1_700_000_000_000 // HOUR_MS * HOUR_MS
+
+def _online(path, hours=30):
+    models = OnlineSeasonalModels(path, alpha=0.25, min_hours=24, update_interval=1, checkpoint_interval=1)
+    timestamps = START + np.arange(hours * 6, dtype=np.int64) * 600_000
+    models.observe(["m1"] * len(timestamps), timestamps, np.arange(len(timestamps)) % 6 + 1.0)
+    models.apply()
+    return models
+
+def _same(a, b):
+    np.testing.assert_allclose(pack([a]), pack([b]))
+
+def _registry(tmp_path, *sources):
+    return ModelRegistry(
+        str(tmp_path / "default.h5"), str(tmp_path / "devices"), str(tmp_path / "params.npy"),
+        poll_interval=1, sources=sources,
+    )
+
+def test_online_state_round_trips_through_mapped_checkpoint(tmp_path):
+    models = _online(str(tmp_path / "online"))
+    assert models.checkpoint()
+
+    restored = OnlineSeasonalModels(str(tmp_path / "online"), alpha=0.25, min_hours=24, update_interval=1, checkpoint_interval=1)
+    assert restored.load() == 1
+    assert isinstance(restored._levels, np.memmap)
+    _same(restored.model("m1"), models.model("m1"))
+
+    # The mapping is copy-on-write: updates stay in memory until the next checkpoint
+    levels_file = str(tmp_path / "online" / "levels.npy")
+    before = os.stat(levels_file).st_mtime_ns
+    restored.observe(["m1"], np.array([START + 40 * HOUR_MS]), np.array([100.0]))
+    assert restored.apply() == 1
+    assert os.stat(levels_file).st_mtime_ns == before
+
+def test_checkpoint_keeps_the_newest_row_per_device(tmp_path):
+    online = _online("")
+    registry = _registry(tmp_path, online.params)
+    old = SeasonalModel(np.full(SLOTS, 7.0), 0.0, START, START)
+    newer = SeasonalModel(np.full(SLOTS, 9.0), 0.0, START + 100 * HOUR_MS, START + 100 * HOUR_MS)
+    write_packed(registry.params_path, ["m1", "m2"], [old, newer])
+    # The index is written after the matrix and versions the pair
+    assert os.stat(index_path(registry.params_path)).st_mtime_ns >= os.stat(registry.params_path).st_mtime_ns
+
+    assert registry.checkpoint() == 2
+    packed = PackedModels(registry.params_path)
+    _same(packed.get("m1"), online.model("m1"))
+    assert packed.get("m2").levels[0] == 9.0
+    assert registry.packed("m1").version == packed.version
+
+def test_packed_rows_lose_to_newer_live_models(tmp_path, monkeypatch):
+    from app.services import ml_service as ml
+
+    online = _online("")
+    registry = _registry(tmp_path)
+    monkeypatch.setattr(ml, "model_registry", registry)
+    monkeypatch.setattr(ml, "online_models", online)
+    live = online.model("m1")
+
+    # A packed row fitted through a later hour than the online model wins over it...
+    ahead = live.fitted_through + HOUR_MS
+    write_packed(registry.params_path, ["m1"], [SeasonalModel(np.full(SLOTS, 5.0), 0.0, ahead, ahead)])
+    registry.refresh()
+    monkeypatch.setattr(ml.seasonal_forecaster, "outdated", lambda device_id, model: False)
+    assert ml.ml_service.model_for("m1").levels[0] == 5.0
+
+    # ...but an older one, e.g. a checkpoint from before a restart, does not
+    behind = live.fitted_through - HOUR_MS
+    write_packed(registry.params_path, ["m1"], [SeasonalModel(np.full(SLOTS, 5.0), 0.0, behind, behind)])
+    registry.refresh()
+    _same(ml.ml_service.model_for("m1"), live)
+
+def test_reader_rejects_a_matrix_newer_than_its_index(tmp_path):
+    path = str(tmp_path / "params.npy")
+    model = SeasonalModel(np.zeros(SLOTS), 0.0, START, START)
+    write_packed(path, ["a"], [model])
+    # A writer that has replaced the matrix but not yet the index
+    np.save(path, pack([model._replace(slope=1.0)]))
+    index_version = os.stat(index_path(path)).st_mtime_ns
+    os.utime(path, ns=(index_version + 1_000_000_000, index_version + 1_000_000_000))
+    with pytest.raises(ValueError):
+        PackedModels(path)
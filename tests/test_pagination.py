@@ -0,0 +1,45 @@
+from app.models.models import Device
+
+def _add_devices(db, user_id, count):
+    session = db()
+    session.add_all([
+        Device(id=f"dev-{i:02d}", name=f"Meter {i}", type="Smart Meter", location="Home", status="online", user_id=user_id)
+        for i in range(count)
+    ])
+    session.commit()
+    session.close()
+
+def test_devices_pages_through_cursor(client, db, auth):
+    _add_devices(db, "user-1", 5)
+
+    first = client.get("/api/devices", params={"limit": 3}, headers=auth)
+    assert first.status_code == 200
+    page = first.json()
+    assert [device["id"] for device in page["items"]] == ["dev-00", "dev-01", "dev-02"]
+    assert page["next_cursor"]
+
+    second = client.get("/api/devices", params={"limit": 3, "cursor": page["next_cursor"]}, headers=auth)
+    assert second.status_code == 200
+    page = second.json()
+    assert [device["id"] for device in page["items"]] == ["dev-03", "dev-04"]
+    assert page["next_cursor"] is None
+
+def test_devices_rejects_bad_cursor(client, db, auth):
+    response = client.get("/api/devices", params={"limit": 3, "cursor": "not-a-cursor"}, headers=auth)
+    assert response.status_code == 400
+
+def test_alerts_pages_through_cursor(client, db, auth):
+    # An empty account gets five generated alerts
+    first = client.get("/api/alerts", params={"limit": 2}, headers=auth)
+    assert first.status_code == 200
+    page = first.json()
+    seen = [alert["id"] for alert in page["items"]]
+    while page["next_cursor"]:
+        response = client.get("/api/alerts", params={"limit": 2, "cursor": page["next_cursor"]}, headers=auth)
+        assert response.status_code == 200
+        page = response.json()
+        seen += [alert["id"] for alert in page["items"]]
+
+    everything = client.get("/api/alerts", headers=auth).json()
+    assert seen == [alert["id"] for alert in everything]
+    assert len(seen) == 5
@@ -0,0 +1,36 @@
+from app.db.influxdb import DEFAULT_MEASUREMENT, InfluxDB
+from app.db.latest import LatestValues
+from app.db.write_buffer import WriteBuffer
+
+def _point(device_id, timestamp, value):
+    return {"measurement": DEFAULT_MEASUREMENT, "tags": {"device_id": device_id}, "fields": {"value": value}, "time": timestamp}
+
+class _Observer:
+    def __init__(self):
+        self.readings = []
+
+    def observe(self, device_ids, timestamps, values):
+        self.readings.extend(zip(device_ids, timestamps.tolist(), values.tolist()))
+
+def test_latest_values_follow_what_the_store_accepted():
+    client = InfluxDB(lateness_seconds=3600)
+    latest = LatestValues(capacity=16)
+    online = _Observer()
+    buffer = WriteBuffer(client, max_points=1000, max_age=60, latest=latest, online=online)
+    hour = 3_600_000
+    now = 1_700_000_000_000
+
+    buffer.write_points([_point("d1", now, 1.0), _point("d1", now + 1000, 2.0)])
+    buffer.flush()
+    # A duplicate keeps the stored value, and a point past the lateness window is rejected
+    buffer.write_points([_point("d1", now + 1000, 99.0), _point("d1", now - 2 * hour, 5.0), _point("d1", now + 2000, 3.0)])
+    buffer.flush()
+
+    _, blocks = latest.read(["d1"])
+    (device_id, timestamps, values), = blocks
+    stored_timestamps, stored_values = client.query("d1", now - 3 * hour, now + hour)
+    assert device_id == "d1"
+    assert timestamps.tolist() == stored_timestamps.tolist() == [now, now + 1000, now + 2000]
+    assert values.tolist() == stored_values.tolist() == [1.0, 2.0, 3.0]
+    # The online models see each stored reading once
+    assert online.readings == [("d1", now, 1.0), ("d1", now + 1000, 2.0), ("d1", now + 2000, 3.0)]
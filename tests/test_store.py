@@ -0,0 +1,118 @@
+import os
+import numpy as np
+from app.db.influxdb import DEFAULT_MEASUREMENT, InfluxDB
+from app.db.segments import read_manifest
+
+MINUTE = 60_000
+START = 1_600_000_000_000 // (60 * MINUTE) * (60 * MINUTE)
+
+def _open(path, **kwargs):
+    store = InfluxDB(chunk_size=4, lateness_seconds=3600, **kwargs)
+    store.open(str(path))
+    return store
+
+def _crash(store):
+    """Stop the sealer and drop the store without sealing, as a killed process would"""
+    store._stop.set()
+    store._thread.join()
+    store._wal.close()
+
+def _files(path):
+    manifest = read_manifest(str(path))
+    return (
+        manifest,
+        sorted(os.listdir(path / "segments")),
+        sorted(name for name in os.listdir(path) if name.startswith("rollups-")),
+        sorted(os.listdir(path / "wal")),
+    )
+
+def test_write_drops_duplicates_and_late_points():
+    store = InfluxDB(chunk_size=4, lateness_seconds=60)
+    timestamps = START + np.arange(10, dtype=np.int64) * 1000
+    assert store.write_arrays("d1", timestamps, np.ones(10)) == 10
+
+    # A stored timestamp and one repeated within the batch both keep the first value
+    accepted = []
+    written = store.write_arrays("d1", START + np.array([5000, 10_000, 10_000]), np.array([7.0, 2.0, 9.0]),
+                                 accepted=accepted)
+    assert written == 1
+    assert [(ts.tolist(), vs.tolist()) for _, _, ts, vs in accepted] == [([START + 10_000], [2.0])]
+    assert store.duplicates == 2
+
+    # Behind the watermark by more than the lateness window is rejected; inside it is merged in order
+    assert store.write_arrays("d1", np.array([START + 10_000 - 60_001, START + 500]), np.array([3.0, 3.0])) == 1
+    assert store.too_late == 1
+    ts, vs = store.query("d1")
+    assert ts.tolist() == sorted([*timestamps.tolist(), START + 500, START + 10_000])
+    assert vs[ts.tolist().index(START + 5000)] == 1.0
+
+    # Rollups only see accepted points
+    minute = store.query_rollup("d1", "1m")
+    assert (minute["count"].tolist(), minute["sum"].tolist()) == ([12], [15.0])
+
+def test_store_recovers_sealed_and_logged_points_without_close(tmp_path):
+    store = _open(tmp_path)
+    timestamps = START + np.arange(10, dtype=np.int64) * MINUTE
+    store.write_arrays("d1", timestamps, np.arange(10, dtype=np.float64))
+    assert store.seal() == 3
+    assert store.stats()["bytes"] == 0
+    manifest, segments, rollups, wal = _files(tmp_path)
+    assert segments == ["00000001.tseg"] and rollups == ["rollups-00000001.npz"]
+    assert wal == [f"{manifest['wal_gen']:08d}.wal"]
+    segment = (tmp_path / "segments" / segments[0]).read_bytes()
+
+    # A late point lands in a sealed chunk, which is copied off the segment mmap
+    # rather than changed in place; a newer point starts a fresh chunk. Both are
+    # only in the WAL when the process dies
+    store.write_arrays("d1", np.array([START + 30_000, START + 10 * MINUTE]), np.array([0.5, 10.0]))
+    assert store.stats()["bytes"] > 0
+    assert (tmp_path / "segments" / segments[0]).read_bytes() == segment
+    expected = store.query("d1")
+    expected_rollup = store.query_rollup("d1", "1m")
+    _crash(store)
+    # The process died halfway through appending a record
+    with open(tmp_path / "wal" / wal[0], "ab") as f:
+        f.write(b"\x01\x02\x03\x04\x05\x00\x00")
+
+    reopened = _open(tmp_path)
+    try:
+        for got, want in zip(reopened.query("d1"), expected):
+            np.testing.assert_array_equal(got, want)
+        for field, column in reopened.query_rollup("d1", "1m").items():
+            np.testing.assert_array_equal(column, expected_rollup[field])
+        # Replayed points are deduplicated against what the segment already holds
+        assert reopened.count("d1") == 12
+    finally:
+        reopened.close()
+
+def test_compaction_applies_retention_and_removes_unreferenced_files(tmp_path):
+    store = _open(tmp_path)
+    timestamps = START + np.arange(12, dtype=np.int64) * MINUTE
+    # Three seals leave three small segments
+    for part in np.split(np.arange(12), 3):
+        store.write_arrays("d1", timestamps[part], np.ones(len(part)))
+        store.seal()
+    assert len(_files(tmp_path)[1]) == 3
+
+    cutoff = int(timestamps[5])
+    result = store.compact({DEFAULT_MEASUREMENT: cutoff}, {"1m": cutoff})
+    assert result["dropped_points"] == 5
+    assert result["dropped_buckets"] == 5
+    assert result["rewritten_segments"] == 3
+    assert store.query("d1")[0].tolist() == timestamps[5:].tolist()
+
+    # The live blocks were rewritten into one segment, and only what the new
+    # manifest references is left on disk
+    manifest, segments, rollups, wal = _files(tmp_path)
+    assert len(segments) == 1
+    assert segments == sorted({name for entry in manifest["series"] for name, _, _ in entry["blocks"]})
+    assert rollups == [manifest["rollups"]]
+    assert wal == [f"{manifest['wal_gen']:08d}.wal"]
+    _crash(store)
+
+    reopened = _open(tmp_path)
+    try:
+        assert reopened.query("d1")[0].tolist() == timestamps[5:].tolist()
+        assert reopened.query_rollup("d1", "1m")["bucket"].tolist() == timestamps[5:].tolist()
+    finally:
+        reopened.close()